@@ -1,7 +1,18 @@
-from flask import Flask, render_template, flash, redirect, request, jsonify
+from flask import Flask, render_template, flash, redirect, request, jsonify, Response, stream_with_context
 from modules import Property, Owner, Company, OwnerCompany, connect_db, db
 # from admin import SECRET_KEY, DATABASE_URI
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from rankings import top_owners, top_companies, ensure_rankings
+from owner_profile import owner_profile
+from sql_helpers import create_missing_indexes
+from search import search, ensure_search_index, SEARCH_LIMIT
+from response_cache import cached_response
+from typeahead import typeahead, start_typeahead_build, TYPEAHEAD_LIMIT
+from exports import export_chunks, EXPORT_TABLES, EXPORT_FORMATS, pyarrow
+from entity_resolution import ensure_owner_entities, owner_entity
+from portfolios import ensure_portfolios, top_portfolios, portfolio, portfolio_members
+from pagination import keyset_page, offset_page, page_size, cached_count, InvalidCursor, PER_PAGE
 import os
 
 app = Flask(__name__)
@@ -14,6 +25,14 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', '1Kn0w@53cr3t')
 app.app_context().push()
 connect_db(app)
 db.create_all()
+create_missing_indexes()
+ensure_rankings()
+ensure_search_index()
+ensure_owner_entities()
+ensure_portfolios()
+# TYPEAHEAD_BUILD=0 turns off the thread that loads and refreshes the autocomplete index, ex: for scripts that drop the tables
+if os.environ.get('TYPEAHEAD_BUILD', '1') != '0':
+    start_typeahead_build(app)
 
 @app.route('/')
 def home():
@@ -48,42 +67,90 @@ def home():
 # RESTFUL JSON API
 # #########################################################
     
+# Read endpoints are @cached_response, cached until the crawler writes, see response_cache.py
+
 # API HELPER FUCTIONS
-def paginate_table_by_page(model, page):
+def paginate_table_by_page(model, page, per_page=PER_PAGE, query=None):
     """
-    Creates a Flask-SQLAlchemy pagination obj based off of an existing Database Model and page.
+    Reads a numbered page of an existing Database Model, kept for clients of the page number endpoints.
     Parameters:
     model (Flask-SQLAlchemy Model Obj) : Must be a model used in the application's database.
     page (int) : Must be a valid page number within the max range.
+    per_page (int) : Rows per page.
+    query (Query) : Rows of model to page through, ex: with eager loads for serialize(), defaults to all of them.
     Returns:
     Dictionary : {"items":[{dict}], "page_nav":{dict}}
     Null : None
     """
-    # Try to create pagination object based off the page_id given
+    # offset_page() returns None when the page is past the last one
+    pag_dict = offset_page(query or model.query, model, page, per_page)
+    if pag_dict is None:
+        return None
+    # Create list of query items as dictionaries
+    items_list = [item.serialize() for item in pag_dict["items"]]
+    return {"items":items_list, "page_nav":pag_dict["page_nav"]}
+
+def list_table(model, key, query=None):
+    """
+    Reads a page of an existing Database Model after the ?cursor= of the previous page and returns it in JSON.
+    Parameters:
+    - model (Flask-SQLAlchemy Model Obj) : Must be a model used in the application's database.
+    - key (str) : JSON key of the items, ex: "owners"
+    - query (Query) : Rows of model to page through, ex: with eager loads for serialize(), defaults to all of them
+    - cursor (str) : next_cursor or prev_cursor of the previous page, first page when missing
+    - per_page (int) : rows per page, default 10, at most 100
+    - count (bool) : count=1 adds the table's row count as "total", cached for a minute
+    Returns:
+    JSON : {key : [{dict}], "page_nav" : {prev_cursor, next_cursor}, *total}
+    """
+    cursor = request.args.get('cursor') or None
+    per_page = page_size(request.args.get('per_page', type=int))
     try:
-        pag_obj = model.query.paginate(page=page, per_page=10)
-    # pag_obj will raise a 404 exception if page exceeds the max pages in the pagination object
-    except:
-        # Will set pag_obj to None for ease of conditional
-        pag_obj = None
-    # In cases where the pagination object didn't raise a 404, we will return the jsonified list of property dicts.
-    if not(pag_obj == None):
-        # Create dictionary that stores adjacent page_id values
-        page_nav = {"prev_page":None, "next_page":None}
-        # Calculate prev_page val if exsits
-        if(pag_obj.has_prev):
-            page_nav['prev_page'] = page - 1
-        # Calculate next_page val if exists
-        if(pag_obj.has_next):
-            page_nav['next_page'] = page + 1
-        # Create list of query items as dictionaries   
-        items_list = [item.serialize() for item in pag_obj.items]
-        # return dictionary of items_list and page_nav
-        return {"items":items_list, "page_nav":page_nav}
-    # Else return None
-    return None
+        paginated_dict = keyset_page(query or model.query, model, cursor, per_page)
+    except InvalidCursor as e:
+        return (jsonify(exceptions={"exception" : str(e)}), 400)
+    response = {key : [item.serialize() for item in paginated_dict["items"]],
+                "page_nav" : paginated_dict["page_nav"]}
+    if request.args.get('count') in ('1', 'true'):
+        response['total'] = cached_count(model)
+    return jsonify(response)
+
+def owner_companies():
+    """OwnerCompany query that loads each row's owner and company with it, OwnerCompany.serialize() reads both."""
+    return OwnerCompany.query.options(joinedload(OwnerCompany.owner), joinedload(OwnerCompany.company))
+
+@app.route('/api/properties')
+@cached_response
+def list_properties():
+    """
+    View function that retrieves a page of properties in id order, starting after the ?cursor= of the previous page.
+    Returns: {"properties" : [{id, address, owner_id, llc_id}, ...], "page_nav" : {prev_cursor, next_cursor}}
+    """
+    return list_table(Property, "properties")
+
+
+@app.route('/api/companies')
+@cached_response
+def list_companies():
+    """
+    View function that retrieves a page of owner/LLC pairs in id order, starting after the ?cursor= of the previous page.
+    Returns: {"companies" : [{id, owner_id, owner_name, company_id, llc_name}, ...], "page_nav" : {prev_cursor, next_cursor}}
+    """
+    return list_table(OwnerCompany, "companies", owner_companies())
+
+
+@app.route('/api/owners')
+@cached_response
+def list_owners():
+    """
+    View function that retrieves a page of owners in id order, starting after the ?cursor= of the previous page.
+    Returns: {"owners" : [{id, full_name, address}, ...], "page_nav" : {prev_cursor, next_cursor}}
+    """
+    return list_table(Owner, "owners")
+
 
 @app.route('/api/properties/<int:page_id>')
+@cached_response
 def get_all_properties(page_id):
     """
     View function that retrieves all properties in the database and returns jsonified list.
@@ -91,7 +158,7 @@ def get_all_properties(page_id):
     hasResults (JSON) : "{"properties" : [{id, address, owner_id, company_id}, ...], "page_nav" : {prev_page, next_page}}"
     noResults (Null) : None
     """
-    paginated_dict = paginate_table_by_page(Property, page_id)
+    paginated_dict = paginate_table_by_page(Property, page_id, page_size(request.args.get('per_page', type=int)))
     # Return JSON if pagination query was successful
     if paginated_dict:
         return jsonify(properties=paginated_dict["items"], 
@@ -101,12 +168,14 @@ def get_all_properties(page_id):
 
 
 @app.route('/api/companies/<int:page_id>')
+@cached_response
 def get_all_companies(page_id):
     """
     View function that retrieves all properties in the database and returns jsonified list.
     Returns: {"companies" : [{id, owner_id, owner_name, company_id, llc_name}, ...], "page_nav" : {prev_page, next_page}} 
     """
-    paginated_dict = paginate_table_by_page(OwnerCompany, page_id)
+    paginated_dict = paginate_table_by_page(OwnerCompany, page_id, page_size(request.args.get('per_page', type=int)),
+                                            owner_companies())
     # Return JSON if pagination query was successful
     if paginated_dict:
         return jsonify(companies=paginated_dict["items"], 
@@ -116,12 +185,13 @@ def get_all_companies(page_id):
 
 
 @app.route('/api/owners/<int:page_id>')
+@cached_response
 def get_all_owners(page_id):
     """
     View Function that retrieves all owners in the database and returns jsonified list.
     Returns: {"owners" : [{id, full_name, address}, ...], "page_nav" : {prev_page, next_page}}
     """
-    paginated_dict = paginate_table_by_page(Owner, page_id)
+    paginated_dict = paginate_table_by_page(Owner, page_id, page_size(request.args.get('per_page', type=int)))
     # Return JSON if pagination query was successful
     if paginated_dict:
         return jsonify(owners=paginated_dict["items"], 
@@ -131,95 +201,154 @@ def get_all_owners(page_id):
 
 
 @app.route('/api/owner/<int:id>')
+@cached_response
 def get_owner(id):
     """
     View function that retieves an owner based on id from the database and returns jsonified data
-    Returns: {"owner" : {id, full_name, address, *llc_name, *property_count, *[properties]}}
-    """
-    def has_company(owner_id):
-        """Helper Function, checks to see if the owner has an associated llc"""
-        result = OwnerCompany.query.get(owner_id)
-        if result == None:
-            return False
-        return True
-    
-    try:
-        # TRY CASE: get owner instance by id
-        owner = Owner.query.get_or_404(id)
-    except Exception as e:
-        # EXCEPT CASE: return jsonified error data. 
-        return (jsonify(exceptions={"exception" : e}), 404)
-    # TRY CASE SUCCEEDS
-    # Create jsonifiable dict containing owner data
-    owner_dict = owner.serialize()
-    # CASE: owner has an llc, llc name added to the owner_dict
-    if has_company(id):
-        company_dict = OwnerCompany.query.get(id).serialize()
-        owner_dict['llc_name'] = company_dict.llc_name
-    else:
-        owner_dict['llc_name'] = None
-    # Using sqlalchemy's func object we can count the number of unique properties that share an owner id.
-    property_count = db.session.query(func.count(Property.id)).filter(Property.owner_id == id).scalar()
-    # CASE: the owner should always have one piece of property associated, 
-    # Otherwise there was a scrapper error and the database's integrity is in question.
-    
-    owner_dict['property_count'] = property_count
-    # Adds list of property addresses owned by owner to the dict
-    properties = [property.address for property in Owner.query.get(id).properties]
-    owner_dict['properties'] = properties
-    
+    Returns: {"owner" : {id, full_name, address, cluster_id, portfolio_id, llc_name, [llc_names], property_count, [properties]}}
+    """
+    # The owner, their LLC names, property count and addresses in one query, see owner_profile.py
+    owner_dict = owner_profile(id)
+    if owner_dict is None:
+        # return jsonified error data.
+        return (jsonify(exceptions={"exception" : f"No owner with id {id}"}), 404)
     return jsonify(owner=owner_dict)
 
+@app.route('/api/entities/<int:cluster_id>')
+@cached_response
+def get_entity(cluster_id):
+    """
+    Retrieves the owners resolved to one entity, the owner detail's cluster_id, and returns them in JSON.
+    Return:
+    JSON : {"entity" : {cluster_id, owners : [{id, full_name, address}, ...]}}
+    """
+    entity = owner_entity(cluster_id)
+    if entity is None:
+        return (jsonify(exceptions={"exception" : f"No entity with id {cluster_id}"}), 404)
+    return jsonify(entity=entity)
+
 @app.route('/api/owners/most')
+@cached_response
 def get_top_owners():
     """
-    Retrieves owners with the most properties from the data base and returns them in JSON.
+    Retrieves owners with the most properties from the precomputed rankings and returns them in JSON.
+    Parameters:
+    - limit (int) : number of owners, default 10, at most 100
     Return:
     JSON : {"owners" : [{id, full_name, property_count}, ...]}
     """
-    q = (db.session.query(Owner.id, Owner.full_name, func.count(Property.id).label('property_count'))
-                .join(Property)
-                .group_by(Owner.id)
-                .order_by(func.count(Property.id).desc())
-                .limit(10))
-    owners = [{"id": o.id, "full_name": o.full_name, "property_count": o.property_count} for o in q]
-    return jsonify(owners=owners)
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(owners=top_owners(max(limit, 1)))
+
+@app.route('/api/companies/most')
+@cached_response
+def get_top_companies():
+    """
+    Retrieves LLCs with the most properties from the precomputed rankings and returns them in JSON.
+    Parameters:
+    - limit (int) : number of LLCs, default 10, at most 100
+    Return:
+    JSON : {"companies" : [{id, llc_name, property_count}, ...]}
+    """
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(companies=top_companies(max(limit, 1)))
+
+@app.route('/api/portfolios/most')
+@cached_response
+def get_top_portfolios():
+    """
+    Retrieves the portfolios, owners connected through their LLCs, with the most properties and returns them in JSON.
+    Parameters:
+    - limit (int) : number of portfolios, default 10, at most 100
+    Return:
+    JSON : {"portfolios" : [{id, name, owner_count, company_count, property_count}, ...]}
+    """
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(portfolios=top_portfolios(max(limit, 1)))
+
+@app.route('/api/portfolios/<int(signed=True):id>')
+@cached_response
+def get_portfolio(id):
+    """
+    Retrieves a portfolio's size, id is the owner detail's portfolio_id (minus the LLC's id for an LLC without owners),
+    and returns it in JSON.
+    Return:
+    JSON : {"portfolio" : {id, name, owner_count, company_count, property_count}}
+    """
+    portfolio_dict = portfolio(id)
+    if portfolio_dict is None:
+        return (jsonify(exceptions={"exception" : f"No portfolio with id {id}"}), 404)
+    return jsonify(portfolio=portfolio_dict)
+
+@app.route('/api/portfolios/<int(signed=True):id>/members')
+@cached_response
+def get_portfolio_members(id):
+    """
+    Retrieves a portfolio's owners and LLCs and returns them in JSON.
+    Return:
+    JSON : {"members" : {portfolio_id, owners : [{id, full_name, cluster_id}, ...], companies : [{id, llc_name}, ...]}}
+    """
+    members = portfolio_members(id)
+    if members is None:
+        return (jsonify(exceptions={"exception" : f"No portfolio with id {id}"}), 404)
+    return jsonify(members=members)
 
 @app.route('/api/search')
+@cached_response
 def search_all_tables():
     """
-    Retrieves likely results from all database tables based on query val and returns JSON
+    Retrieves likely results from all database tables based on query val and returns JSON, best match first
     Parameters:
-    - q (str) : search val
+    - query (str) : search val
+    - limit (int) : results per type, default 10, at most 50
     Returns:
-    - JSON : {"owners": [{id, full_name, address},..], "properties": [{id, address, owner_id, company_id},...],, "companies": [{id, llc_name, owner_id}]}
+    - JSON : {"owners": [{id, full_name, address},..], "properties": [{id, address, owner_id, llc_id},...], "companies": [{id, owner_id, owner_name, company_id, llc_name}]}
     """
     # get query val
     q = request.args.get('query', '')
-    # query result variables
-    q_owner = Owner.query.filter(Owner.full_name.contains(q)).limit(10).all()
-    q_property = Property.query.filter(Property.address.contains(q)).limit(10).all()
-    # Output of this query is [(<Company>, <OwnerCompany>),...]
-    # Flaw of Database Schema is Company should rework that to be streamlined for queries
-    q_company = db.session.query(Company, OwnerCompany).join(OwnerCompany, OwnerCompany.company_id == Company.id).filter(Company.llc_name.contains(q)).all()
-
-    # serialized element lists determined by query variables finding results
-    if q_owner:
-        owners = [o.serialize() for o in q_owner]
-    else:
-        owners = None
-    if q_property:
-        properties = [p.serialize() for p in q_property]
-    else:
-        properties = None
-    if q_company:
-        # Using last query we can create a list of OwnerCompany instances which is more useful than a Company instance
-        q_owner_company = [tuple[1] for tuple in q_company]
-        companies = [c.serialize() for c in q_owner_company]
-    else:
-        companies = None
+    limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+    # Indexed search of each table, see search.py
+    results = search(q, limit)
+    # serialized element lists, None when a type has no results
+    owners = [o.serialize() for o in results['owners']] or None
+    properties = [p.serialize() for p in results['properties']] or None
+    companies = [c.serialize() for c in results['companies']] or None
     # return the jsonified list in their respective sections
     return jsonify(owners=owners, properties=properties, companies=companies)
 
+@app.route('/api/typeahead')
+def typeahead_search():
+    """
+    Autocomplete for the search bar, answered from an in-memory prefix index, see typeahead.py
+    Parameters:
+    - q (str) : what's been typed, matched against the start of every word
+    - limit (int) : results per type, default 8, at most 50
+    Returns:
+    - JSON : {"owners": [{id, name, owner_id}, ...], "companies": [...], "properties": [...]}
+    """
+    q = request.args.get('q', '')
+    limit = request.args.get('limit', TYPEAHEAD_LIMIT, type=int)
+    return jsonify(typeahead.search(q, limit))
+
+@app.route('/api/export/<table>.<format>')
+def export_table(table, format):
+    """
+    Streams a whole table for bulk download, read with a server side cursor so memory stays flat, see exports.py
+    Parameters:
+    - table (str) : properties, owners or owner_companies
+    - format (str) : ndjson, csv or parquet (needs pyarrow)
+    - since (int) : only rows with a larger id, ex: the last id of the previous export
+    Returns:
+    - Chunked response : rows in id order
+    """
+    if table not in EXPORT_TABLES or format not in EXPORT_FORMATS:
+        return (jsonify(exceptions={"exception" : f"No export {table}.{format}"}), 404)
+    if format == 'parquet' and pyarrow is None:
+        return (jsonify(exceptions={"exception" : "Parquet exports need pyarrow installed"}), 501)
+    since = request.args.get('since', type=int)
+    # stream_with_context keeps the request's database session open while the rows are sent
+    return Response(stream_with_context(export_chunks(table, format, since)), mimetype=EXPORT_FORMATS[format],
+                    headers={'Content-Disposition': f'attachment; filename={table}.{format}'})
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,296 @@
+# Imports
+import asyncio
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import metrics
+
+# Concurrent crawl engine. Fetches several parcels at once while a per-host token bucket keeps the
+# request rate polite, parses them in a separate pool and hands them to a single writer in parid order
+# so the CrawlerProgress table still resumes from the right place. The writer runs on a thread of its own,
+# the event loop keeps fetching and parsing while it's in the database.
+
+
+class HostRateLimiter:
+    """
+    Token bucket per host. Each request spends one token, tokens refill at `rate` per second
+    and at most `burst` can be saved up. A rate of 0 or less turns limiting off.
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        # host -> (tokens, time of last refill)
+        self._buckets = {}
+        self._locks = {}
+
+    async def acquire(self, url):
+        """
+        Waits until the host of url has a token to spend.
+
+        Parameters:
+        - url (str) : URL about to be requested.
+        """
+        if self.rate <= 0:
+            return
+        host = urlsplit(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        # The lock makes requests for one host queue up instead of all waking at once
+        async with lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                await asyncio.sleep((1 - tokens) / self.rate)
+                now = time.monotonic()
+                tokens = 1
+            self._buckets[host] = (tokens - 1, now)
+
+
+class StageStats:
+    """
+    Latency of one pipeline stage plus the depth of the queue feeding it. held is a dict of items the stage
+    has taken off its queue but not handled yet, counted as queued too.
+    """
+
+    def __init__(self, name, queue=None, held=None):
+        self.name = name
+        self.queue = queue
+        self.held = held
+        self.count = 0
+        self.total = 0.0
+        # Latest latencies, for the median
+        self.latencies = deque(maxlen=1000)
+        # The write stage records from its own thread
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        metrics.stage_seconds.observe(seconds, self.name)
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.latencies.append(seconds)
+
+    def summary(self):
+        """Returns {'count', 'mean', 'p50', 'max', 'queued'}, times in seconds."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            count, total = self.count, self.total
+        queued = None
+        if self.queue is not None:
+            queued = self.queue.qsize() + (len(self.held) if self.held is not None else 0)
+        return {'count': count,
+                'mean': total / count if count else None,
+                'p50': latencies[len(latencies) // 2] if latencies else None,
+                'max': latencies[-1] if latencies else None,
+                'queued': queued}
+
+
+def format_stages(stages):
+    """One line per stage, for the periodic report."""
+    lines = []
+    for stage in stages:
+        summary = stage.summary()
+        if summary['count']:
+            lines.append(f"  {stage.name:<6} done={summary['count']} queued={summary['queued']} "
+                         f"mean={summary['mean'] * 1000:.1f}ms p50={summary['p50'] * 1000:.1f}ms max={summary['max'] * 1000:.1f}ms")
+        else:
+            lines.append(f"  {stage.name:<6} done=0 queued={summary['queued']}")
+    return "\n".join(lines)
+
+
+async def crawl(pages, write, fetch, parse=None, concurrency=4, parsers=2, queue_size=None,
+                limiter=None, executor=None, parse_executor=None, report_every=30, failures=None, write_executor=None):
+    """
+    Crawls pages as a pipeline of three stages joined by bounded queues: `concurrency` fetchers, `parsers`
+    parse workers and a single writer thread. A full queue makes the stage before it wait, so the slowest stage
+    sets the pace without anything piling up. Pages are written one at a time and in the order of pages, a page is
+    only written after every page before it has been written or skipped. Skipped pages are handed to failures,
+    so the parcel isn't lost once the resume point has moved past it: failed() for a fetch or write that failed,
+    missing() for a page that came back without parcel data.
+
+    Parameters:
+    - pages (iterable) : (url, next_url) pairs, in crawl order.
+    - write (function) : write(data, url), called from the write thread, ex: crawler.update_database.
+    - fetch (function) : fetch(url) -> page or None, ex: scraper.fetch_page. Runs in executor.
+    - parse (function) : parse(page) -> dict or None, ex: scraper.parse_page. Runs in parse_executor.
+                         None when fetch already returns the data dict, ex: scraper.fetch_parcel.
+    - concurrency (int) : Number of parcels being fetched at once.
+    - parsers (int) : Number of pages being parsed at once.
+    - queue_size (int) : Most items waiting between two stages, defaults to 2 * concurrency.
+    - limiter (HostRateLimiter) : Politeness budget, None for no limit.
+    - executor (Executor) : Where fetch runs, None uses the event loop's default thread pool.
+    - parse_executor (Executor) : Where parse runs, a ProcessPoolExecutor since parsing is CPU-bound.
+    - report_every (float) : Seconds between stage reports, None for no reports.
+    - failures (FailedParcels) : Told about every page that couldn't be fetched, scraped or written and every
+                                 page that was written, in page order on the write thread, None to only count them.
+    - write_executor (Executor) : Where write runs, a single thread so pages are written one at a time.
+                                  None starts one for the crawl.
+
+    Return:
+    - stats (dict) : {'fetched', 'written', 'incomplete', 'errors', 'last_url', 'seconds', 'stages'}
+    """
+    if not (isinstance(concurrency, int)) or concurrency < 1:
+        raise TypeError('Concurrency must be a positive integer')
+    if not (isinstance(parsers, int)) or parsers < 1:
+        raise TypeError('Parsers must be a positive integer')
+
+    loop = asyncio.get_running_loop()
+    pages = iter(enumerate(pages))
+    queue_size = queue_size or concurrency * 2
+    # (seq, url, next_url, page) waiting to be parsed, then (seq, url, data, fetched) waiting to be written
+    parse_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    # seq -> (url, data, fetched), holds pages that finished ahead of an earlier one
+    finished = {}
+    stages = [StageStats('fetch'), StageStats('parse', parse_queue), StageStats('write', write_queue, finished)]
+    fetch_stage, parse_stage, write_stage = stages
+    stats = {'fetched': 0, 'written': 0, 'incomplete': 0, 'errors': 0, 'last_url': None}
+    own_write_executor = write_executor is None
+    if own_write_executor:
+        write_executor = ThreadPoolExecutor(max_workers=1)
+    next_write = 0
+    # Caps how far fetching may run ahead of the writer so finished can't grow without bound
+    window = concurrency * 4 + queue_size * 2
+    advanced = asyncio.Condition()
+    started = time.monotonic()
+
+    def flush():
+        """
+        Writes every finished page that is next in line. Runs on the write thread while the writer waits for it,
+        so finished only changes here meanwhile.
+
+        Return:
+        - errors (int) : Pages that couldn't be written, added to stats['errors'] back on the event loop thread.
+        """
+        nonlocal next_write
+        errors = 0
+        while next_write in finished:
+            url, data, fetched = finished.pop(next_write)
+            next_write += 1
+            if next_write % 10 == 0:
+                print(url)
+            if data is None:
+                # A page without parcel data is most likely a parid that doesn't exist
+                if failures is not None and fetched:
+                    failures.missing(url)
+                elif failures is not None:
+                    failures.failed(url)
+                continue
+            began = time.monotonic()
+            try:
+                write(data, url)
+                stats['written'] += 1
+                metrics.pages.inc('written')
+                stats['last_url'] = data['next_url']
+                if failures is not None:
+                    failures.written(url)
+            except Exception as e:
+                errors += 1
+                metrics.pages.inc('error')
+                metrics.stage_errors.inc('write', type(e).__name__)
+                print(f"Exception in Crawler: {e}")
+                print(f"{url}")
+                if failures is not None:
+                    failures.failed(url)
+            write_stage.record(time.monotonic() - began)
+        return errors
+
+    async def fetcher():
+        """Pulls the next page off the shared iterator until it runs out."""
+        for seq, (url, next_url) in pages:
+            async with advanced:
+                await advanced.wait_for(lambda: seq - next_write < window)
+            if limiter:
+                await limiter.acquire(url)
+
+            began = time.monotonic()
+            try:
+                page = await loop.run_in_executor(executor, fetch, url)
+                stats['fetched'] += 1
+            except Exception as e:
+                print(f"Exception from fetch : {e}")
+                stats['errors'] += 1
+                metrics.stage_errors.inc('fetch', type(e).__name__)
+                page = None
+            fetch_stage.record(time.monotonic() - began)
+            await parse_queue.put((seq, url, next_url, page))
+
+    async def parser():
+        """Parses fetched pages until it's handed None."""
+        while True:
+            item = await parse_queue.get()
+            if item is None:
+                return
+            seq, url, next_url, page = item
+            data = page
+            if parse and page is not None:
+                began = time.monotonic()
+                try:
+                    data = await loop.run_in_executor(parse_executor, parse, page)
+                except Exception as e:
+                    print(f"Exception from parse : {e}")
+                    stats['errors'] += 1
+                    metrics.stage_errors.inc('parse', type(e).__name__)
+                    data = None
+                parse_stage.record(time.monotonic() - began)
+
+            if data is None or None in data.values():
+                # Same check the sequential crawler makes, but one bad parcel doesn't stop the others
+                print(f"Incomplete Scrape: {url}")
+                stats['incomplete'] += 1
+                metrics.pages.inc('incomplete')
+                data = None
+            else:
+                data['next_url'] = next_url
+            await write_queue.put((seq, url, data, page is not None))
+
+    async def writer():
+        """Hands pages to the write thread, the only stage that touches the database, until it's handed None."""
+        done = False
+        while not done:
+            items = [await write_queue.get()]
+            # Pages that came in while the thread was busy go over in one trip
+            while not write_queue.empty():
+                items.append(write_queue.get_nowait())
+            for item in items:
+                if item is None:
+                    done = True
+                    continue
+                seq, url, data, fetched = item
+                finished[seq] = (url, data, fetched)
+            # The queue fills up behind a slow write and holds the stages before it back, not the event loop
+            stats['errors'] += await loop.run_in_executor(write_executor, flush)
+            async with advanced:
+                advanced.notify_all()
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(report_every)
+            print(f"Crawl stages after {time.monotonic() - started:.0f}s:\n{format_stages(stages)}")
+
+    report_task = asyncio.create_task(reporter()) if report_every else None
+    writer_task = asyncio.create_task(writer())
+    parser_tasks = [asyncio.create_task(parser()) for _ in range(parsers)]
+    try:
+        await asyncio.gather(*(fetcher() for _ in range(concurrency)))
+        # Each stage is told to stop once everything before it is done
+        for _ in parser_tasks:
+            await parse_queue.put(None)
+        await asyncio.gather(*parser_tasks)
+        await write_queue.put(None)
+        await writer_task
+    finally:
+        # Only still running if a fetcher failed outright
+        for task in [report_task, writer_task, *parser_tasks]:
+            if task and not task.done():
+                task.cancel()
+        if own_write_executor:
+            # Waits for a write that's still running
+            write_executor.shutdown()
+
+    stats['seconds'] = time.monotonic() - started
+    stats['stages'] = {stage.name: stage.summary() for stage in stages}
+    return stats
@@ -0,0 +1,214 @@
+# Imports
+from sqlalchemy import insert, update, bindparam
+from modules import Owner, Company, Property, PropertyTransfer, OwnerCompany, CrawlerProgress, db
+from identity_cache import owner_cache, company_cache
+from metrics import timed_db
+from sql_helpers import upsert, chunks
+from rankings import count_properties
+from generation import bump_generation
+
+# Batched write path for the crawler. Buffers scraped parcels and writes each batch in one transaction
+# with INSERT ... ON CONFLICT upserts, ending with the same rows update_database() would have written.
+# Both write properties with write_properties(), a parcel scraped with a different owner than the one stored
+# (it sold, or it's being re-crawled) has its property moved to the new owner and LLC, and the move is logged in
+# the property_transfer table.
+
+
+def write_properties(properties, transfers=()):
+    """
+    Inserts new properties and moves stored ones to the owner and LLC they were scraped with, in the caller's
+    transaction, with the rankings' and portfolios' counts moved along (rankings.count_properties) and each move
+    logged as a PropertyTransfer.
+
+    Parameters:
+    - properties (list) : {'address', 'owner_id', 'llc_id'} of each scraped property, at most one per address.
+    - transfers (list) : Same, for properties only updated when they're already stored, ex: a parcel an LLC bought.
+
+    Return:
+    - (inserted, updated) (tuple) : Number of properties inserted and of stored ones whose owner or LLC changed.
+    """
+    rows = {row['address']: row for row in transfers}
+    rows.update((row['address'], row) for row in properties)
+    stored = {}
+    property_ids = {}
+    for chunk in chunks(sorted(rows)):
+        for address, owner_id, llc_id, id in (db.session.query(Property.address, Property.owner_id,
+                                                               Property.llc_id, Property.id)
+                                              .filter(Property.address.in_(chunk))):
+            stored[address] = (owner_id, llc_id)
+            property_ids[address] = id
+    inserted = []
+    for chunk in chunks([row for row in properties if row['address'] not in stored]):
+        # RETURNING only gives back the rows that were actually inserted, not ones another worker just wrote
+        inserted.extend(db.session.execute(upsert(Property).values(chunk)
+                                           .on_conflict_do_nothing(index_elements=['address'])
+                                           .returning(Property.owner_id, Property.llc_id)))
+    changed = [row for address, row in sorted(rows.items())
+               if address in stored and stored[address] != (row['owner_id'], row['llc_id'])]
+    if changed:
+        table = Property.__table__
+        db.session.execute(update(table).where(table.c.address == bindparam('property_address'))
+                           .values(owner_id=bindparam('new_owner_id'), llc_id=bindparam('new_llc_id')),
+                           [{'property_address': row['address'], 'new_owner_id': row['owner_id'],
+                             'new_llc_id': row['llc_id']} for row in changed])
+        db.session.execute(insert(PropertyTransfer), [{'property_id': property_ids[row['address']]} for row in changed])
+    count_properties(inserted + [(row['owner_id'], row['llc_id']) for row in changed],
+                     removed=[stored[row['address']] for row in changed])
+    return len(inserted), len(changed)
+
+
+def plan_record(data):
+    """
+    Works out which rows update_database() would write for one scraped parcel.
+
+    Parameters:
+    - data (dict) : Scraper result.
+
+    Return:
+    - Plan (dict) : {'company': llc_name or None, 'owner': (full_name, address) or None,
+                     'link': bool, 'property': address or None, 'transfer': address or None}
+    """
+    plan = {'company': None, 'owner': None, 'link': False, 'property': None, 'transfer': None}
+    # Case: Owner is an LLC
+    if 'LLC' in data['owner_name']:
+        plan['company'] = data['owner_name']
+        try:
+            price = int(data['price'])
+        except ValueError:
+            # update_database stops after the company when the price isn't a number
+            return plan
+        # SubCase: Owner of LLC was the prev grantor, LLCs bought from someone else only record the company
+        if price == 0:
+            plan['owner'] = (data['grantor'], data['owner_address'])
+            plan['link'] = True
+            plan['property'] = data['property_address']
+        else:
+            # A stored property the LLC bought is moved to it, without an owner
+            plan['transfer'] = data['property_address']
+    # Case: Owner isn't an LLC
+    else:
+        plan['owner'] = (data['owner_name'], data['owner_address'])
+        plan['property'] = data['property_address']
+    return plan
+
+
+class BatchWriter:
+    """
+    Buffers scraper results and flushes them `batch_size` at a time. Has the same write(data, url)
+    signature as update_database() so the crawl engine can use either.
+    If a batch fails as a whole it is rolled back and handed to `fallback` one parcel at a time, the urls of
+    parcels the fallback couldn't write either end up in `failed`.
+    """
+
+    def __init__(self, batch_size=100, fallback=None):
+        self.batch_size = batch_size
+        self.fallback = fallback
+        self.pending = []
+        self.failed = []
+        self.stats = {'records': 0, 'flushes': 0, 'fallbacks': 0}
+
+    def __call__(self, data, url):
+        self.add(data, url)
+
+    def add(self, data, url):
+        """Buffers one parcel, flushing when the batch is full."""
+        self.pending.append((data, url))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes every buffered parcel in one transaction."""
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        try:
+            with timed_db('batch_flush'):
+                self._write(records)
+                # Cached API responses built from the old data are stale from this commit on
+                bump_generation()
+                db.session.commit()
+            self.stats['records'] += len(records)
+            self.stats['flushes'] += 1
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"Exception from BatchWriter : {e}")
+            if self.fallback is None:
+                raise
+            self.stats['fallbacks'] += 1
+            for data, url in records:
+                if self.fallback(data, url) is False:
+                    self.failed.append(url)
+
+    def _upsert_ids(self, model, key, rows, cache):
+        """
+        Inserts rows that aren't in the table yet and returns the id of every row, new or existing.
+        Keys in cache skip the database entirely. For the rest, the conflict update only rewrites the
+        key with itself, so existing rows keep their values (an owner keeps the name it was first seen with)
+        and RETURNING still gives back their ids.
+
+        Parameters:
+        - model (Model) : Owner or Company.
+        - key (Column) : Unique column rows are matched on.
+        - rows (list) : Column dicts, at most one per key.
+        - cache (IdentityCache) : Ids already known for key.
+
+        Return:
+        - ids (dict) : key value -> id
+        """
+        ids = {}
+        missing = []
+        for row in rows:
+            id = cache.get(row[key.name])
+            if id is None:
+                missing.append(row)
+            else:
+                ids[row[key.name]] = id
+        for chunk in chunks(missing):
+            statement = upsert(model).values(chunk)
+            statement = statement.on_conflict_do_update(index_elements=[key.name],
+                                                        set_={key.name: statement.excluded[key.name]})
+            for id, value in db.session.execute(statement.returning(model.id, key)):
+                ids[value] = id
+                # Only cached once the batch commits
+                cache.stage(value, id)
+        return ids
+
+    def _write(self, records):
+        plans = [plan_record(data) for data, url in records]
+
+        # Metadata table, one row per parcel like update_database
+        db.session.execute(insert(CrawlerProgress),
+                           [{'curr_url': url, 'next_url': data['next_url']} for data, url in records])
+
+        # Companies and owners, the first time a key shows up in the batch wins
+        llc_names = list(dict.fromkeys(plan['company'] for plan in plans if plan['company']))
+        company_ids = self._upsert_ids(Company, Company.llc_name, [{'llc_name': name} for name in llc_names],
+                                       company_cache)
+        owners = {}
+        for plan in plans:
+            if plan['owner'] and plan['owner'][1] not in owners:
+                owners[plan['owner'][1]] = plan['owner'][0]
+        owner_ids = self._upsert_ids(Owner, Owner.address,
+                                     [{'full_name': name, 'address': address} for address, name in owners.items()],
+                                     owner_cache)
+
+        # OwnerCompany links
+        links = list(dict.fromkeys((owner_ids[plan['owner'][1]], company_ids[plan['company']])
+                                   for plan in plans if plan['link']))
+        for chunk in chunks([{'owner_id': owner_id, 'company_id': company_id} for owner_id, company_id in links]):
+            db.session.execute(upsert(OwnerCompany).values(chunk).on_conflict_do_nothing(
+                index_elements=['owner_id', 'company_id']))
+
+        # Properties, the first time an address shows up in the batch wins
+        properties = {}
+        transfers = {}
+        for plan in plans:
+            if plan['property'] and plan['property'] not in properties:
+                properties[plan['property']] = {'address': plan['property'],
+                                                'owner_id': owner_ids[plan['owner'][1]],
+                                                'llc_id': company_ids.get(plan['company'])}
+            elif plan['transfer'] and plan['transfer'] not in transfers:
+                transfers[plan['transfer']] = {'address': plan['transfer'], 'owner_id': None,
+                                               'llc_id': company_ids[plan['company']]}
+        write_properties(list(properties.values()), list(transfers.values()))
@@ -0,0 +1,742 @@
+# Imports
+import argparse
+import gc
+import glob
+import json
+import os
+import platform
+import random
+import resource
+import tempfile
+import threading
+import time
+from datetime import datetime
+from contextlib import redirect_stdout
+from itertools import islice
+import requests
+import scraper
+from scraper import parcel_url_sequence, find_next_url, get_parid, ParcelIndex, parse_quickinfo, fetch_backends, html_parsers
+from stand_in import start_stand_in, make_parcel_record, render_parcel_page, CITIES, DATA_URL_TEMPLATE
+
+# Benchmarks for the crawler, run against the local stand-in so washoecounty.gov is never hit.
+# Usage: python benchmark.py next_url|backends|writes|parsers|crawl|search|queries|typeahead
+
+
+def pages_per_second(function, items):
+    """
+    Calls function once per item and measures the throughput.
+
+    Parameters:
+    - function (function) : Called as function(item).
+    - items (list) : Inputs, one call each.
+
+    Return:
+    - Rate (float) : Calls per second.
+    """
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    return len(items) / (time.perf_counter() - started)
+
+
+def print_rates(title, rates):
+    """Prints a name -> pages/sec table, rates that are strings are printed as notes."""
+    print(title)
+    for name, rate in rates.items():
+        if isinstance(rate, str):
+            print(f"  {name:<16} {rate}")
+        else:
+            print(f"  {name:<16} {rate:>12.1f} pages/sec")
+
+
+def benchmark_next_url(pages=1000, browser_pages=5):
+    """
+    Compares the Selenium next-page click with the browser-free next url resolvers.
+
+    Parameters:
+    - pages (int) : Parcels resolved by each browser-free resolver.
+    - browser_pages (int) : Parcels resolved through Selenium, each one starts a Chrome.
+
+    Return:
+    - rates (dict) : resolver name -> pages/sec, or the reason it was skipped.
+    """
+    server = start_stand_in()
+    urls = list(islice(parcel_url_sequence(f"{server.base_url}?parid=00102001"), pages))
+    rates = {}
+    try:
+        try:
+            rates['browser'] = pages_per_second(lambda url: find_next_url(url, use_browser=True), urls[:browser_pages])
+        except Exception as e:
+            rates['browser'] = f"skipped ({type(e).__name__})"
+
+        rates['sequence'] = pages_per_second(find_next_url, urls)
+
+        previous_index = scraper.parcel_index
+        scraper.parcel_index = ParcelIndex(get_parid(url) for url in urls)
+        try:
+            rates['parcel_index'] = pages_per_second(find_next_url, urls)
+        finally:
+            scraper.parcel_index = previous_index
+    finally:
+        server.shutdown()
+
+    print_rates('next url resolution', rates)
+    return rates
+
+
+def benchmark_backends(pages=200, fixtures=None, render=False):
+    """
+    Runs every fetch backend over the same parcels and checks they all extract the same data.
+    'static' parses the served HTML without a browser, it stands in for 'render' when no Chromium is available.
+    Without fixtures the payloads are the stand-in's own, so 'data' agreeing only checks the code against itself,
+    with fixtures it's checked against real recorded payloads and parcels without one are left out.
+
+    Parameters:
+    - pages (int) : Parcels fetched by each backend.
+    - fixtures (str) : Directory of recorded pages for the stand-in to serve.
+    - render (bool) : Also run the headless browser backend.
+
+    Return:
+    - rates (dict) : backend name -> pages/sec.
+    """
+    server = start_stand_in(fixtures=fixtures)
+    # The stand-in's payload url, the data backend has no default
+    scraper.data_url_template = DATA_URL_TEMPLATE
+    urls = list(islice(parcel_url_sequence(f"{server.base_url}?parid=00102001"), pages))
+    backends = {'static': lambda url: parse_quickinfo(requests.get(url).text), 'data': fetch_backends['data']}
+    if render:
+        backends['render'] = fetch_backends['render']
+    rates = {}
+    results = {}
+    try:
+        for name, backend in backends.items():
+            results[name] = []
+            rates[name] = pages_per_second(lambda url: results[name].append(backend(url)), urls)
+    finally:
+        server.shutdown()
+
+    print_rates('fetch backends', rates)
+    if not fixtures:
+        print("  synthetic payloads, 'data' is only checked against the stand-in, record real ones with stand_in.py --record")
+    # Every backend should give back exactly what the first one did
+    baseline = next(iter(results))
+    for name in results:
+        # Parcels recorded without a payload
+        compared = [(url, a, b) for url, a, b in zip(urls, results[baseline], results[name])
+                    if not (fixtures and name == 'data' and b is None)]
+        mismatches = [url for url, a, b in compared if a != b]
+        print(f"  {name:<16} {len(compared) - len(mismatches)}/{len(compared)} match {baseline}")
+        for url in mismatches[:5]:
+            print(f"    mismatch: {url}")
+    return rates
+
+
+def make_scraped_records(count, base_url='http://127.0.0.1/assessor/cama/'):
+    """
+    Builds count (data, url) pairs shaped like scraper results, from the stand-in's synthetic parcels.
+
+    Parameters:
+    - count (int) : Number of parcels.
+    - base_url (str) : Assessor url the parcel urls are built on.
+
+    Return:
+    - records (list) : [(data, url), ...] in parid order.
+    """
+    urls = list(islice(parcel_url_sequence(f"{base_url}?parid=00102001"), count + 1))
+    records = []
+    for url, next_url in zip(urls, urls[1:]):
+        data = make_parcel_record(get_parid(url))
+        del data['parid']
+        data['next_url'] = next_url
+        records.append((data, url))
+    return records
+
+
+def snapshot_database():
+    """Returns every table's rows by their natural keys, so databases written in different orders can be compared."""
+    from modules import Owner, Company, Property, OwnerCompany, CrawlerProgress
+    return {
+        'owner': sorted((o.full_name, o.address) for o in Owner.query),
+        'company': sorted(c.llc_name for c in Company.query),
+        'owner_company': sorted((l.owner.address, l.company.llc_name) for l in OwnerCompany.query),
+        'property': sorted((p.address, p.owner.address if p.owner else '', p.company.llc_name if p.company else '')
+                           for p in Property.query),
+        'crawler_progress': sorted((r.curr_url, r.next_url) for r in CrawlerProgress.query)
+    }
+
+
+def benchmark_writes(rows=2000, batch_sizes=(1, 100, 1000), database_url=None):
+    """
+    Writes the same parcels with update_database() and with BatchWriter at each batch size, and checks
+    every run leaves the database in the same state. The tables are dropped between runs, so
+    database_url must point at a throwaway database.
+
+    Parameters:
+    - rows (int) : Parcels written per run.
+    - batch_sizes (tuple) : BatchWriter batch sizes to run.
+    - database_url (str) : Throwaway database, defaults to a temporary SQLite file.
+
+    Return:
+    - rates (dict) : writer name -> parcels/sec.
+    """
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    # crawler.py connects to DATABASE_URL when it's imported
+    os.environ['DATABASE_URL'] = database_url
+    from crawler import update_database, db
+    from batch_writer import BatchWriter
+    from identity_cache import owner_cache, company_cache
+
+    records = make_scraped_records(rows)
+    writers = {'update_database': lambda: update_database}
+    for batch_size in batch_sizes:
+        writers[f"batch {batch_size}"] = lambda batch_size=batch_size: BatchWriter(batch_size=batch_size)
+
+    rates = {}
+    snapshots = {}
+    for name, make_writer in writers.items():
+        db.drop_all()
+        db.create_all()
+        # Cached ids belong to the tables that were just dropped
+        owner_cache.clear()
+        company_cache.clear()
+        write = make_writer()
+        # update_database prints every row it writes
+        with redirect_stdout(open(os.devnull, 'w')):
+            started = time.perf_counter()
+            for data, url in records:
+                write(dict(data), url)
+            if isinstance(write, BatchWriter):
+                write.flush()
+            rates[name] = len(records) / (time.perf_counter() - started)
+        snapshots[name] = snapshot_database()
+
+    print_rates(f"database writes ({db.engine.dialect.name})", rates)
+    print(f"  owner cache {owner_cache.stats()}")
+    for name in snapshots:
+        same = snapshots[name] == snapshots['update_database']
+        print(f"  {name:<16} {'same rows as' if same else 'DIFFERENT rows from'} update_database")
+    return rates
+
+
+def load_corpus(corpus=None, pages=200):
+    """
+    Loads saved parcel pages, ex: a directory recorded with stand_in.py --record.
+
+    Parameters:
+    - corpus (str) : Directory of <parid>.html pages, None for the stand-in's synthetic pages.
+    - pages (int) : Number of synthetic pages when there's no corpus.
+
+    Return:
+    - documents (list) : HTML strings.
+    """
+    if corpus:
+        documents = []
+        for path in sorted(glob.glob(os.path.join(corpus, '*.html'))):
+            with open(path) as file:
+                documents.append(file.read())
+        return documents
+    urls = islice(parcel_url_sequence('http://127.0.0.1/assessor/cama/?parid=00102001'), pages)
+    return [render_parcel_page(make_parcel_record(get_parid(url))) for url in urls]
+
+
+def benchmark_parsers(corpus=None, pages=200, repeat=3):
+    """
+    Times every HTML parser over the same saved pages and checks they extract the same data as BeautifulSoup.
+
+    Parameters:
+    - corpus (str) : Directory of saved <parid>.html pages, None for synthetic pages.
+    - pages (int) : Number of synthetic pages when there's no corpus.
+    - repeat (int) : Runs per parser, the fastest is reported.
+
+    Return:
+    - rates (dict) : parser name -> pages/sec.
+    """
+    documents = load_corpus(corpus, pages)
+    rates = {}
+    outputs = {}
+    for name, parse in html_parsers.items():
+        def run(html, parse=parse):
+            # A page a parser can't read counts as None, same as extract_data
+            try:
+                return parse(html)
+            except Exception:
+                return None
+        # The BeautifulSoup helpers print their exceptions
+        with redirect_stdout(open(os.devnull, 'w')):
+            rates[name] = max(pages_per_second(run, documents) for _ in range(repeat))
+            outputs[name] = [run(html) for html in documents]
+
+    print_rates(f"html parsers ({len(documents)} pages)", rates)
+    for name in outputs:
+        matches = sum(1 for a, b in zip(outputs['soup'], outputs[name]) if a == b)
+        print(f"  {name:<16} {matches}/{len(documents)} match soup")
+    return rates
+
+
+def peak_memory():
+    """Returns the peak resident memory in MB of this process and of its finished child processes, ex: the parsers."""
+    # ru_maxrss is in kilobytes on Linux
+    return {'process_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def latency_percentiles(histogram):
+    """Returns {name: {'count', 'mean', 'p50', 'p99'}} in seconds for every series of a metrics.Histogram."""
+    percentiles = {}
+    for label_values, (count, total) in sorted(histogram.series().items()):
+        percentiles[label_values[0]] = {'count': count, 'mean': total / count,
+                                        'p50': histogram.quantile(0.5, *label_values),
+                                        'p99': histogram.quantile(0.99, *label_values)}
+    return percentiles
+
+
+def benchmark_crawl(pages=200, mode='concurrent', backend='static', concurrency=4, latency=0.05, error_rate=0.0,
+                    fixtures=None, database_url=None, output=None, compare=None):
+    """
+    Crawls the stand-in end to end into a throwaway database with crawler() or concurrent_crawler(), and reports
+    pages/sec, per-stage p50/p99 and peak memory. The database's tables are dropped first.
+
+    Parameters:
+    - pages (int) : Parcels to crawl.
+    - mode (str) : 'concurrent' or 'sequential'.
+    - backend (str) : 'static' renders pages by downloading the stand-in's HTML, for when there's no Chromium,
+                      'render' uses the headless browser and 'data' the data payload.
+    - concurrency (int) : Fetch threads in concurrent mode.
+    - latency (float) : Seconds the stand-in delays every response by.
+    - error_rate (float) : Share of requests the stand-in answers with a 503.
+    - fixtures (str) : Recorded pages or a page archive for the stand-in to serve.
+    - database_url (str) : Throwaway database, defaults to a temporary SQLite file.
+    - output (str) : JSON file the results are written to.
+    - compare (str) : JSON file of an earlier run to print the differences against.
+
+    Return:
+    - results (dict) : Everything written to output.
+    """
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    import crawler
+    import metrics
+    from metrics import timed
+    from identity_cache import owner_cache, company_cache
+
+    # Which backend fetch_page uses, and whether the crawler starts the browser
+    scraper.fetch_backend = 'data' if backend == 'data' else 'render'
+    scraper.data_url_template = DATA_URL_TEMPLATE
+    crawler.fetch_backend = backend
+    if backend == 'static':
+        def download_html(url):
+            with timed('render'):
+                response = scraper.http_session.get(url, timeout=20)
+                response.raise_for_status()
+                return response.text
+        # Still goes through render_page_with_retry's backoff, limiter and breaker
+        scraper.fetch_rendered_html = download_html
+
+    crawler.db.drop_all()
+    crawler.db.create_all()
+    owner_cache.clear()
+    company_cache.clear()
+    metrics.reset()
+    server = start_stand_in(latency=latency, fixtures=fixtures, error_rate=error_rate)
+    start_url = f"{server.base_url}?parid=00102001"
+    try:
+        # update_database prints every row it writes
+        with redirect_stdout(open(os.devnull, 'w')):
+            started = time.perf_counter()
+            if mode == 'sequential':
+                crawler.crawler(start_url, index=pages, delay=0)
+            else:
+                crawler.concurrent_crawler(start_url, index=pages, concurrency=concurrency, rate=0)
+            seconds = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    finished = {labels[0]: count for labels, count in metrics.pages.items().items()}
+    errors = {}
+    for counter in (metrics.stage_errors, metrics.db_errors):
+        for (name, error_type), count in counter.items().items():
+            errors[f"{name}:{error_type}"] = count
+    results = {
+        'benchmark': 'crawl',
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {'pages': pages, 'mode': mode, 'backend': backend, 'concurrency': concurrency, 'latency': latency,
+                   'error_rate': error_rate, 'fixtures': fixtures, 'database': crawler.db.engine.dialect.name},
+        'seconds': seconds,
+        'pages_per_second': finished.get('written', 0) / seconds,
+        'pages': finished,
+        'stages': latency_percentiles(metrics.stage_seconds),
+        'db': latency_percentiles(metrics.db_seconds),
+        'errors': errors,
+        'site': dict(server.stats, limit=crawler.site_limiter.limit, **crawler.site_limiter.stats),
+        'memory': peak_memory()
+    }
+
+    print(f"crawl ({mode}, {backend}, {pages} pages, {latency * 1000:.0f}ms latency, {error_rate:.0%} errors)")
+    print(f"  {results['pages_per_second']:.1f} pages/sec, {finished}, peak memory {results['memory']['process_mb']:.0f}MB")
+    for group in ('stages', 'db'):
+        for name, summary in results[group].items():
+            print(f"  {name:<22} n={summary['count']:<6} p50={summary['p50'] * 1000:8.1f}ms p99={summary['p99'] * 1000:8.1f}ms")
+    if errors:
+        print(f"  errors {errors}")
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"  results written to {output}")
+    if compare:
+        compare_results(compare, results)
+    return results
+
+
+def compare_results(path, results):
+    """Prints how results moved against an earlier run saved by benchmark_crawl(output=path)."""
+    with open(path) as file:
+        baseline = json.load(file)
+
+    def change(old, new):
+        return f"{(new - old) / old:+.1%}" if old else 'n/a'
+
+    print(f"  compared to {path} ({baseline['time']}):")
+    print(f"    pages/sec {baseline['pages_per_second']:.1f} -> {results['pages_per_second']:.1f} "
+          f"({change(baseline['pages_per_second'], results['pages_per_second'])})")
+    for group in ('stages', 'db'):
+        for name, summary in results[group].items():
+            old = baseline[group].get(name)
+            if old:
+                print(f"    {name:<22} p99 {old['p99'] * 1000:.1f}ms -> {summary['p99'] * 1000:.1f}ms ({change(old['p99'], summary['p99'])})")
+    print(f"    peak memory {baseline['memory']['process_mb']:.0f}MB -> {results['memory']['process_mb']:.0f}MB")
+
+
+def make_search_dataset(rows, seed=0):
+    """
+    Builds a synthetic county of rows properties for the search benchmark, with about one owner per two
+    properties and one LLC per hundred. Names and streets are made from syllables so there are enough distinct ones.
+
+    Parameters:
+    - rows (int) : Number of properties.
+    - seed (int) : Seed of the random names, the same seed gives the same dataset.
+
+    Return:
+    - (owners, companies, properties) (tuple) : Lists of row dicts for insert(Owner), insert(Company) and insert(Property).
+    """
+    generator = random.Random(seed)
+    syllables = ['AN', 'BER', 'CAR', 'DEL', 'EN', 'FOR', 'GAR', 'HOL', 'IN', 'JOR', 'KEL', 'LAN', 'MAR', 'NOR', 'OS',
+                 'PER', 'QUIN', 'ROS', 'SAN', 'TOR', 'UL', 'VAL', 'WIN', 'YOR', 'ZEL']
+
+    def word(parts):
+        return ''.join(generator.choice(syllables) for _ in range(parts))
+
+    streets = [f"{word(2)} {generator.choice(['ST', 'AVE', 'LN', 'DR', 'BLVD', 'CT', 'WAY'])}" for _ in range(2000)]
+    owners = [{'id': id, 'full_name': f"{word(3)}, {word(2)}", 'address': f"{id} {generator.choice(streets)} RENO NV"}
+              for id in range(1, rows // 2 + 1)]
+    llc_names = {f"{word(2)} {generator.choice(['HOLDINGS', 'RENTALS', 'PROPERTIES', 'INVESTMENTS'])} LLC" for _ in range(rows // 100 + 1)}
+    companies = [{'id': id, 'llc_name': name} for id, name in enumerate(sorted(llc_names), 1)]
+    properties = [{'id': id, 'address': f"{id} {generator.choice(streets)} {generator.choice(CITIES)}",
+                   'owner_id': generator.randint(1, len(owners)),
+                   'llc_id': generator.randint(1, len(companies)) if generator.random() < 0.2 else None}
+                  for id in range(1, rows + 1)]
+    return owners, companies, properties
+
+
+def benchmark_search(rows=500000, queries=200, scan_queries=30, database_url=None):
+    """
+    Times /api/search's indexed search against the LIKE '%q%' scans it replaced, over a synthetic dataset of
+    rows properties. The database's tables are dropped first.
+
+    Parameters:
+    - rows (int) : Properties in the dataset.
+    - queries (int) : Queries timed with the indexed search.
+    - scan_queries (int) : Queries timed with the scans, each one reads the three tables.
+    - database_url (str) : Throwaway database, defaults to a temporary SQLite file.
+
+    Return:
+    - results (dict) : search name -> {'count', 'p50', 'p99'} in seconds.
+    """
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    # app.py connects to DATABASE_URL when it's imported
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['TYPEAHEAD_BUILD'] = '0'
+    from sqlalchemy import insert
+    from app import db
+    from modules import Owner, Company, OwnerCompany, Property
+    from search import search, ensure_search_index
+    from sql_helpers import chunks
+
+    db.drop_all()
+    db.create_all()
+    owners, companies, properties = make_search_dataset(rows)
+    started = time.perf_counter()
+    for model, table_rows in ((Owner, owners), (Company, companies), (Property, properties)):
+        for chunk in chunks(table_rows, 10000):
+            db.session.execute(insert(model), chunk)
+    db.session.execute(insert(OwnerCompany), [{'owner_id': company['id'], 'company_id': company['id']} for company in companies])
+    db.session.commit()
+    print(f"loaded {len(owners)} owners, {len(companies)} LLCs, {rows} properties in {time.perf_counter() - started:.1f}s")
+    started = time.perf_counter()
+    ensure_search_index()
+    print(f"built the search index in {time.perf_counter() - started:.1f}s")
+
+    # Pieces of real names and addresses the way someone would type them, from a few letters to a whole name
+    generator = random.Random(1)
+    samples = [row['full_name'] for row in generator.sample(owners, queries)] + \
+              [row['address'] for row in generator.sample(properties, queries)] + \
+              [row['llc_name'] for row in generator.sample(companies, min(queries, len(companies)))]
+    terms = []
+    for sample in generator.sample(samples, queries):
+        start = generator.randrange(len(sample))
+        terms.append(sample[start:start + generator.randint(2, 12)].strip() or sample)
+
+    def scan(q):
+        # The search before the indexes
+        Owner.query.filter(Owner.full_name.contains(q)).limit(10).all()
+        Property.query.filter(Property.address.contains(q)).limit(10).all()
+        db.session.query(Company, OwnerCompany).join(OwnerCompany, OwnerCompany.company_id == Company.id).filter(Company.llc_name.contains(q)).all()
+
+    results = {}
+    for name, function, items in (('indexed', search, terms), ('like scan', scan, terms[:scan_queries])):
+        seconds = []
+        for q in items:
+            began = time.perf_counter()
+            function(q)
+            seconds.append(time.perf_counter() - began)
+        seconds.sort()
+        results[name] = {'count': len(seconds), 'p50': seconds[len(seconds) // 2],
+                         'p99': seconds[min(len(seconds) - 1, int(len(seconds) * 0.99))]}
+
+    print(f"search over {rows} properties ({db.engine.dialect.name})")
+    for name, summary in results.items():
+        print(f"  {name:<16} {summary['count']:>5} queries  p50 {summary['p50'] * 1000:8.2f}ms  p99 {summary['p99'] * 1000:8.2f}ms")
+    return results
+
+
+def benchmark_queries(rows=2000, database_url=None):
+    """
+    Calls every API read endpoint at a small and a large result size and counts the SQL statements each call runs.
+    A count that grows with the result size is an N+1 query, a relationship lazy loaded per row.
+    The database's tables are dropped first.
+
+    Parameters:
+    - rows (int) : Properties in the synthetic dataset.
+    - database_url (str) : Throwaway database, defaults to a temporary SQLite file.
+
+    Return:
+    - failures (list) : Endpoints whose query count grew.
+    """
+    if database_url is None:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    # app.py connects to DATABASE_URL when it's imported
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['TYPEAHEAD_BUILD'] = '0'
+    from sqlalchemy import insert, func
+    from app import app, db
+    from modules import Owner, Company, OwnerCompany, Property
+    from search import ensure_search_index
+    from rankings import rebuild_rankings
+    from entity_resolution import resolve_owners
+    from portfolios import rebuild_portfolios
+    from query_counter import count_queries
+    from sql_helpers import chunks
+    from response_cache import response_cache
+    from typeahead import typeahead
+
+    # Counts what a view runs, not what the response cache saves it from
+    response_cache.max_bytes = 0
+
+    db.drop_all()
+    db.create_all()
+    owners, companies, properties = make_search_dataset(rows)
+    for model, table_rows in ((Owner, owners), (Company, companies), (Property, properties)):
+        for chunk in chunks(table_rows, 10000):
+            db.session.execute(insert(model), chunk)
+    # Some owners with several LLCs, so the owner detail has lists on both sides
+    links = [{'owner_id': (company['id'] % 50) + 1, 'company_id': company['id']} for company in companies]
+    db.session.execute(insert(OwnerCompany), links)
+    # Spellings of the first owner's address, so one entity has several owners
+    address = owners[0]['address']
+    db.session.execute(insert(Owner), [{'full_name': owners[0]['full_name'], 'address': variant} for variant in
+                                       (address.title(), address.replace(' RENO', ', RENO,'), address + '.')])
+    db.session.commit()
+    ensure_search_index()
+    rebuild_rankings()
+    resolve_owners()
+    rebuild_portfolios()
+    # The app's background thread loads it otherwise
+    typeahead.refresh()
+
+    # Owners with the fewest and the most properties
+    counts = (db.session.query(Property.owner_id, func.count(Property.id)).group_by(Property.owner_id)
+              .order_by(func.count(Property.id), Property.owner_id).all())
+    few, many = counts[0][0], counts[-1][0]
+    # (small, large) url pairs
+    endpoints = [(f"/api/{name}?per_page=2", f"/api/{name}?per_page=50") for name in ('owners', 'properties', 'companies')]
+    endpoints += [(f"/api/{name}/1?per_page=2", f"/api/{name}/1?per_page=50") for name in ('owners', 'properties', 'companies')]
+    endpoints += [(f"/api/{name}/most?limit=2", f"/api/{name}/most?limit=50") for name in ('owners', 'companies')]
+    endpoints += [(f"/api/search?query={query}&limit=2", f"/api/search?query={query}&limit=50") for query in ('AN', 'CAR')]
+    endpoints += [("/api/typeahead?q=A&limit=2", "/api/typeahead?q=A&limit=50")]
+    endpoints += [(f"/api/owner/{few}", f"/api/owner/{many}")]
+    endpoints += [(f"/api/entities/{owners[1]['id']}", f"/api/entities/{owners[0]['id']}")]
+    endpoints += [("/api/portfolios/most?limit=2", "/api/portfolios/most?limit=50")]
+    # Owners past the 50 with LLCs are portfolios of their own
+    endpoints += [(f"/api/portfolios/{owners[-1]['id']}/members", f"/api/portfolios/{owners[0]['id']}/members")]
+
+    def rows_in(value):
+        # Items in every list of a JSON response, ex: the owners of a page or the properties of an owner
+        if isinstance(value, list):
+            return len(value)
+        if isinstance(value, dict):
+            return sum(rows_in(item) for item in value.values())
+        return 0
+
+    client = app.test_client()
+    failures = []
+    print(f"queries per request ({db.engine.dialect.name})")
+    for small, large in endpoints:
+        # The first call warms up anything cached per process, ex: the table's row count
+        client.get(small)
+        results = []
+        for url in (small, large):
+            response = None
+            def get():
+                nonlocal response
+                response = client.get(url)
+            count, statements = count_queries(db.engine, get)
+            results.append((count, rows_in(response.get_json())))
+        grew = results[1][0] > results[0][0]
+        if grew:
+            failures.append(large)
+        print(f"  {small:<36} {results[0][0]:>3} queries ({results[0][1]} rows)   {large:<36} {results[1][0]:>3} queries "
+              f"({results[1][1]} rows){'   GREW' if grew else ''}")
+    print(f"  {len(failures)} endpoints with N+1 queries")
+    return failures
+
+
+def benchmark_typeahead(entries=1000000, queries=2000, batch=1000):
+    """
+    Builds the typeahead's address index over entries synthetic addresses, and reports its memory and the times of
+    Typeahead.search, the whole lookup /api/typeahead makes, on its own and while a refresh merges new names in.
+
+    Parameters:
+    - entries (int) : Names in the index.
+    - queries (int) : Prefixes looked up.
+    - batch (int) : Names added by the refresh whose merge the searches run alongside.
+
+    Return:
+    - results (dict) : {'entries', 'keys', 'build_seconds', 'index_mb', 'build_peak_mb', 'p50_us', 'p99_us',
+                        'merge_seconds', 'merging_p99_us', 'merging_max_us'}
+    """
+    from typeahead import Typeahead, paused_gc
+
+    owners, companies, properties = make_search_dataset(entries)
+    rows = [(row['id'], row['address'], row['owner_id']) for row in properties]
+    del owners, companies, properties
+    gc.collect()
+    # Filled straight from the rows, the same arrays refresh() builds from the database
+    typeahead = Typeahead()
+    index = typeahead.indexes['properties']
+    # The process' peak RSS was set by making the dataset, so the build's peak is sampled from the current RSS
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    def current_rss():
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * page_size
+    before = current_rss()
+    samples = [before]
+    building = threading.Event()
+    building.set()
+    def sample():
+        while building.is_set():
+            samples.append(current_rss())
+            time.sleep(0.05)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    with paused_gc():
+        index.add(rows[:-batch])
+        index.publish()
+    build_seconds = time.perf_counter() - started
+    building.clear()
+    sampler.join()
+    build_peak = max(samples) - before
+
+    # What someone types: the start of a word of a real address, from one letter to most of it
+    generator = random.Random(2)
+    prefixes = []
+    for id, address, owner_id in generator.sample(rows, queries):
+        words = address.split()
+        word = ' '.join(words[generator.randrange(len(words)):])
+        prefixes.append(word[:generator.randint(1, 12)])
+    def lookups():
+        seconds = []
+        for prefix in prefixes:
+            began = time.perf_counter()
+            typeahead.search(prefix, 8)
+            seconds.append(time.perf_counter() - began)
+        return sorted(seconds)
+    seconds = lookups()
+
+    # The last names come in as a crawl batch would, merged into the whole index while searches go on
+    index.add(rows[-batch:])
+    merge = threading.Thread(target=index.publish, kwargs={'merge': True})
+    started = time.perf_counter()
+    merge.start()
+    merging = []
+    while merge.is_alive():
+        merging += lookups()
+    merge.join()
+    merge_seconds = time.perf_counter() - started
+    merging.sort()
+
+    results = {'entries': len(index), 'keys': len(index.keys[0]), 'build_seconds': build_seconds,
+               'index_mb': index.memory() / 1024 / 1024, 'build_peak_mb': build_peak / 1024 / 1024,
+               'p50_us': seconds[len(seconds) // 2] * 1e6, 'p99_us': seconds[int(len(seconds) * 0.99)] * 1e6,
+               'merge_seconds': merge_seconds, 'merging_p99_us': merging[int(len(merging) * 0.99)] * 1e6,
+               'merging_max_us': merging[-1] * 1e6}
+    print(f"typeahead over {results['entries']} addresses ({results['keys']} word keys)")
+    print(f"  built in {build_seconds:.1f}s, index {results['index_mb']:.1f}MB, peak RSS +{results['build_peak_mb']:.0f}MB while building")
+    print(f"  Typeahead.search top 8 p50 {results['p50_us']:.1f}us  p99 {results['p99_us']:.1f}us")
+    print(f"  while a {merge_seconds:.1f}s merge runs: {len(merging)} searches, p99 {results['merging_p99_us']:.1f}us  "
+          f"max {results['merging_max_us'] / 1000:.1f}ms")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs crawler benchmarks against the local stand-in.')
+    parser.add_argument('benchmark', choices=['next_url', 'backends', 'writes', 'parsers', 'crawl', 'search', 'queries', 'typeahead'])
+    parser.add_argument('--pages', type=int, default=None)
+    parser.add_argument('--fixtures', default=None,
+                        help='Directory of recorded pages, served by the stand-in or parsed by the parsers benchmark.')
+    parser.add_argument('--render', action='store_true', help='Include the headless browser backend.')
+    parser.add_argument('--database-url', default=None,
+                        help='Throwaway database for the writes, crawl, search and queries benchmarks, its tables are dropped. Defaults to a temporary SQLite file.')
+    parser.add_argument('--mode', choices=['concurrent', 'sequential'], default='concurrent', help='Crawler the crawl benchmark runs.')
+    parser.add_argument('--backend', choices=['static', 'render', 'data'], default='static',
+                        help='How the crawl benchmark fetches pages, static downloads the HTML without a browser.')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stand-in delays every response by.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests the stand-in answers with a 503.')
+    parser.add_argument('--output', default=None, help='JSON file the crawl results are written to.')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier crawl run to compare against.')
+    args = parser.parse_args()
+
+    if args.benchmark == 'next_url':
+        benchmark_next_url(pages=args.pages or 1000)
+    elif args.benchmark == 'backends':
+        benchmark_backends(pages=args.pages or 200, fixtures=args.fixtures, render=args.render)
+    elif args.benchmark == 'writes':
+        benchmark_writes(rows=args.pages or 2000, database_url=args.database_url)
+    elif args.benchmark == 'parsers':
+        benchmark_parsers(corpus=args.fixtures, pages=args.pages or 200)
+    elif args.benchmark == 'crawl':
+        benchmark_crawl(pages=args.pages or 200, mode=args.mode, backend='render' if args.render else args.backend,
+                        concurrency=args.concurrency, latency=args.latency, error_rate=args.error_rate,
+                        fixtures=args.fixtures, database_url=args.database_url, output=args.output, compare=args.compare)
+    elif args.benchmark == 'search':
+        benchmark_search(rows=args.pages or 500000, database_url=args.database_url)
+    elif args.benchmark == 'queries':
+        # Exits with an error when an endpoint has N+1 queries, so it can gate a build
+        if benchmark_queries(rows=args.pages or 2000, database_url=args.database_url):
+            raise SystemExit(1)
+    elif args.benchmark == 'typeahead':
+        benchmark_typeahead(entries=args.pages or 1000000)
@@ -1,11 +1,27 @@
 # Imports
 import os
 import time
+import asyncio
+import argparse
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from flask import Flask
 from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
-from modules import Owner, Company, Property, OwnerCompany, CrawlerProgress, connect_db, db
-from scraper import scraper
+from modules import Owner, Company, OwnerCompany, CrawlerProgress, connect_db, db
+from scraper import scraper, fetch_page, parse_page, fetch_backend, parcel_url_sequence, find_next_url, get_renderer_pool, close_renderer_pool, get_parid, set_parid, site_limiter, site_breaker, use_browser_for_next_url
+from async_crawler import crawl, HostRateLimiter
+from batch_writer import BatchWriter, write_properties
+from generation import bump_generation
+from entity_resolution import resolve_new_owners
+from portfolios import update_portfolios
+from identity_cache import owner_cache, company_cache, watch_session, warm_caches
+from page_archive import PageArchive, archiving
+from recrawl import FingerprintWriter, schedule_recrawl
+from failed_parcels import FailedParcels, failed_urls
+from metrics import timed, timed_db, start_metrics_server, start_summary_log, summary, pages as page_counter
+from shard_leases import (plan_shards, claim_shard, heartbeat, release_shard, shard_pages, shard_progress,
+                          default_worker_name, LeaseLost, LeaseTimer)
 
 # Configurations
 app = Flask(__name__)
@@ -17,15 +33,26 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'P@55w0rdI5S3cr3t')
 app.app_context().push()
 connect_db(app)
 db.create_all()
+# Cached owner/company ids follow the session's commits and rollbacks
+watch_session(db.session)
 
 # Global Variables
-starting_url = None
-max_id = db.session.query(func.max(CrawlerProgress.id)).scalar()
-if max_id:
-    crawler_progress = CrawlerProgress.query.filter(CrawlerProgress.id == max_id).first()
-    starting_url = crawler_progress.next_url
-else:
-    starting_url = 'https://www.washoecounty.gov/assessor/cama/?parid=00102001'
+first_url = os.environ.get('ASSESSOR_START_URL', 'https://www.washoecounty.gov/assessor/cama/?parid=00102001')
+
+
+def get_starting_url():
+    """Returns the next_url of the latest CrawlerProgress row, or first_url when nothing has been crawled yet."""
+    max_id = db.session.query(func.max(CrawlerProgress.id)).scalar()
+    if max_id:
+        crawler_progress = CrawlerProgress.query.filter(CrawlerProgress.id == max_id).first()
+        return crawler_progress.next_url
+    return first_url
+
+
+def restore_starting_url(url):
+    """Makes url the latest CrawlerProgress row again, after a pass over parcels outside the crawl order wrote its own."""
+    db.session.add(CrawlerProgress(curr_url=url, next_url=url))
+    db.session.commit()
 
 
 # Database Functions
@@ -83,14 +110,55 @@ def get_or_insert_company(name):
         return Company.query.filter_by(llc_name=name).first()
 
 
+def get_or_insert_owner_id(name, address):
+    """
+    Same as get_or_insert_owner() but returns only the id, from owner_cache when the address has been seen before.
+
+    Parameters:
+    - name (str) : Full name of Owner.
+    - address (str) : Owner's address.
+
+    Return:
+    - id (int) : The owner's id.
+    """
+    owner_id = owner_cache.get(address)
+    if owner_id is None:
+        # get_or_insert_owner has committed the row by the time it returns, so the id is safe to keep
+        with timed_db('get_or_insert_owner'):
+            owner_id = get_or_insert_owner(name=name, address=address).id
+        owner_cache.put(address, owner_id)
+    return owner_id
+
+
+def get_or_insert_company_id(name):
+    """
+    Same as get_or_insert_company() but returns only the id, from company_cache when the name has been seen before.
+
+    Parameters:
+    - name (str) : Name of LLC
+
+    Return:
+    - id (int) : The company's id.
+    """
+    company_id = company_cache.get(name)
+    if company_id is None:
+        with timed_db('get_or_insert_company'):
+            company_id = get_or_insert_company(name=name).id
+        company_cache.put(name, company_id)
+    return company_id
+
+
 def update_database(data, url):
+    # Returns False when the parcel's data couldn't be written, so it isn't fingerprinted as done
+    written = True
     # First update metadata table
     # print(f"Grantor: {data['grantor']}")
     # print(f"Price: {data['price']}")
     try:
-        progress = CrawlerProgress(curr_url=url, next_url=data['next_url'])
-        db.session.add(progress)
-        db.session.commit()
+        with timed_db('insert_progress'):
+            progress = CrawlerProgress(curr_url=url, next_url=data['next_url'])
+            db.session.add(progress)
+            db.session.commit()
 
     except Exception as e:
         print(f"Exception from update_database : {e}")
@@ -98,65 +166,98 @@ def update_database(data, url):
     # Case: Owner is an LLC
     if ('LLC' in data['owner_name']):
         print('Case: Owner is LLC')
-        company = get_or_insert_company(name=data['owner_name'])
+        company_id = get_or_insert_company_id(name=data['owner_name'])
 
         # SubCase: Owner of LLC was the prev grantor
         if int(data['price']) == 0:
             # print('Owner of LLC was the prev grantor')
-            owner = get_or_insert_owner(name=data['grantor'], address=data['owner_address'])
+            owner_id = get_or_insert_owner_id(name=data['grantor'], address=data['owner_address'])
             # print(f'Owner: {owner}')
             # Try to update the owner_company table to make sure their is an association between person and company.
             try:
-                owner_company = OwnerCompany(owner_id = owner.id, company_id = company.id)
-                # print(f"owner_company: {owner_company}")
-                db.session.add(owner_company)
-                db.session.commit()
+                with timed_db('insert_owner_company'):
+                    owner_company = OwnerCompany(owner_id = owner_id, company_id = company_id)
+                    # print(f"owner_company: {owner_company}")
+                    db.session.add(owner_company)
+                    db.session.commit()
 
             except IntegrityError:
                 # If pairing already exist IntegrityError raised
                 db.session.rollback()
 
-            # Try to insert property instance to property table 
+
+            # Try to insert property instance to property table, or move the stored one to its new owner
             try:
-                property = Property(address = data['property_address'], 
-                                    owner_id = owner.id, 
-                                    llc_id = company.id)
-                print(f"property: {property}")
-                db.session.add(property)
-                db.session.commit()
+                with timed_db('insert_property'):
+                    property = {'address': data['property_address'], 'owner_id': owner_id, 'llc_id': company_id}
+                    print(f"property: {property}")
+                    # Counted in the same transaction
+                    write_properties([property])
+                    db.session.commit()
             
             except Exception as e:
                 db.session.rollback()
                 print(f"Exception from update_database : {e}")
+                written = False
+
+        # SubCase: LLC bought it from someone else, a stored property is moved to the LLC
+        else:
+            try:
+                with timed_db('insert_property'):
+                    write_properties([], transfers=[{'address': data['property_address'], 'owner_id': None,
+                                                     'llc_id': company_id}])
+                    db.session.commit()
+
+            except Exception as e:
+                db.session.rollback()
+                print(f"Exception from update_database : {e}")
+                written = False
             
     # Case: Owner isn't an LLC
     elif not ('LLC' in data['owner_name']):
         # print('Case: Owner is not a LLC, should see this!')
         try:
-            owner = get_or_insert_owner(name = data['owner_name'], address = data['owner_address'])
-            property = Property(address = data['property_address'], owner_id = owner.id)
-            print(f"property: {property}")
-            # Don't have to add owner to the session because get_or_insert_owner will have dealt w/ it.
-            db.session.add(property)
-            db.session.commit()
+            owner_id = get_or_insert_owner_id(name = data['owner_name'], address = data['owner_address'])
+            with timed_db('insert_property'):
+                property = {'address': data['property_address'], 'owner_id': owner_id, 'llc_id': None}
+                print(f"property: {property}")
+                # Don't have to add owner to the session because get_or_insert_owner will have dealt w/ it.
+                write_properties([property])
+                db.session.commit()
         
         except Exception as e:
             db.session.rollback()
             print(f"Exception from update_database : {e}")
+            written = False
 
     # In all other cases
     else:
         print("Update Database did not work. Check Database CrawlerProgress table to see how far it got.")
-        
+
+    # Cached API responses built from the old data are stale from here on
+    try:
+        with timed_db('bump_generation'):
+            bump_generation()
+            db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Exception from update_database : {e}")
+    return written
+
 # Crawler
-def crawler(url, index=100):
+def crawler(url, index=100, max_skips=25, delay=2):
     """
     Will crawl across the Washoe Assessor site scraping data from each url it crosses, the data will 
     be plugged into the database, and then will go to the next url until the idx is met.
+    Writes go through make_writer(1), so parcels whose data hasn't changed since the last crawl aren't written again.
 
     Parameters:
     - url (str) : URL from washoe site.
     - idx (int) : Integer that will determine how many times the loop is run, default is 100.
+    - max_skips (int) : Parcels in a row that may come back empty before the crawl stops, default is 25.
+                        Skipped parcels go in the failed parcels table, same as in the concurrent crawl.
+    - delay (float) : Seconds to wait before each parcel, default is 2.
 
     Return:
     - Last URL (str) : Will return the last url reached.
@@ -165,33 +266,474 @@ def crawler(url, index=100):
     # Conditionals to check if parameters meet requirements
     current_url = url
     loop_count = 0
+    skipped = 0
+    write = make_writer(1)
+    failures = FailedParcels()
     if not (isinstance(current_url, str)) and not ('https://www.washoecounty.gov/assessor/cama/?parid=' in current_url):
         raise TypeError('URL needs to be a string or needs to start with https://www.washoecounty.gov/assessor/cama/?parid=')
     if not (isinstance(index, int)):
         raise TypeError('Index must be an integer')
 
-    # loop that crawls
-    while loop_count < index:
-        time.sleep(2)
-        loop_count += 1
-        data = scraper(current_url)
+    try:
+        # loop that crawls
+        while loop_count < index:
+            time.sleep(delay)
+            # Unchanged parcels' progress rows, the fingerprints and the failed parcels go in a batch at a time
+            if loop_count and loop_count % write.batch_size == 0:
+                write.flush()
+                failures.flush()
+            loop_count += 1
+            data = scraper(current_url)
 
-        if None in data.values():
-            return ("Incomplete Scrape", current_url)
+            if not data or None in data.values():
+                # Counting up the parid sequence lands on parids that don't exist, step over a few before giving up
+                page_counter.inc('incomplete')
+                # The resume point moves past it with the next write, the table keeps it
+                if data:
+                    failures.missing(current_url)
+                else:
+                    failures.failed(current_url)
+                skipped += 1
+                next_url = find_next_url(current_url, use_browser=use_browser_for_next_url)
+                if skipped > max_skips or next_url is None:
+                    return ("Incomplete Scrape", current_url)
+                current_url = next_url
+                continue
+            skipped = 0
         
-        if loop_count % 10 == 0:
-            print(current_url)
+            if loop_count % 10 == 0:
+                print(current_url)
         
+            try:
+                with timed('write'):
+                    written = write(data, current_url)
+                page_counter.inc('written')
+                if written is False:
+                    failures.failed(current_url)
+                else:
+                    failures.written(current_url)
+
+            except Exception as e:
+                page_counter.inc('error')
+                print(f"Exception in Crawler: {e}")
+                print(f"{current_url}")
+                failures.failed(current_url)
+
+            finally:
+                current_url = data['next_url']
+
+        return current_url
+    finally:
+        write.flush()
+        failures.flush()
+        # Chromium outlives the process otherwise
+        close_renderer_pool()
+
+
+def concurrent_crawler(url, index=100, concurrency=4, rate=1.0, batch_size=100, parsers=2, archive=None,
+                       retry_missing=False):
+    """
+    Crawls the next `index` parcels of the parid sequence starting at url with several parcels in flight.
+    Fetching, parsing and writing run as separate stages, pages are written in parid order.
+
+    Parameters:
+    - url (str) : URL from washoe site.
+    - index (int) : Number of parcels to crawl, default is 100.
+    - concurrency (int) : Number of parcels fetched at the same time, default is 4.
+    - rate (float) : Most requests per second sent to the assessor site, default is 1.
+    - batch_size (int) : Parcels written per transaction, 1 writes each one with update_database, default is 100.
+    - parsers (int) : Processes parsing fetched pages, default is 2.
+    - archive (str) : Directory of a PageArchive every fetched page is also saved to, default is None.
+    - retry_missing (bool) : Also retries the parcels whose pages came back without data, default is False.
+
+    Return:
+    - Last URL (str) : The next_url of the last parcel written.
+    """
+    if not (isinstance(index, int)):
+        raise TypeError('Index must be an integer')
+    # Every page knows its successor up front, so the Selenium next-page lookup isn't needed here
+    following = parcel_url_sequence(url)
+    next(following)
+    pages = islice(zip(parcel_url_sequence(url), following), index)
+    limiter = HostRateLimiter(rate=rate)
+    parse_executor = start_parse_executor(parsers)
+    # One pooled page per worker thread, the pool is shared so the browser starts only once
+    if fetch_backend == 'render':
+        get_renderer_pool(size=concurrency)
+    fetch = fetch_page
+    if archive:
+        archive = PageArchive(archive)
+        fetch = archiving(fetch_page, archive)
+    try:
+        with parse_executor:
+            retry_failed_parcels(fetch, concurrency=concurrency, limiter=limiter, batch_size=batch_size,
+                                 parsers=parsers, parse_executor=parse_executor)
+            if retry_missing:
+                retry_failed_parcels(fetch, concurrency=concurrency, limiter=limiter, batch_size=batch_size,
+                                     parsers=parsers, parse_executor=parse_executor, missing=True)
+            stats = run_pipeline(pages, fetch, make_writer(batch_size), concurrency=concurrency, limiter=limiter,
+                                 parsers=parsers, parse_executor=parse_executor)
+    finally:
+        if archive:
+            print(f"Page archive: {archive.stats}")
+            archive.close()
+        close_renderer_pool()
+    return stats['last_url']
+
+
+def retry_failed_parcels(fetch, concurrency, limiter, batch_size, parsers, parse_executor, missing=False):
+    """
+    Crawls the parcels earlier crawls couldn't scrape (failed_parcels.py) again, without moving
+    the point the crawl resumes from. With missing, the parcels whose pages came back without data instead.
+
+    Return:
+    - Parcels (int) : Number of failed parcels retried.
+    """
+    urls = failed_urls(missing=missing)
+    if not urls:
+        return 0
+    print(f"Retrying {len(urls)} {'missing' if missing else 'failed'} parcels")
+    resume_url = get_starting_url()
+    pages = [(url, find_next_url(url)) for url in urls]
+    try:
+        run_pipeline(pages, fetch, make_writer(batch_size), concurrency=concurrency, limiter=limiter,
+                     parsers=parsers, parse_executor=parse_executor)
+    finally:
+        restore_starting_url(resume_url)
+    return len(urls)
+
+
+def replay_crawler(archive, index=None, batch_size=100, parsers=2):
+    """
+    Re-parses the latest archived page of every parcel in a PageArchive and writes it to the database,
+    same as concurrent_crawler but without touching the network, ex: after a change to the extraction logic.
+    Stored rows that differ from the re-parsed data are updated, even for parcels whose fingerprint hasn't
+    changed, and the point the crawl resumes from is left where it was.
+
+    Parameters:
+    - archive (str) : Directory of the PageArchive.
+    - index (int) : Most parcels to replay, default is every archived parcel.
+    - batch_size (int) : Parcels written per transaction, 1 writes each one with update_database, default is 100.
+    - parsers (int) : Processes parsing archived pages, default is 2.
+
+    Return:
+    - Last URL (str) : The next_url of the last parcel written.
+    """
+    # Where the full crawl resumes, the replayed parcels' progress rows shouldn't move it
+    resume_url = get_starting_url()
+    parse_executor = start_parse_executor(parsers)
+    archive = PageArchive(archive)
+    urls = archive.urls()
+    # The next archived parcel stands in for next_url
+    following = urls[1:] + [find_next_url(urls[-1]) if urls else None]
+    pages = islice(zip(urls, following), index)
+    try:
+        # Reads are local, a couple of threads are enough to keep the parsers busy
+        with parse_executor:
+            # Every parcel is written, stored rows that don't match the re-parsed data are updated
+            stats = run_pipeline(pages, archive.get_page, make_writer(batch_size, rewrite=True), concurrency=2,
+                                 limiter=None, parsers=parsers, parse_executor=parse_executor)
+    finally:
+        archive.close()
+        restore_starting_url(resume_url)
+    return stats['last_url']
+
+
+def recrawl_crawler(url, budget, concurrency=4, rate=1.0, batch_size=100, parsers=2, archive=None):
+    """
+    Refresh pass over parcels that were crawled before. Spends `budget` pages on the parcels most likely
+    to have changed (recrawl.schedule_recrawl) and only writes the ones whose data did change.
+
+    Parameters:
+    - url (str) : Any assessor url, the scheduled parids are swapped into it.
+    - budget (int) : Number of parcels to re-crawl.
+    - concurrency (int) : Number of parcels fetched at the same time, default is 4.
+    - rate (float) : Most requests per second sent to the assessor site, default is 1.
+    - batch_size (int) : Parcels written per transaction, 1 writes each one with update_database, default is 100.
+    - parsers (int) : Processes parsing fetched pages, default is 2.
+    - archive (str) : Directory of a PageArchive every fetched page is also saved to, default is None.
+
+    Return:
+    - Parcels (dict) : {'new', 'changed', 'unchanged'} counts.
+    """
+    if not (isinstance(budget, int)):
+        raise TypeError('Budget must be an integer')
+    # Where the full crawl resumes, the refresh pass shouldn't move it
+    resume_url = get_starting_url()
+    urls = [set_parid(url, parid) for parid in schedule_recrawl(budget)]
+    pages = [(page_url, find_next_url(page_url)) for page_url in urls]
+    limiter = HostRateLimiter(rate=rate)
+    parse_executor = start_parse_executor(parsers)
+    if fetch_backend == 'render':
+        get_renderer_pool(size=concurrency)
+    fetch = fetch_page
+    if archive:
+        archive = PageArchive(archive)
+        fetch = archiving(fetch_page, archive)
+    write = make_writer(batch_size)
+    try:
+        with parse_executor:
+            run_pipeline(pages, fetch, write, concurrency=concurrency, limiter=limiter,
+                         parsers=parsers, parse_executor=parse_executor)
+    finally:
+        if archive:
+            print(f"Page archive: {archive.stats}")
+            archive.close()
+        close_renderer_pool()
+        # The latest progress row is where the full crawl resumes, point it back where it was
+        restore_starting_url(resume_url)
+    return write.stats
+
+
+def sharded_crawler(worker=None, concurrency=4, rate=1.0, batch_size=100, parsers=2, lease_seconds=300, archive=None):
+    """
+    Claims shards planned with shard_leases.plan_shards() one after another and crawls each like concurrent_crawler,
+    until every shard is done or leased to another worker. Any number of these can run at once, on any machine
+    that reaches the database.
+
+    Parameters:
+    - worker (str) : Name of this worker, default is host:pid.
+    - concurrency (int) : Number of parcels fetched at the same time, default is 4.
+    - rate (float) : Most requests per second this worker sends to the assessor site, default is 1.
+    - batch_size (int) : Parcels written per transaction, 1 writes each one with update_database, default is 100.
+    - parsers (int) : Processes parsing fetched pages, default is 2.
+    - lease_seconds (int) : How long a shard stays leased without a heartbeat, default is 300.
+    - archive (str) : Directory of a PageArchive every fetched page is also saved to, default is None.
+
+    Return:
+    - Shards (int) : Number of shards this worker finished.
+    """
+    worker = worker or default_worker_name()
+    parse_executor = start_parse_executor(parsers)
+    if fetch_backend == 'render':
+        get_renderer_pool(size=concurrency)
+    fetch = fetch_page
+    if archive:
+        archive = PageArchive(archive)
+        fetch = archiving(fetch_page, archive)
+    finished = 0
+    try:
+        with parse_executor:
+            while True:
+                shard = claim_shard(worker, lease_seconds=lease_seconds)
+                if shard is None:
+                    break
+                print(f"{worker} claimed shard {shard.id}: {shard.next_parid} to {shard.end_parid}")
+                if crawl_shard(shard, worker, fetch, concurrency=concurrency, rate=rate, batch_size=batch_size,
+                               parsers=parsers, parse_executor=parse_executor, lease_seconds=lease_seconds):
+                    finished += 1
+    finally:
+        if archive:
+            print(f"Page archive: {archive.stats}")
+            archive.close()
+        close_renderer_pool()
+    print(f"{worker} finished {finished} shards, all shards: {shard_progress()}")
+    return finished
+
+
+def crawl_shard(shard, worker, fetch, concurrency, rate, batch_size, parsers, parse_executor, lease_seconds):
+    """
+    Crawls what's left of a leased shard. A LeaseTimer keeps the lease alive, and every third of the lease the
+    crawl heartbeats the parid it got up to. A shard left unfinished, ex: on Ctrl-C, is released for another worker.
+
+    Return:
+    - Done (bool) : True if the shard was finished, False if its lease was lost on the way.
+    """
+    write = make_writer(batch_size)
+    # next_parid is the first parid after the last page written, pages skipped after it are simply redone on resume
+    lease = {'next_parid': None, 'pages': 0, 'beat': time.monotonic(), 'lost': False}
+    timer = LeaseTimer(shard, worker, lease_seconds, app).start()
+
+    def checkpoint(done=False):
+        # The heartbeat vouches for every page before next_parid, so buffered writes go in first
+        write.flush()
         try:
-            update_database(data, current_url)
+            heartbeat(shard, worker, next_parid=shard.end_parid if done else lease['next_parid'],
+                      pages=lease['pages'], lease_seconds=lease_seconds, done=done)
+            lease['pages'] = 0
+        except LeaseLost as e:
+            print(f"Exception from crawl_shard : {e}")
+            lease['lost'] = True
+        lease['beat'] = time.monotonic()
 
-        except Exception as e:
-            print(f"Exception in Crawler: {e}")
-            print(f"{current_url}")
+    def leased_write(data, url):
+        # On the crawl's write thread, after every write before it, so it can heartbeat
+        lease['pages'] += 1
+        lease['next_parid'] = get_parid(data['next_url'])
+        if time.monotonic() - lease['beat'] > lease_seconds / 3:
+            checkpoint()
+
+    def leased_pages():
+        # Pulled by the fetchers on the event loop thread
+        for page in shard_pages(shard):
+            if lease['lost'] or timer.lost:
+                # Another worker owns the shard now, stop handing out its pages
+                return
+            yield page
+
+    done = False
+    try:
+        # Token buckets are tied to the event loop they were first used on, every shard gets its own loop
+        run_pipeline(leased_pages(), fetch, write, concurrency=concurrency, limiter=HostRateLimiter(rate=rate),
+                     parsers=parsers, parse_executor=parse_executor, on_write=leased_write)
+        timer.stop()
+        if lease['lost'] or timer.lost:
+            return False
+        checkpoint(done=True)
+        done = not lease['lost']
+        return done
+    finally:
+        timer.stop()
+        if not done and not lease['lost'] and not timer.lost:
+            # Saves how far it got and gives the lease up, so another worker resumes the shard right away
+            try:
+                checkpoint()
+                release_shard(shard, worker)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Exception from crawl_shard : {e}")
+
+
+def start_parse_executor(parsers):
+    """
+    Starts the parse processes. Parsing is CPU-bound so it gets processes, they're all started up front,
+    before the browser and fetch threads exist, because forking a process that has threads can deadlock it.
+    """
+    parse_executor = ProcessPoolExecutor(max_workers=parsers)
+    list(parse_executor.map(abs, range(parsers)))
+    return parse_executor
+
+
+def make_writer(batch_size, rewrite=False):
+    """
+    Returns the crawl's database writer: update_database for a batch_size of 1, otherwise a BatchWriter that
+    falls back on it, behind a FingerprintWriter that skips parcels whose data hasn't changed, unless rewrite.
+    """
+    write = update_database if batch_size <= 1 else BatchWriter(batch_size=batch_size, fallback=update_database)
+    return FingerprintWriter(write, batch_size=max(batch_size, 100), rewrite=rewrite)
+
+
+def resolve_written():
+    """Resolves the owners the crawl's writes added to their entities, then gives them and their LLC links a portfolio."""
+    with timed_db('resolve_new_owners'):
+        resolve_new_owners()
+    with timed_db('update_portfolios'):
+        update_portfolios()
+
+
+def push_app_context():
+    """Gives a worker thread an app context of its own, and with it a database session of its own."""
+    app.app_context().push()
+
+
+def run_pipeline(pages, fetch, write, concurrency, limiter, parsers, parse_executor, on_write=None):
+    """
+    Runs async_crawler.crawl() over pages with a make_writer() writer, flushes it and prints the crawl's stats.
+    Parcels that couldn't be scraped or written go in the failed parcels table with each batch the writer flushes.
+    The writes, failed parcels and entity and portfolio updates all run on the crawl's write thread.
+    on_write(data, url) is called there after each parcel is handed to the writer, ex: to track a shard's progress.
+    """
+    # The fetch threads are the most requests that can be in flight, the adaptive limit works its way up to them
+    site_limiter.set_max_limit(concurrency)
+    failures = FailedParcels()
+
+    handed = {'parcels': 0}
+
+    def write_parcel(data, url):
+        write(data, url)
+        if on_write is not None:
+            on_write(data, url)
+        handed['parcels'] += 1
+        # The owners and links of every written batch get their entities and portfolios as the crawl goes
+        if handed['parcels'] % write.batch_size == 0:
+            write.flush()
+            failures.flush()
+            resolve_written()
 
+    def finish():
+        write.flush()
+        failures.flush()
+        resolve_written()
+        # The thread's session goes back to the pool before the thread ends
+        db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            ThreadPoolExecutor(max_workers=1, initializer=push_app_context) as write_executor:
+        try:
+            stats = asyncio.run(crawl(pages, write_parcel, fetch, parse=parse_page, concurrency=concurrency,
+                                      parsers=parsers, limiter=limiter, executor=executor,
+                                      parse_executor=parse_executor, failures=failures,
+                                      write_executor=write_executor))
         finally:
-            current_url = data['next_url']
-    
-    return current_url
+            # Queued behind any write the thread is still busy with
+            write_executor.submit(finish).result()
+    stages = stats.pop('stages')
+    print(f"Crawl finished: {stats}")
+    print(f"Stage latencies: {stages}")
+    print(f"Parcels written: {write.stats}, failed parcels: {failures.stats}")
+    print(f"Owner cache: {owner_cache.stats()}, company cache: {company_cache.stats()}")
+    print(f"Site limit: {site_limiter.limit:.1f} {site_limiter.stats}, circuit breaker: {site_breaker.state} {site_breaker.stats}")
+    return stats
+
 
-crawler(starting_url)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crawls the Washoe Assessor site into the database.')
+    parser.add_argument('--url', default=None, help='URL to start from, defaults to where the last crawl stopped.')
+    parser.add_argument('--index', type=int, default=None,
+                        help='Number of parcels to crawl, default is 100 (every saved page with --replay).')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('CRAWL_CONCURRENCY', 4)),
+                        help='Parcels in flight, 1 runs the original sequential crawler.')
+    parser.add_argument('--rate', type=float, default=float(os.environ.get('CRAWL_RATE', 1.0)),
+                        help='Most requests per second sent to the assessor site, 0 for no limit.')
+    parser.add_argument('--parsers', type=int, default=int(os.environ.get('CRAWL_PARSERS', 2)),
+                        help='Processes parsing fetched pages in concurrent mode.')
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('CRAWL_BATCH_SIZE', 100)),
+                        help='Parcels written per transaction in concurrent mode.')
+    parser.add_argument('--archive', default=os.environ.get('PAGE_ARCHIVE'),
+                        help='Directory every fetched page is also saved to in concurrent mode.')
+    parser.add_argument('--replay', default=None,
+                        help='Directory of saved pages to parse again instead of crawling, --index limits how many.')
+    parser.add_argument('--plan-shards', type=int, default=None, metavar='COUNT',
+                        help='Splits the next COUNT parids from --url into shards for --worker processes, then exits.')
+    parser.add_argument('--shard-size', type=int, default=1000, help='Parids per shard for --plan-shards.')
+    parser.add_argument('--worker', nargs='?', const='', default=None, metavar='NAME',
+                        help='Crawls planned shards until none are left, alongside any other workers. NAME defaults to host:pid.')
+    parser.add_argument('--lease-seconds', type=int, default=int(os.environ.get('CRAWL_LEASE_SECONDS', 300)),
+                        help='How long a worker keeps a shard without a heartbeat before another worker can take it.')
+    parser.add_argument('--retry-missing', action='store_true',
+                        help='Also retries the parcels whose pages came back without data before crawling.')
+    parser.add_argument('--recrawl', type=int, default=None, metavar='BUDGET',
+                        help='Refresh pass, re-crawls the BUDGET parcels most likely to have changed and writes only the changed ones.')
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('METRICS_PORT', 0)) or None,
+                        help='Serves Prometheus metrics on http://0.0.0.0:PORT/metrics while crawling.')
+    parser.add_argument('--summary-every', type=int, default=int(os.environ.get('METRICS_SUMMARY_SECONDS', 60)),
+                        help='Seconds between metric summaries in the log, 0 for none.')
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    if args.summary_every:
+        start_summary_log(args.summary_every)
+    if args.plan_shards:
+        added = plan_shards(args.url or first_url, args.plan_shards, shard_size=args.shard_size)
+        print(f"Added {added} shards, all shards: {shard_progress()}")
+        raise SystemExit
+    warm_caches(db)
+    if args.worker is not None:
+        sharded_crawler(worker=args.worker or None, concurrency=args.concurrency, rate=args.rate,
+                        batch_size=args.batch_size, parsers=args.parsers, lease_seconds=args.lease_seconds,
+                        archive=args.archive)
+    elif args.recrawl:
+        recrawl_crawler(args.url or first_url, args.recrawl, concurrency=args.concurrency, rate=args.rate,
+                        batch_size=args.batch_size, parsers=args.parsers, archive=args.archive)
+    elif args.replay:
+        replay_crawler(args.replay, index=args.index, batch_size=args.batch_size, parsers=args.parsers)
+    elif args.concurrency > 1:
+        concurrent_crawler(args.url or get_starting_url(), index=args.index or 100, concurrency=args.concurrency,
+                           rate=args.rate, batch_size=args.batch_size, parsers=args.parsers, archive=args.archive,
+                           retry_missing=args.retry_missing)
+    else:
+        crawler(args.url or get_starting_url(), index=args.index or 100)
+        # The concurrent modes resolve after each batch they write
+        resolve_written()
+    print(summary())
@@ -0,0 +1,355 @@
+# Imports
+import re
+from collections import Counter, defaultdict
+from sqlalchemy import insert, update, func
+from modules import Owner, OwnerEntity, db
+from sql_helpers import chunks
+from generation import bump_generation
+
+# Entity resolution of owners. Owner.address is the owner table's unique key, so '123 MAIN ST' and
+# '123 MAIN STREET' are two owners. Each owner gets a cluster_id in owner_entity, the smallest owner id of the
+# owners that are the same entity, so the API can group by it:
+# - Names and addresses are normalized first: upper case, no punctuation, street suffixes, directions and
+#   unit designators abbreviated the USPS way, 'POST OFFICE BOX' -> 'PO BOX'. 'NO' and '#' are only a unit,
+#   'APT', after the street suffix and before a number, elsewhere 'NO' is a street word ('456 NO NAME RD').
+#   Equal normalized addresses are the same owner, as equal addresses are in the owner table.
+# - Owners are only compared within a block, same house number, street initial and zip code, so the number of
+#   comparisons stays near the number of owners instead of its square.
+# - Within a block, each owner is scored against all the others at once from an inverted index of address
+#   trigrams, and owners whose address and name trigrams are both similar enough are the same entity.
+# resolve_owners() resolves the whole table, resolve_new_owners() only the owners a crawl batch added.
+
+# Least trigram Jaccard similarity of the normalized addresses and names of two owners of a block to merge them
+ADDRESS_SIMILARITY = 0.75
+NAME_SIMILARITY = 0.5
+
+# Owners read per query while resolving the whole table
+LOAD_BATCH = 50000
+
+# resolve_new_owners() looks for unresolved owners among the ids after the last resolved one minus this many,
+# owners committed out of id order by concurrent crawl workers are still found
+NEW_OWNER_WINDOW = 10000
+
+# Words replaced with their abbreviation in addresses
+ADDRESS_WORDS = {
+    'STREET': 'ST', 'STR': 'ST', 'AVENUE': 'AVE', 'AV': 'AVE', 'BOULEVARD': 'BLVD', 'DRIVE': 'DR', 'LANE': 'LN',
+    'ROAD': 'RD', 'COURT': 'CT', 'PLACE': 'PL', 'CIRCLE': 'CIR', 'PARKWAY': 'PKWY', 'HIGHWAY': 'HWY',
+    'TERRACE': 'TER', 'TRAIL': 'TRL', 'SQUARE': 'SQ', 'MOUNTAIN': 'MTN', 'CANYON': 'CYN', 'CREEK': 'CRK',
+    'HEIGHTS': 'HTS', 'POINT': 'PT', 'LOOP': 'LOOP', 'WAY': 'WAY',
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+    'APARTMENT': 'APT', 'UNIT': 'APT', 'SUITE': 'STE', 'BUILDING': 'BLDG', 'FLOOR': 'FL',
+}
+
+# Abbreviated street suffixes, a unit number comes after one of them
+STREET_SUFFIXES = {'ST', 'AVE', 'BLVD', 'DR', 'LN', 'RD', 'CT', 'PL', 'CIR', 'PKWY', 'HWY', 'TER', 'TRL', 'SQ',
+                   'LOOP', 'WAY'}
+
+# Words that are a unit designator when they come after the street suffix and before a number, ex: 'MAIN ST NO 4'
+UNIT_WORDS = {'NO', '#'}
+
+# Words dropped from names, they vary between records of the same person or trust
+NAME_NOISE = {'JR', 'SR', 'II', 'III', 'IV', 'ETAL', 'ET', 'AL', 'TR', 'TRUST', 'TRUSTEE', 'TRUSTEES',
+              'FAMILY', 'LIVING', 'REVOCABLE', 'THE', 'AND'}
+
+NON_WORD = re.compile(r'[^A-Z0-9# ]+')
+PO_BOX = re.compile(r'\b(?:P ?O|POST OFFICE|POST OFC)\s+BOX\b')
+UNIT = re.compile(r'#')
+ZIP_CODE = re.compile(r'^\d{5}$')
+
+
+def normalize_address(address):
+    """
+    Normalized form of a mail address, ex: '123 Main Street, Apt. #4 Reno, NV 89501-1234' -> '123 MAIN ST APT 4 RENO NV 89501'.
+
+    Parameters:
+    - address (str) : Address as scraped.
+
+    Return:
+    - address (str) : Normalized address, '' for None.
+    """
+    if not address:
+        return ''
+    address = address.upper().replace('.', '')
+    # ZIP+4 loses its +4, and '-' between words becomes a space
+    address = re.sub(r'\b(\d{5})-\d{4}\b', r'\1', address)
+    address = NON_WORD.sub(' ', address)
+    address = PO_BOX.sub('PO BOX', address)
+    # '#4' is two words, the unit designator and its number
+    address = UNIT.sub(' # ', address)
+    words = [ADDRESS_WORDS.get(word, word) for word in address.split()]
+    suffix = next((position for position, word in enumerate(words) if position and word in STREET_SUFFIXES), None)
+    words = [unit_word(words, position, suffix) for position in range(len(words))]
+    words = [word for word in words if word != '#']
+    # 'APT APT 4' from 'UNIT #4'
+    words = [word for position, word in enumerate(words) if not (word == 'APT' and position and words[position - 1] == 'APT')]
+    return ' '.join(words)
+
+
+def unit_word(words, position, suffix):
+    """
+    The word at position of a normalized address, 'APT' for a 'NO' or '#' that's a unit designator.
+
+    Parameters:
+    - words (list) : Address words, with ADDRESS_WORDS applied.
+    - position (int) : Word's position.
+    - suffix (int) : Position of the street suffix, None when there's none.
+
+    Return:
+    - word (str) : The word, '#' when it's a '#' that isn't a unit designator.
+    """
+    word = words[position]
+    if word not in UNIT_WORDS or suffix is None or position <= suffix:
+        return word
+    following = words[position + 1] if position + 1 < len(words) else ''
+    return 'APT' if following[:1].isdigit() else word
+
+
+def normalize_name(name):
+    """
+    Normalized form of an owner's name, its words sorted so 'SMITH, JOHN' and 'JOHN SMITH' are the same,
+    ex: 'Smith, John Jr.' -> 'JOHN SMITH'.
+
+    Parameters:
+    - name (str) : Name as scraped.
+
+    Return:
+    - name (str) : Normalized name, '' for None.
+    """
+    if not name:
+        return ''
+    words = NON_WORD.sub(' ', name.upper().replace('.', '').replace('#', ' ')).split()
+    return ' '.join(sorted(word for word in words if word not in NAME_NOISE))
+
+
+def block_key(address_key):
+    """
+    Blocking key of a normalized address: house number or PO box number, street initial and zip code,
+    ex: '123 MAIN ST RENO NV 89501' -> '123 M 89501', 'PO BOX 1890 SPARKS NV 89436' -> '1890 B 89436'.
+    Addresses without a zip code use their last word, usually the state.
+    """
+    words = address_key.split()
+    if not words:
+        return ''
+    if words[:2] == ['PO', 'BOX'] and len(words) > 2:
+        number, street = words[2], 'B'
+    else:
+        number = words[0] if words[0][:1].isdigit() else ''
+        street = next((word[0] for word in words[1 if number else 0:] if word not in ADDRESS_WORDS.values()), '')
+    place = next((word for word in reversed(words) if ZIP_CODE.match(word)), words[-1])
+    return f"{number} {street} {place}"
+
+
+def trigrams(text):
+    """Set of the 3 character substrings of text padded with spaces, ex: 'AB' -> {'  A', ' AB', 'AB '}."""
+    padded = f"  {text} "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class UnionFind:
+    """Disjoint sets of ids, the root of each set is its smallest id."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, id):
+        root = self.parent.setdefault(id, id)
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Points the path straight at the root, the next find is one step
+        while id != root:
+            self.parent[id], id = root, self.parent[id]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            # The larger root joins the smaller, so every root is its set's smallest id
+            if b < a:
+                a, b = b, a
+            self.parent[b] = a
+
+    def roots(self):
+        """Returns {id: root} of every id seen."""
+        return {id: self.find(id) for id in self.parent}
+
+
+def match_block(records, sets):
+    """
+    Unions the owners of a block that are the same entity.
+
+    Parameters:
+    - records (list) : (owner_id, address_key, name_key) of the block's owners.
+    - sets (UnionFind) : Sets the matches are added to.
+    """
+    by_address = {}
+    for owner_id, address_key, name_key in records:
+        # Same normalized address, same owner
+        if address_key in by_address:
+            sets.union(by_address[address_key], owner_id)
+        else:
+            by_address[address_key] = owner_id
+    if len(by_address) < 2:
+        return
+    # One record per distinct address, scored against all the others at once: the trigram postings give the
+    # size of every intersection, so only pairs sharing a trigram are looked at
+    distinct = [(owner_id, address_key, trigrams(address_key)) for address_key, owner_id in by_address.items()]
+    names = {owner_id: name_key for owner_id, address_key, name_key in records}
+    postings = defaultdict(list)
+    for number, (owner_id, address_key, grams) in enumerate(distinct):
+        for gram in grams:
+            postings[gram].append(number)
+    for number, (owner_id, address_key, grams) in enumerate(distinct):
+        shared = Counter()
+        for gram in grams:
+            shared.update(other for other in postings[gram] if other > number)
+        for other, common in shared.items():
+            other_id, other_key, other_grams = distinct[other]
+            if common / (len(grams) + len(other_grams) - common) < ADDRESS_SIMILARITY:
+                continue
+            if jaccard(trigrams(names[owner_id]), trigrams(names[other_id])) >= NAME_SIMILARITY:
+                sets.union(owner_id, other_id)
+
+
+def owner_keys(rows):
+    """(owner_id, address_key, name_key, block_key) of (id, full_name, address) owner rows."""
+    for id, full_name, address in rows:
+        address_key = normalize_address(address)
+        yield id, address_key, normalize_name(full_name), block_key(address_key)
+
+
+def resolve_owners():
+    """
+    Batch mode, resolves every owner from scratch and rewrites owner_entity.
+
+    Return:
+    - (owners, clusters) (tuple) : Number of owners and of distinct entities.
+    """
+    blocks = defaultdict(list)
+    keys = {}
+    after = 0
+    while True:
+        rows = (db.session.query(Owner.id, Owner.full_name, Owner.address)
+                .filter(Owner.id > after).order_by(Owner.id).limit(LOAD_BATCH).all())
+        if not rows:
+            break
+        for id, address_key, name_key, block in owner_keys(rows):
+            blocks[block].append((id, address_key, name_key))
+            keys[id] = (address_key, block)
+        after = rows[-1][0]
+    sets = UnionFind()
+    for records in blocks.values():
+        for id, address_key, name_key in records:
+            sets.find(id)
+        match_block(records, sets)
+    roots = sets.roots()
+    db.session.query(OwnerEntity).delete()
+    rows = [{'owner_id': id, 'cluster_id': roots[id], 'address_key': address_key, 'block_key': block}
+            for id, (address_key, block) in sorted(keys.items())]
+    for chunk in chunks(rows, LOAD_BATCH):
+        db.session.execute(insert(OwnerEntity), chunk)
+    bump_generation()
+    db.session.commit()
+    return len(rows), len(set(roots.values()))
+
+
+def resolve_new_owners():
+    """
+    Incremental mode, resolves the owners that have no owner_entity row yet against the resolved owners of
+    their blocks, merging clusters a new owner links together. Called after each crawl batch is written.
+
+    Return:
+    - owners (int) : Number of owners resolved.
+    """
+    try:
+        last = db.session.query(func.max(OwnerEntity.owner_id)).scalar() or 0
+        rows = (db.session.query(Owner.id, Owner.full_name, Owner.address)
+                .outerjoin(OwnerEntity, OwnerEntity.owner_id == Owner.id)
+                .filter(Owner.id > last - NEW_OWNER_WINDOW, OwnerEntity.owner_id.is_(None))
+                .order_by(Owner.id).all())
+        if not rows:
+            return 0
+        new = list(owner_keys(rows))
+        blocks = sorted({block for id, address_key, name_key, block in new})
+        addresses = sorted({address_key for id, address_key, name_key, block in new})
+        # The resolved owners the new ones could match, with their clusters
+        known = {}
+        candidates = (db.session.query(OwnerEntity.owner_id, OwnerEntity.address_key, Owner.full_name,
+                                       OwnerEntity.block_key, OwnerEntity.cluster_id)
+                      .join(Owner, Owner.id == OwnerEntity.owner_id))
+        for column, values in ((OwnerEntity.block_key, blocks), (OwnerEntity.address_key, addresses)):
+            for chunk in chunks(values):
+                known.update((row.owner_id, row) for row in candidates.filter(column.in_(chunk)))
+        known = list(known.values())
+        sets = UnionFind()
+        by_block = defaultdict(dict)
+        for owner_id, address_key, full_name, block, cluster_id in known:
+            sets.union(cluster_id, owner_id)
+            by_block[block][owner_id] = (owner_id, address_key, normalize_name(full_name))
+        by_address = {address_key: owner_id for owner_id, address_key, full_name, block, cluster_id in known}
+        for id, address_key, name_key, block in new:
+            sets.find(id)
+            by_block[block][id] = (id, address_key, name_key)
+            # A resolved owner with the same address in another block, ex: one crawled before a blocking change
+            if address_key in by_address:
+                sets.union(by_address[address_key], id)
+        for records in by_block.values():
+            match_block(list(records.values()), sets)
+        roots = sets.roots()
+        # Existing clusters a new owner joined to a smaller one are renumbered
+        moved = defaultdict(list)
+        for cluster_id in {cluster_id for owner_id, address_key, full_name, block, cluster_id in known}:
+            if roots[cluster_id] != cluster_id:
+                moved[roots[cluster_id]].append(cluster_id)
+        for root, cluster_ids in sorted(moved.items()):
+            db.session.execute(update(OwnerEntity).where(OwnerEntity.cluster_id.in_(cluster_ids))
+                               .values(cluster_id=root))
+        db.session.execute(insert(OwnerEntity), [
+            {'owner_id': id, 'cluster_id': roots[id], 'address_key': address_key, 'block_key': block}
+            for id, address_key, name_key, block in new])
+        bump_generation()
+        db.session.commit()
+        return len(new)
+
+    except Exception as e:
+        # The owners stay unresolved until the next batch or resolve_owners()
+        db.session.rollback()
+        print(f"Exception from resolve_new_owners : {e}")
+        return 0
+
+
+def ensure_owner_entities():
+    """Resolves the owners of a database that has owners but no owner_entity rows yet, ex: one crawled before entity resolution."""
+    if db.session.query(OwnerEntity.owner_id).first() is None and db.session.query(Owner.id).first() is not None:
+        resolve_owners()
+
+
+def owner_entity(cluster_id):
+    """
+    The owners of an entity.
+
+    Parameters:
+    - cluster_id (int) : Entity's cluster_id.
+
+    Return:
+    - Dictionary : {cluster_id, owners: [{id, full_name, address}, ...]} owners in id order.
+    - Null : None when there's no such entity.
+    """
+    rows = (db.session.query(Owner.id, Owner.full_name, Owner.address)
+            .join(OwnerEntity, OwnerEntity.owner_id == Owner.id)
+            .filter(OwnerEntity.cluster_id == cluster_id).order_by(Owner.id).all())
+    if not rows:
+        return None
+    return {"cluster_id": cluster_id,
+            "owners": [{"id": o.id, "full_name": o.full_name, "address": o.address} for o in rows]}
+
+
+if __name__ == '__main__':
+    # python entity_resolution.py resolves every owner of the database at DATABASE_URL
+    from app import app
+    owners, clusters = resolve_owners()
+    print(f"Resolved {owners} owners into {clusters} entities")
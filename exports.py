@@ -0,0 +1,133 @@
+# Imports
+import io
+import csv
+import json
+from sqlalchemy import select, Integer
+from modules import Owner, Company, OwnerCompany, Property, db
+# pyarrow is only needed for Parquet exports
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+# Bulk exports of the crawled tables for analysts, streamed instead of paged. Rows are read in id order through a
+# server side cursor (yield_per) EXPORT_BATCH at a time and each batch is encoded and sent as soon as it's read,
+# so memory stays flat whatever the table's size. ?since=ID only exports rows after that id, the last id of
+# the previous export, so incremental pulls only read the new rows.
+
+# Rows read and encoded per batch
+EXPORT_BATCH = 2000
+
+# Exportable table -> (select of its columns, id column it's ordered and filtered by)
+EXPORT_TABLES = {
+    'properties': (select(Property.id, Property.address, Property.owner_id, Property.llc_id), Property.id),
+    'owners': (select(Owner.id, Owner.full_name, Owner.address), Owner.id),
+    'owner_companies': (select(OwnerCompany.id, OwnerCompany.owner_id, Owner.full_name.label('owner_name'),
+                               OwnerCompany.company_id, Company.llc_name)
+                        .join(Owner, Owner.id == OwnerCompany.owner_id)
+                        .join(Company, Company.id == OwnerCompany.company_id), OwnerCompany.id),
+}
+
+# Format -> mimetype
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+def export_batches(table, since=None, batch=EXPORT_BATCH):
+    """
+    Reads a table in id order, batch rows at a time from a server side cursor.
+
+    Parameters:
+    - table (str) : Key of EXPORT_TABLES.
+    - since (int) : Only rows with a larger id, None for all of them.
+    - batch (int) : Rows per batch.
+
+    Return:
+    - (columns, batches) (tuple) : Column names and a generator of lists of row tuples.
+    """
+    statement, key = EXPORT_TABLES[table]
+    if since is not None:
+        statement = statement.where(key > since)
+    result = db.session.execute(statement.order_by(key).execution_options(yield_per=batch))
+    return list(result.keys()), (list(partition) for partition in result.partitions())
+
+
+def ndjson_chunks(columns, batches):
+    """One JSON object per row and line."""
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+
+def csv_chunks(columns, batches):
+    """A header line, then one line per row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that keeps what's written until drain(), so a Parquet writer's output can be streamed."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def arrow_schema(table):
+    """Parquet schema of an export, from its columns' types so a batch of all NULLs doesn't change a column's type."""
+    statement, key = EXPORT_TABLES[table]
+    return pyarrow.schema([(column.name, pyarrow.int64() if isinstance(column.type, Integer) else pyarrow.string())
+                           for column in statement.selected_columns])
+
+
+def parquet_chunks(columns, batches, schema):
+    """One Parquet row group per batch, the file's footer comes last."""
+    sink = ChunkSink()
+    writer = parquet.ParquetWriter(sink, schema)
+    for rows in batches:
+        writer.write_table(pyarrow.Table.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_chunks(table, format, since=None):
+    """
+    Encodes a table for a streamed response.
+
+    Parameters:
+    - table (str) : Key of EXPORT_TABLES.
+    - format (str) : Key of EXPORT_FORMATS.
+    - since (int) : Only rows with a larger id.
+
+    Return:
+    - chunks (generator) : str chunks for ndjson and csv, bytes for parquet.
+    """
+    columns, batches = export_batches(table, since)
+    if format == 'parquet':
+        return parquet_chunks(columns, batches, arrow_schema(table))
+    if format == 'csv':
+        return csv_chunks(columns, batches)
+    return ndjson_chunks(columns, batches)
@@ -0,0 +1,97 @@
+# Imports
+from datetime import datetime
+from sqlalchemy import delete
+from modules import FailedParcel, db
+from sql_helpers import upsert, chunks
+import scraper
+from scraper import get_parid
+
+# Parcels a crawl went past without writing. The crawl writes in order past a page it couldn't scrape and moves
+# the resume point on, so those parcels are kept here instead. A parcel whose fetch or write failed is retried
+# first by the next concurrent crawl, one that's written is taken off the list and one that fails MAX_ATTEMPTS
+# times is left alone. A page that came back without parcel data is kept as missing and not retried: counting up
+# the parid sequence lands on plenty of parids that don't exist, and each one costs a full render timeout.
+# `python crawler.py --retry-missing` retries them on demand. With a PARCEL_LIST loaded every parid exists,
+# so an empty page there is a failed render and is retried like any other failure.
+
+# Crawls a parcel may fail in before it stops being retried
+MAX_ATTEMPTS = 3
+
+
+def failed_urls(limit=None, missing=False):
+    """
+    Urls of the failed parcels that are still retried, oldest failure first.
+
+    Parameters:
+    - limit (int) : Most urls, None for all.
+    - missing (bool) : The parcels whose pages came back without data instead of the ones that failed.
+
+    Return:
+    - urls (list) : Assessor urls.
+    """
+    query = (db.session.query(FailedParcel.url)
+             .filter(FailedParcel.attempts < MAX_ATTEMPTS, FailedParcel.missing == missing)
+             .order_by(FailedParcel.last_failed, FailedParcel.parid))
+    if limit is not None:
+        query = query.limit(limit)
+    return [url for url, in query]
+
+
+class FailedParcels:
+    """
+    Keeps the failed parcels table in step with a crawl: failed(url) records a parcel the crawl went past,
+    missing(url) one whose page had no parcel data, written(url) takes a failed parcel off the list.
+    Nothing is saved until flush(), called after the writer's own flush so it goes in with the writer's batch.
+    Called from the crawl's writer stage, in page order.
+    """
+
+    def __init__(self):
+        # Parids in the table, loaded on first use
+        self.known = None
+        # parid -> failed parcel row waiting for the next flush
+        self.rows = {}
+        # Parids written since the last flush
+        self.cleared = []
+        self.stats = {'failed': 0, 'missing': 0, 'retried': 0}
+
+    def failed(self, url, missing=False):
+        # Every listed parid exists, so with a parcel list an empty page is a render that failed
+        missing = missing and scraper.parcel_index is None
+        self.stats['missing' if missing else 'failed'] += 1
+        parid = get_parid(url)
+        self.rows[parid] = {'parid': parid, 'url': url, 'missing': missing, 'attempts': 1,
+                            'last_failed': datetime.utcnow()}
+
+    def missing(self, url):
+        self.failed(url, missing=True)
+
+    def written(self, url):
+        if self.known is None:
+            self.known = {parid for parid, in db.session.query(FailedParcel.parid)}
+        parid = get_parid(url)
+        if parid in self.known:
+            self.cleared.append(parid)
+
+    def flush(self):
+        """Saves the parcels that failed since the last flush and takes the ones written off the list, in one commit."""
+        if not self.rows and not self.cleared:
+            return
+        rows, self.rows = list(self.rows.values()), {}
+        parids, self.cleared = self.cleared, []
+        try:
+            for chunk in chunks(rows):
+                statement = upsert(FailedParcel).values(chunk)
+                db.session.execute(statement.on_conflict_do_update(index_elements=['parid'], set_={
+                    'url': statement.excluded.url, 'missing': statement.excluded.missing,
+                    'attempts': FailedParcel.attempts + 1, 'last_failed': statement.excluded.last_failed}))
+            for chunk in chunks(parids):
+                db.session.execute(delete(FailedParcel).where(FailedParcel.parid.in_(chunk)))
+            db.session.commit()
+            if self.known is not None:
+                self.known.difference_update(parids)
+                self.known.update(row['parid'] for row in rows)
+            self.stats['retried'] += len(parids)
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"Exception from FailedParcels : {e}")
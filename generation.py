@@ -0,0 +1,52 @@
+# Imports
+import time
+import threading
+from datetime import datetime
+from modules import CrawlGeneration, db
+from sql_helpers import upsert
+
+# The crawl generation, a number every write to the crawled data bumps in the same transaction as the data.
+# The API caches its responses per generation (response_cache.py), so a response stays cached until the
+# crawler, or anything else, changes what it was built from. It lives in the database because the crawler
+# and the app are separate processes, possibly on separate machines.
+
+# Seconds the app reuses the generation it last read before reading it again, the most a response can be stale
+GENERATION_CHECK_SECONDS = 2.0
+
+# (read at, generation) of the last read in this process
+_last_read = (None, None)
+_lock = threading.Lock()
+
+
+def bump_generation():
+    """Adds one to the generation in the caller's transaction, the caller commits it along with its writes."""
+    global _last_read
+    statement = upsert(CrawlGeneration).values(id=1, generation=1, updated_at=datetime.utcnow())
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['id'], set_={'generation': CrawlGeneration.generation + 1,
+                                     'updated_at': statement.excluded.updated_at}))
+    # This process' next read goes to the database
+    with _lock:
+        _last_read = (None, None)
+
+
+def current_generation(max_age=GENERATION_CHECK_SECONDS):
+    """
+    Returns the generation, read from the database at most once every max_age seconds.
+
+    Parameters:
+    - max_age (float) : Seconds an earlier read is reused, 0 always reads.
+
+    Return:
+    - generation (int) : 0 when nothing was written yet.
+    """
+    global _last_read
+    now = time.monotonic()
+    with _lock:
+        read_at, generation = _last_read
+    if read_at is not None and now - read_at < max_age:
+        return generation
+    generation = db.session.query(CrawlGeneration.generation).filter(CrawlGeneration.id == 1).scalar() or 0
+    with _lock:
+        _last_read = (now, generation)
+    return generation
@@ -0,0 +1,103 @@
+# Imports
+from collections import OrderedDict
+from sqlalchemy import event
+
+# Remembers the ids of owners and companies the crawler has already written, so a landlord that shows up on
+# thousands of parcels is looked up once. Ids learned inside an open transaction are only kept once it commits.
+# Keys are the exact address or name strings, the same values the tables' unique constraints compare, so a key
+# that differs only in whitespace is a different row and never shares another's id.
+
+
+class IdentityCache:
+    """Bounded LRU of key -> id with hit/miss counters."""
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._ids = OrderedDict()
+        # Ids written by the open transaction, they don't exist for anyone else until it commits
+        self._staged = {}
+
+    def get(self, key):
+        """Returns the id cached for key, None on a miss."""
+        if key in self._staged:
+            self.hits += 1
+            return self._staged[key]
+        if key in self._ids:
+            self._ids.move_to_end(key)
+            self.hits += 1
+            return self._ids[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, id):
+        """Caches an id that is already committed."""
+        self._ids[key] = id
+        self._ids.move_to_end(key)
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def stage(self, key, id):
+        """Caches an id from the open transaction, kept on commit() and dropped on rollback()."""
+        self._staged[key] = id
+
+    def commit(self):
+        for key, id in self._staged.items():
+            self.put(key, id)
+        self._staged.clear()
+
+    def rollback(self):
+        self._staged.clear()
+
+    def clear(self):
+        """Forgets everything, for when rows are deleted or merged outside the crawler."""
+        self._ids.clear()
+        self._staged.clear()
+
+    def warm(self, rows):
+        """Caches (key, id) rows, oldest first so the last ones are the most recently used."""
+        for key, id in rows:
+            self.put(key, id)
+
+    def stats(self):
+        """Returns {'size', 'hits', 'misses', 'hit_rate'}."""
+        lookups = self.hits + self.misses
+        return {'size': len(self._ids), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None}
+
+
+# owner address -> owner.id and llc_name -> company.id, shared by update_database and BatchWriter
+owner_cache = IdentityCache()
+company_cache = IdentityCache()
+
+
+def watch_session(session):
+    """Keeps staged ids in step with session: kept when it commits and dropped when it rolls back."""
+    def after_commit(session):
+        owner_cache.commit()
+        company_cache.commit()
+
+    def after_rollback(session):
+        owner_cache.rollback()
+        company_cache.rollback()
+
+    event.listen(session, 'after_commit', after_commit)
+    event.listen(session, 'after_rollback', after_rollback)
+
+
+def warm_caches(db):
+    """
+    Fills both caches from the database, the newest rows first in line to be kept.
+
+    Parameters:
+    - db (SQLAlchemy) : The app's database object.
+    """
+    # Imported here so the cache itself doesn't depend on the models
+    from modules import Owner, Company
+    owners = (db.session.query(Owner.address, Owner.id)
+              .order_by(Owner.id.desc()).limit(owner_cache.max_size).all())
+    companies = (db.session.query(Company.llc_name, Company.id)
+                 .order_by(Company.id.desc()).limit(company_cache.max_size).all())
+    owner_cache.warm(reversed(owners))
+    company_cache.warm(reversed(companies))
@@ -0,0 +1,262 @@
+# Imports
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Crawl telemetry. Counters and latency histograms kept in this process, served in the Prometheus text
+# format by start_metrics_server() and summarized in the log by start_summary_log().
+
+# Upper bounds in seconds, from a cached lookup to a slow render. Close enough together that the p50/p99
+# estimates of quantile() land within about a fifth of the true value
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2,
+                   0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 60)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Count per combination of label values that only goes up."""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def total(self):
+        return sum(self._values.values())
+
+    def items(self):
+        """Returns {label values: count}."""
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Latency distribution per combination of label values, in cumulative buckets like Prometheus expects."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (the last one is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, seconds)] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def quantile(self, q, *label_values):
+        """
+        Estimates a quantile from the buckets, interpolating inside the bucket it falls in the way
+        Prometheus' histogram_quantile() does.
+
+        Parameters:
+        - q (float) : Quantile, ex: 0.99
+        - label_values (str) : Which series.
+
+        Return:
+        - seconds (float) : Estimate, None when the series is empty. Past the last bucket it's the last bound.
+        """
+        with self._lock:
+            series = self._values.get(label_values)
+            if not series or not series[2]:
+                return None
+            counts = list(series[0])
+            rank = q * series[2]
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def series(self):
+        """Returns {label values: (count, sum)}."""
+        with self._lock:
+            return {label_values: (series[2], series[1]) for label_values, series in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    labels = format_labels(self.labels + ('le',), label_values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# The crawler's metrics
+stage_seconds = Histogram('crawler_stage_seconds', 'Seconds spent per call of each crawl stage.', labels=('stage',))
+stage_errors = Counter('crawler_errors_total', 'Exceptions raised per crawl stage and exception type.',
+                       labels=('stage', 'type'))
+db_seconds = Histogram('crawler_db_seconds', 'Seconds spent per database operation.', labels=('operation',))
+db_errors = Counter('crawler_db_errors_total', 'Exceptions raised per database operation and exception type.',
+                    labels=('operation', 'type'))
+pages = Counter('crawler_pages_total', 'Parcels finished, by result.', labels=('result',))
+registry = [stage_seconds, stage_errors, db_seconds, db_errors, pages]
+started = time.time()
+
+
+def reset():
+    """Zeroes every metric, ex: between benchmark runs in one process."""
+    global started
+    for metric in registry:
+        metric.reset()
+    started = time.time()
+
+
+@contextmanager
+def timed(stage):
+    """Times a block as one call of a crawl stage, ex: with timed('render'): ... Exceptions are counted and re-raised."""
+    began = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        stage_errors.inc(stage, type(e).__name__)
+        raise
+    finally:
+        stage_seconds.observe(time.monotonic() - began, stage)
+
+
+@contextmanager
+def timed_db(operation):
+    """Same as timed() for a database operation, ex: with timed_db('insert_property'): ..."""
+    began = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        db_errors.inc(operation, type(e).__name__)
+        raise
+    finally:
+        db_seconds.observe(time.monotonic() - began, operation)
+
+
+def exposition():
+    """Returns every metric in the Prometheus text format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.exposition())
+    lines.append('# HELP crawler_uptime_seconds Seconds since the crawler started.')
+    lines.append('# TYPE crawler_uptime_seconds gauge')
+    lines.append(f"crawler_uptime_seconds {time.time() - started}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves exposition() on /metrics."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown out the crawl's own output
+        pass
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """
+    Serves the metrics on http://host:port/metrics from a background thread.
+
+    Parameters:
+    - port (int) : Port to listen on.
+    - host (str) : Interface to listen on.
+
+    Return:
+    - server (ThreadingHTTPServer) : The running server, server.shutdown() stops it.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summary():
+    """
+    One line per stage and database operation with calls, errors, mean and p99, plus the overall pages/sec.
+
+    Return:
+    - summary (str) : Lines for the log.
+    """
+    uptime = time.time() - started
+    lines = [f"Crawl metrics after {uptime:.0f}s: {pages.total()} pages, {pages.total() / uptime:.2f} pages/sec "
+             f"({', '.join(f'{labels[0]}={value}' for labels, value in sorted(pages.items().items()))})"]
+    for histogram, errors in ((stage_seconds, stage_errors), (db_seconds, db_errors)):
+        for label_values, (count, total) in sorted(histogram.series().items()):
+            failed = sum(value for labels, value in errors.items().items() if labels[0] == label_values[0])
+            lines.append(f"  {label_values[0]:<22} calls={count} errors={failed} mean={total / count * 1000:.1f}ms "
+                         f"p99={histogram.quantile(0.99, *label_values) * 1000:.1f}ms")
+    error_types = {}
+    for counter in (stage_errors, db_errors):
+        for (name, error_type), value in counter.items().items():
+            error_types[error_type] = error_types.get(error_type, 0) + value
+    if error_types:
+        lines.append(f"  errors by type: {error_types}")
+    return '\n'.join(lines)
+
+
+def start_summary_log(interval=60):
+    """Prints summary() every interval seconds from a background thread."""
+    def log():
+        previous = pages.total()
+        while True:
+            time.sleep(interval)
+            current = pages.total()
+            print(summary())
+            print(f"  last {interval}s: {(current - previous) / interval:.2f} pages/sec")
+            previous = current
+    thread = threading.Thread(target=log, daemon=True)
+    thread.start()
+    return thread
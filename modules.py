@@ -43,10 +43,12 @@ class Company(db.Model):
                                         unique=True)
     
     def serialize(self) :
+        """Returns dictionary representation of a company instance that can be turned into JSON, owner_id is its first owner's.
+        owner_company is a list, load it with the company (selectinload) when serializing many."""
         return {
             "id" : self.id,
             "llc_name" : self.llc_name,
-            "owner_id" : self.owner_company.owner_id
+            "owner_id" : self.owner_company[0].owner_id if self.owner_company else None
         }
 
 
@@ -59,8 +61,9 @@ class OwnerCompany(db.Model):
                                autoincrement=True)
     owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'),
                                      nullable=False)
+    # Indexed for the typeahead, which reads an LLC's first owner by company_id
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'),
-                                       nullable=False)
+                                       nullable=False, index=True)
     
     # Relationships
     owner = db.relationship('Owner', backref='owner_company', foreign_keys=[owner_id])
@@ -89,8 +92,10 @@ class Property(db.Model):
                                 autoincrement=True)
     address = db.Column(db.String(100), nullable=False,
                                         unique=True)
-    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'))
-    llc_id = db.Column(db.Integer, db.ForeignKey('company.id'))
+    # Indexed for the owner detail, which reads an owner's properties by owner_id
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'), index=True)
+    # Indexed for the portfolios, which count their LLCs' properties by llc_id
+    llc_id = db.Column(db.Integer, db.ForeignKey('company.id'), index=True)
 
     # Relationships
     company = db.relationship('Company', backref='properties', foreign_keys=[llc_id])
@@ -106,6 +111,19 @@ class Property(db.Model):
         }
 
 
+class PropertyTransfer(db.Model):
+    """PropertyTransfer Model, a stored property the crawl moved to another owner or LLC, the typeahead reads it to update the owner it opens"""
+    __tablename__ = 'property_transfer'
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True,
+                               autoincrement=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id'),
+                                        nullable=False)
+    transferred_at = db.Column(db.DateTime, nullable=False,
+                                            default=datetime.utcnow)
+
+
 # Meta Data
 class CrawlerProgress(db.Model):
     """CrawlerProgress Model"""
@@ -118,3 +136,192 @@ class CrawlerProgress(db.Model):
                                           default=datetime.utcnow)
     curr_url = db.Column(db.String(500), nullable=False)
     next_url = db.Column(db.String(500), nullable=False)
+
+
+class FailedParcel(db.Model):
+    """FailedParcel Model, a parcel a crawl couldn't scrape and went past, failed ones are retried by the next crawl"""
+    __tablename__ = 'failed_parcel'
+
+    # Columns
+    parid = db.Column(db.String(20), primary_key=True)
+    url = db.Column(db.String(500), nullable=False)
+    # The page came back without parcel data, most likely a parid that doesn't exist
+    missing = db.Column(db.Boolean, nullable=False,
+                                    default=False)
+    attempts = db.Column(db.Integer, nullable=False,
+                                     default=1)
+    last_failed = db.Column(db.DateTime, nullable=False,
+                                         default=datetime.utcnow)
+
+
+class CrawlGeneration(db.Model):
+    """CrawlGeneration Model, a single row counting the writes to the crawled data, cached API responses are keyed on it"""
+    __tablename__ = 'crawl_generation'
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.Integer, nullable=False,
+                                       default=0)
+    updated_at = db.Column(db.DateTime, nullable=False,
+                                        default=datetime.utcnow)
+
+
+class CrawlShard(db.Model):
+    """CrawlShard Model, a range of parids crawled by whichever worker holds its lease"""
+    __tablename__ = 'crawl_shard'
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True,
+                               autoincrement=True)
+    # Any assessor url, the shard's parids are swapped into it
+    start_url = db.Column(db.String(500), nullable=False)
+    # First parid of the shard and the first parid after it, None runs to the end of the parid sequence
+    start_parid = db.Column(db.String(20), nullable=False,
+                                           unique=True)
+    end_parid = db.Column(db.String(20))
+    # Where the shard resumes, everything before it has been written
+    next_parid = db.Column(db.String(20), nullable=False)
+    pages = db.Column(db.Integer, nullable=False,
+                                  default=0)
+    done = db.Column(db.Boolean, nullable=False,
+                                 default=False)
+    # Lease, the shard belongs to worker until lease_expires
+    worker = db.Column(db.String(100))
+    lease_expires = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+
+    def serialize(self):
+        """Returns dictionary representation of a crawl_shard instance that can be turned into JSON"""
+        return {
+            "id" : self.id,
+            "start_parid" : self.start_parid,
+            "end_parid" : self.end_parid,
+            "next_parid" : self.next_parid,
+            "pages" : self.pages,
+            "done" : self.done,
+            "worker" : self.worker,
+            "lease_expires" : self.lease_expires.isoformat() if self.lease_expires else None
+        }
+
+
+class ParcelFingerprint(db.Model):
+    """ParcelFingerprint Model, a hash of the last data scraped for a parcel and how often it has changed"""
+    __tablename__ = 'parcel_fingerprint'
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True,
+                               autoincrement=True)
+    parid = db.Column(db.String(20), nullable=False,
+                                     unique=True)
+    fingerprint = db.Column(db.String(40), nullable=False)
+    # Times the parcel was scraped and times its data came back different
+    checks = db.Column(db.Integer, nullable=False,
+                                   default=1)
+    changes = db.Column(db.Integer, nullable=False,
+                                    default=0)
+    last_checked = db.Column(db.DateTime, nullable=False,
+                                          default=datetime.utcnow)
+    last_changed = db.Column(db.DateTime, nullable=False,
+                                          default=datetime.utcnow)
+    # What the last scrape looked like, LLC owned parcels and recent sales change hands more often
+    llc = db.Column(db.Boolean, nullable=False,
+                                default=False)
+    sold = db.Column(db.Boolean, nullable=False,
+                                 default=False)
+
+
+# Rollups
+class OwnerPropertyCount(db.Model):
+    """OwnerPropertyCount Model, number of properties per owner kept up to date by the crawler's writes"""
+    __tablename__ = 'owner_property_count'
+
+    # Columns
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'),
+                                     primary_key=True)
+    property_count = db.Column(db.Integer, nullable=False,
+                                           default=0)
+
+    # Relationships
+    owner = db.relationship('Owner', foreign_keys=[owner_id])
+
+    # Indexes, the rankings walk this one from the top instead of sorting the table
+    __table_args__ = (db.Index('ix_owner_property_count_rank', 'property_count', 'owner_id'),)
+
+
+class CompanyPropertyCount(db.Model):
+    """CompanyPropertyCount Model, number of properties per LLC kept up to date by the crawler's writes"""
+    __tablename__ = 'company_property_count'
+
+    # Columns
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'),
+                                       primary_key=True)
+    property_count = db.Column(db.Integer, nullable=False,
+                                           default=0)
+
+    # Relationships
+    company = db.relationship('Company', foreign_keys=[company_id])
+
+    # Indexes
+    __table_args__ = (db.Index('ix_company_property_count_rank', 'property_count', 'company_id'),)
+
+
+class OwnerEntity(db.Model):
+    """OwnerEntity Model, the resolved entity of each owner: owners whose names and addresses are the same up to spelling share a cluster_id"""
+    __tablename__ = 'owner_entity'
+
+    # Columns
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'),
+                                     primary_key=True)
+    # Smallest owner id of the cluster
+    cluster_id = db.Column(db.Integer, nullable=False,
+                                       index=True)
+    # Normalized address, ex: '123 MAIN ST RENO NV 89501' for '123 Main Street, Reno NV 89501'
+    address_key = db.Column(db.Text, nullable=False,
+                                     index=True)
+    # House number, street initial and zip code, only owners in the same block are compared
+    block_key = db.Column(db.Text, nullable=False,
+                                   index=True)
+
+    # Relationships
+    owner = db.relationship('Owner', foreign_keys=[owner_id])
+
+
+class Portfolio(db.Model):
+    """Portfolio Model, a connected group of owners and the LLCs linking them or a lone LLC, with its sizes kept up to date by the crawler's writes"""
+    __tablename__ = 'portfolio'
+
+    # Columns
+    # Smallest owner id of the portfolio, or minus the id of an LLC without owners
+    portfolio_id = db.Column(db.Integer, primary_key=True,
+                                         autoincrement=False)
+    owner_count = db.Column(db.Integer, nullable=False,
+                                        default=0)
+    company_count = db.Column(db.Integer, nullable=False,
+                                          default=0)
+    property_count = db.Column(db.Integer, nullable=False,
+                                           default=0)
+
+    # Indexes
+    __table_args__ = (db.Index('ix_portfolio_rank', 'property_count', 'portfolio_id'),)
+
+
+class PortfolioOwner(db.Model):
+    """PortfolioOwner Model, the portfolio of each owner"""
+    __tablename__ = 'portfolio_owner'
+
+    # Columns
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'),
+                                     primary_key=True)
+    portfolio_id = db.Column(db.Integer, nullable=False,
+                                         index=True)
+
+
+class PortfolioCompany(db.Model):
+    """PortfolioCompany Model, the portfolio of each LLC"""
+    __tablename__ = 'portfolio_company'
+
+    # Columns
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'),
+                                       primary_key=True)
+    portfolio_id = db.Column(db.Integer, nullable=False,
+                                         index=True)
@@ -0,0 +1,52 @@
+# Imports
+from sqlalchemy import select, func
+from modules import Owner, Company, OwnerCompany, Property, OwnerEntity, PortfolioOwner, db
+
+# The owner detail the frontend opens on every owner click, read in one round trip: the owner's columns with
+# correlated subqueries for their entity's cluster_id, portfolio, LLC names, property count and property
+# addresses, each an indexed lookup on owner_id. The lists come back as one string each, joined on a separator
+# that never appears in the data.
+
+SEPARATOR = '\x1f'
+
+
+def owner_profile(owner_id):
+    """
+    Reads an owner with everything the owner detail shows, in a single query.
+
+    Parameters:
+    - owner_id (int) : Owner's id.
+
+    Return:
+    - Dictionary : {id, full_name, address, cluster_id, portfolio_id, llc_name, llc_names, property_count,
+                   properties}, llc_name is the first of llc_names or None, cluster_id and portfolio_id are None
+                   until the owner is resolved and the lists are sorted.
+    - Null : None when there's no such owner.
+    """
+    llc_names = (select(func.aggregate_strings(Company.llc_name, SEPARATOR))
+                 .select_from(OwnerCompany).join(Company, Company.id == OwnerCompany.company_id)
+                 .where(OwnerCompany.owner_id == Owner.id).scalar_subquery())
+    property_count = select(func.count(Property.id)).where(Property.owner_id == Owner.id).scalar_subquery()
+    cluster_id = select(OwnerEntity.cluster_id).where(OwnerEntity.owner_id == Owner.id).scalar_subquery()
+    portfolio_id = (select(PortfolioOwner.portfolio_id).where(PortfolioOwner.owner_id == Owner.id)
+                    .scalar_subquery())
+    addresses = (select(func.aggregate_strings(Property.address, SEPARATOR))
+                 .where(Property.owner_id == Owner.id).scalar_subquery())
+    row = db.session.execute(select(Owner.id, Owner.full_name, Owner.address, cluster_id.label('cluster_id'),
+                                    portfolio_id.label('portfolio_id'), llc_names.label('llc_names'), property_count.label('property_count'),
+                                    addresses.label('properties'))
+                             .where(Owner.id == owner_id)).first()
+    if row is None:
+        return None
+    llc_names = sorted(row.llc_names.split(SEPARATOR)) if row.llc_names else []
+    return {
+        "id" : row.id,
+        "full_name" : row.full_name,
+        "address" : row.address,
+        "cluster_id" : row.cluster_id,
+        "portfolio_id" : row.portfolio_id,
+        "llc_name" : llc_names[0] if llc_names else None,
+        "llc_names" : llc_names,
+        "property_count" : row.property_count,
+        "properties" : sorted(row.properties.split(SEPARATOR)) if row.properties else []
+    }
@@ -0,0 +1,187 @@
+# Imports
+import os
+import time
+import zlib
+import threading
+from bisect import bisect_right
+from scraper import get_parid
+
+# Append-only archive of every page the crawler fetched, so a change to the extraction logic can be
+# re-run over pages already on disk instead of crawling the county site again.
+# An archive is a directory holding three files:
+# - dictionary : the first page appended, every other page is compressed against it.
+# - pages.z : each page's body compressed on its own with zlib, one after the other.
+# - index.tsv : one line per page, parid, fetched_at, backend, offset, length and url, tab separated.
+# Pages are only ever appended, a parcel fetched twice keeps both copies.
+
+DATA_FILE = 'pages.z'
+INDEX_FILE = 'index.tsv'
+DICTIONARY_FILE = 'dictionary'
+# zlib only looks back 32KB, the rest of a longer dictionary would be dead weight
+DICTIONARY_SIZE = 32 * 1024
+
+
+class PageArchive:
+    """
+    Compressed store of fetch_page() results keyed by parid and fetch time. Safe to share between
+    the crawler's fetch threads, but only one process should append to a directory at a time.
+    """
+
+    def __init__(self, directory, level=9):
+        self.directory = directory
+        self.level = level
+        self._lock = threading.Lock()
+        # parid -> [(fetched_at, backend, offset, length, url), ...] oldest first
+        self._entries = {}
+        self.stats = {'pages': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._data = open(os.path.join(directory, DATA_FILE), 'ab')
+        self._index = open(os.path.join(directory, INDEX_FILE), 'a')
+        self._reader = os.open(os.path.join(directory, DATA_FILE), os.O_RDONLY)
+        # Parcel pages are mostly the same markup, so compressing each one against a sample page
+        # shrinks them several times more than compressing them alone
+        self._dictionary = None
+        if os.path.exists(os.path.join(directory, DICTIONARY_FILE)):
+            with open(os.path.join(directory, DICTIONARY_FILE), 'rb') as file:
+                self._dictionary = file.read()
+        self._load_index()
+
+    def _load_index(self):
+        """Reads index.tsv back into memory, skipping lines for pages whose bytes never made it to pages.z."""
+        size = os.path.getsize(os.path.join(self.directory, DATA_FILE))
+        with open(os.path.join(self.directory, INDEX_FILE)) as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                # A crash can leave a half written last line
+                if len(fields) != 6:
+                    continue
+                parid, fetched_at, backend, offset, length, url = fields
+                offset, length = int(offset), int(length)
+                if offset + length > size:
+                    continue
+                self._add_entry(parid, (float(fetched_at), backend, offset, length, url))
+
+    def _add_entry(self, parid, entry):
+        entries = self._entries.setdefault(parid, [])
+        entries.append(entry)
+        # Appends come in time order, only an index written out of order needs sorting
+        if len(entries) > 1 and entries[-2][0] > entry[0]:
+            entries.sort(key=lambda entry: entry[0])
+
+    def append(self, page, fetched_at=None):
+        """
+        Compresses a fetched page onto the end of the archive.
+
+        Parameters:
+        - page (dict) : fetch_page() result, {'url', 'backend', 'body'}.
+        - fetched_at (float) : Unix time the page was fetched, defaults to now.
+        """
+        try:
+            parid = get_parid(page['url'])
+        except KeyError:
+            raise ValueError(f"No parid in {page['url']}")
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        raw = page['body'].encode('utf-8')
+        if self._dictionary is None:
+            self._save_dictionary(raw)
+        # Compressing is the slow part, it's done before taking the lock
+        compressor = zlib.compressobj(self.level, zdict=self._dictionary)
+        stored = compressor.compress(raw) + compressor.flush()
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(stored)
+            # The bytes have to be in pages.z before the index line that points at them
+            self._data.flush()
+            self._index.write(f"{parid}\t{fetched_at:.3f}\t{page['backend']}\t{offset}\t{len(stored)}\t{page['url']}\n")
+            self._index.flush()
+            self._add_entry(parid, (round(fetched_at, 3), page['backend'], offset, len(stored), page['url']))
+            self.stats['pages'] += 1
+            self.stats['raw_bytes'] += len(raw)
+            self.stats['stored_bytes'] += len(stored)
+
+    def _save_dictionary(self, raw):
+        """Makes the first page appended to a new archive its dictionary."""
+        with self._lock:
+            if self._dictionary is not None:
+                return
+            dictionary = raw[-DICTIONARY_SIZE:]
+            with open(os.path.join(self.directory, DICTIONARY_FILE), 'wb') as file:
+                file.write(dictionary)
+            self._dictionary = dictionary
+
+    def _read(self, entry):
+        fetched_at, backend, offset, length, url = entry
+        # pread doesn't move a shared file position, so threads can read at the same time
+        decompressor = zlib.decompressobj(zdict=self._dictionary)
+        body = decompressor.decompress(os.pread(self._reader, length, offset)).decode('utf-8')
+        return {'url': url, 'backend': backend, 'body': body, 'fetched_at': fetched_at}
+
+    def get(self, parid, at=None):
+        """
+        Looks up one stored page of a parcel.
+
+        Parameters:
+        - parid (str) : Parcel id.
+        - at (float) : Unix time, returns the latest page fetched at or before it. Defaults to the latest page.
+
+        Return:
+        - Page (dict) : {'url', 'backend', 'body', 'fetched_at'}, None if the parcel has no page.
+        """
+        entries = self._entries.get(parid)
+        if not entries:
+            return None
+        if at is None:
+            return self._read(entries[-1])
+        position = bisect_right([entry[0] for entry in entries], at)
+        return self._read(entries[position - 1]) if position else None
+
+    def get_page(self, url):
+        """Same as get() for the parid of url, has the same signature as scraper.fetch_page so a crawl can replay from it."""
+        return self.get(get_parid(url))
+
+    def history(self, parid):
+        """Returns the fetch times of every stored page of a parcel, oldest first."""
+        return [entry[0] for entry in self._entries.get(parid, [])]
+
+    def parids(self):
+        """Returns every archived parid in parid order."""
+        return sorted(self._entries)
+
+    def urls(self):
+        """Returns the url of the latest page of every archived parcel, in parid order."""
+        return [self._entries[parid][-1][4] for parid in self.parids()]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def __contains__(self, parid):
+        return parid in self._entries
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
+            os.close(self._reader)
+
+
+def archiving(fetch, archive):
+    """
+    Wraps a fetch function so every page it returns is also appended to archive.
+
+    Parameters:
+    - fetch (function) : fetch(url) -> page or None, ex: scraper.fetch_page.
+    - archive (PageArchive) : Where pages are kept.
+
+    Return:
+    - fetch (function) : Same signature as fetch.
+    """
+    def fetch_and_archive(url):
+        page = fetch(url)
+        if page is not None:
+            try:
+                archive.append(page)
+            except Exception as e:
+                # Losing the copy shouldn't lose the parcel
+                print(f"Exception from PageArchive : {e}")
+        return page
+    return fetch_and_archive
@@ -0,0 +1,158 @@
+# Imports
+import json
+import time
+import base64
+import binascii
+import threading
+from sqlalchemy import func
+from modules import db
+
+# Keyset pagination for the API listings. A page is the rows with an id just past (or just before) the
+# cursor, read off the primary key index, so the thousandth page costs the same as the first. OFFSET
+# pagination reads and throws away every row before the page, and its COUNT(*) reads the whole table.
+
+# Rows per page when the request doesn't say, and the most it may ask for
+PER_PAGE = 10
+MAX_PER_PAGE = 100
+
+# Seconds a table's row count is reused before it's counted again
+COUNT_TTL = 60
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that wasn't made by encode_cursor()."""
+
+
+def encode_cursor(id, direction):
+    """
+    Makes an opaque cursor, clients only pass it back.
+
+    Parameters:
+    - id (int) : Id the page starts after ('next') or ends before ('prev').
+    - direction (str) : 'next' or 'prev'.
+
+    Return:
+    - cursor (str) : URL safe token.
+    """
+    token = json.dumps([direction, id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(token).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reads a cursor made by encode_cursor().
+
+    Parameters:
+    - cursor (str) : Token from a page_nav.
+
+    Return:
+    - (direction, id) (tuple) : ex: ('next', 120)
+
+    Raises:
+    - InvalidCursor : The token is malformed.
+    """
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, id = json.loads(token)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor {cursor!r}") from e
+    if direction not in ('next', 'prev') or not isinstance(id, int):
+        raise InvalidCursor(f"Invalid cursor {cursor!r}")
+    return direction, id
+
+
+def page_size(per_page):
+    """Clamps a requested page size, None gives PER_PAGE."""
+    if per_page is None:
+        return PER_PAGE
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def keyset_page(query, model, cursor=None, per_page=PER_PAGE):
+    """
+    Reads one page of a query in id order, starting from a cursor.
+
+    Parameters:
+    - query (Query) : Rows to page through, ex: Owner.query. Must not be ordered yet.
+    - model (Flask-SQLAlchemy Model Obj) : Model whose id the query is paged by.
+    - cursor (str) : next_cursor or prev_cursor of the previous page, None for the first page.
+    - per_page (int) : Rows per page.
+
+    Return:
+    - Dictionary : {"items":[Model], "page_nav":{"prev_cursor", "next_cursor"}}, a cursor is None when there's no page that way.
+
+    Raises:
+    - InvalidCursor : The cursor is malformed.
+    """
+    direction, id = decode_cursor(cursor) if cursor else ('next', None)
+    # One row past the page tells whether there's another page without counting the rows
+    if direction == 'next':
+        if id is not None:
+            query = query.filter(model.id > id)
+        rows = query.order_by(model.id).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev, has_next = id is not None, more
+    else:
+        rows = query.filter(model.id < id).order_by(model.id.desc()).limit(per_page + 1).all()
+        more = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        has_prev, has_next = more, True
+
+    page_nav = {"prev_cursor": None, "next_cursor": None}
+    if items and has_prev:
+        page_nav['prev_cursor'] = encode_cursor(items[0].id, 'prev')
+    if items and has_next:
+        page_nav['next_cursor'] = encode_cursor(items[-1].id, 'next')
+    return {"items": items, "page_nav": page_nav}
+
+
+def offset_page(query, model, page, per_page=PER_PAGE):
+    """
+    Reads a numbered page of a query in id order, for the page number endpoints. Still an OFFSET, but without a COUNT(*).
+
+    Parameters:
+    - query (Query) : Rows to page through, ex: Owner.query. Must not be ordered yet.
+    - model (Flask-SQLAlchemy Model Obj) : Model whose id orders the query.
+    - page (int) : Page number, starting at 1.
+    - per_page (int) : Rows per page.
+
+    Return:
+    - Dictionary : {"items":[Model], "page_nav":{"prev_page", "next_page"}}
+    - Null : None when the page is past the last one.
+    """
+    if page < 1:
+        return None
+    rows = query.order_by(model.id).offset((page - 1) * per_page).limit(per_page + 1).all()
+    if not rows and page > 1:
+        return None
+    page_nav = {"prev_page": page - 1 if page > 1 else None,
+                "next_page": page + 1 if len(rows) > per_page else None}
+    return {"items": rows[:per_page], "page_nav": page_nav}
+
+
+# table name -> (counted at, row count)
+_counts = {}
+_counts_lock = threading.Lock()
+
+
+def cached_count(model, ttl=COUNT_TTL):
+    """
+    Row count of a model's table, counted at most once every ttl seconds.
+
+    Parameters:
+    - model (Flask-SQLAlchemy Model Obj) : Model to count.
+    - ttl (float) : Seconds a count is reused.
+
+    Return:
+    - count (int) : Number of rows, up to ttl seconds old.
+    """
+    now = time.monotonic()
+    with _counts_lock:
+        cached = _counts.get(model.__tablename__)
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+    count = db.session.query(func.count(model.id)).scalar()
+    with _counts_lock:
+        _counts[model.__tablename__] = (now, count)
+    return count
@@ -0,0 +1,358 @@
+# Imports
+from collections import defaultdict, Counter
+from sqlalchemy import select, insert, update, delete, func, or_, bindparam, literal, null, true, union, union_all
+from modules import (Owner, Company, OwnerCompany, OwnerEntity, Property, Portfolio, PortfolioOwner,
+                     PortfolioCompany, db)
+from sql_helpers import upsert, chunks
+from generation import bump_generation
+from entity_resolution import UnionFind
+
+# Ownership graph. Owners are connected by the LLCs they share (owner_company) and by being the same resolved
+# entity (owner_entity), and each connected group is a portfolio, found with union-find instead of walking
+# owner -> owner_company -> company -> owner_company -> owner in recursive joins. A portfolio's id is its
+# smallest owner id, an LLC without owners is a portfolio of its own with minus its id. portfolio_owner and
+# portfolio_company give the portfolio of each owner and LLC, and the portfolio table keeps each portfolio's
+# owner, LLC and property counts, so every lookup is one indexed read. A portfolio's properties are the ones
+# its owners or its LLCs hold, each counted once, so a property an LLC bought stays in the landlord's count.
+# rebuild_portfolios() builds the graph from scratch, update_portfolios() adds the owners, LLCs and links of a
+# crawl batch, merging the portfolios they connect, and the crawler's writes add to the property counts.
+
+# Most portfolios top_portfolios() returns
+MAX_PORTFOLIOS = 100
+
+# Rows read per query while rebuilding
+LOAD_BATCH = 50000
+
+# update_portfolios() looks for owners and links without a portfolio among the last this many ids of their
+# table, rows committed out of id order by concurrent crawl workers are still found
+NEW_ROW_WINDOW = 10000
+
+
+def company_portfolio(company_id):
+    """Id of the portfolio of an LLC without owners, negative so it can't be an owner id."""
+    return -company_id
+
+
+def rebuild_portfolios():
+    """
+    Builds every portfolio from scratch from the owner_company links and the resolved owner entities.
+
+    Return:
+    - (owners, portfolios) (tuple) : Number of owners and of portfolios.
+    """
+    sets = UnionFind()
+    for owner_id, cluster_id in (db.session.query(Owner.id, OwnerEntity.cluster_id)
+                                 .outerjoin(OwnerEntity, OwnerEntity.owner_id == Owner.id).yield_per(LOAD_BATCH)):
+        sets.find(owner_id)
+        if cluster_id is not None:
+            sets.union(cluster_id, owner_id)
+    # An LLC joins all its owners to its first one
+    first_owners = {}
+    for owner_id, company_id in (db.session.query(OwnerCompany.owner_id, OwnerCompany.company_id)
+                                 .yield_per(LOAD_BATCH)):
+        sets.union(first_owners.setdefault(company_id, owner_id), owner_id)
+    roots = sets.roots()
+    company_portfolios = {company_id: roots[owner_id] for company_id, owner_id in first_owners.items()}
+    for company_id, in db.session.query(Company.id).yield_per(LOAD_BATCH):
+        company_portfolios.setdefault(company_id, company_portfolio(company_id))
+    totals = defaultdict(lambda: [0, 0])
+    for owner_id, root in roots.items():
+        totals[root][0] += 1
+    for company_id, portfolio_id in company_portfolios.items():
+        totals[portfolio_id][1] += 1
+
+    for model in (Portfolio, PortfolioOwner, PortfolioCompany):
+        db.session.query(model).delete()
+    for model, rows in (
+            (PortfolioOwner, [{'owner_id': id, 'portfolio_id': root} for id, root in sorted(roots.items())]),
+            (PortfolioCompany, [{'company_id': id, 'portfolio_id': portfolio_id}
+                                for id, portfolio_id in sorted(company_portfolios.items())]),
+            (Portfolio, [{'portfolio_id': portfolio_id, 'owner_count': owners, 'company_count': companies,
+                          'property_count': 0}
+                         for portfolio_id, (owners, companies) in sorted(totals.items())])):
+        for chunk in chunks(rows, LOAD_BATCH):
+            db.session.execute(insert(model), chunk)
+    recount_portfolio_properties()
+    bump_generation()
+    db.session.commit()
+    return len(roots), len(totals)
+
+
+def update_portfolios():
+    """
+    Gives the owners, LLCs and owner_company links added since the last call their portfolio, merging the portfolios
+    a new link or entity connects. An LLC without owners gets a portfolio of its own until a link gives it one.
+    Called after each crawl batch is written and its owners resolved.
+
+    Return:
+    - owners (int) : Number of owners added to a portfolio.
+    """
+    try:
+        last_owner = db.session.query(func.max(Owner.id)).scalar() or 0
+        # New owner id -> their entity's cluster_id
+        new_owners = dict(db.session.query(Owner.id, OwnerEntity.cluster_id)
+                          .outerjoin(OwnerEntity, OwnerEntity.owner_id == Owner.id)
+                          .outerjoin(PortfolioOwner, PortfolioOwner.owner_id == Owner.id)
+                          .filter(Owner.id > last_owner - NEW_ROW_WINDOW, PortfolioOwner.owner_id.is_(None)))
+        last_link = db.session.query(func.max(OwnerCompany.id)).scalar() or 0
+        # Links whose owner and LLC aren't in the same portfolio yet
+        links = (db.session.query(OwnerCompany.owner_id, OwnerCompany.company_id, PortfolioOwner.portfolio_id,
+                                  PortfolioCompany.portfolio_id)
+                 .outerjoin(PortfolioOwner, PortfolioOwner.owner_id == OwnerCompany.owner_id)
+                 .outerjoin(PortfolioCompany, PortfolioCompany.company_id == OwnerCompany.company_id)
+                 .filter(OwnerCompany.id > last_link - NEW_ROW_WINDOW,
+                         or_(PortfolioOwner.portfolio_id.is_(None), PortfolioCompany.portfolio_id.is_(None),
+                             PortfolioOwner.portfolio_id != PortfolioCompany.portfolio_id)).all())
+        last_company = db.session.query(func.max(Company.id)).scalar() or 0
+        # New LLCs without an owner
+        new_companies = [company_id for company_id, in (
+            db.session.query(Company.id)
+            .outerjoin(PortfolioCompany, PortfolioCompany.company_id == Company.id)
+            .outerjoin(OwnerCompany, OwnerCompany.company_id == Company.id)
+            .filter(Company.id > last_company - NEW_ROW_WINDOW, PortfolioCompany.company_id.is_(None),
+                    OwnerCompany.company_id.is_(None)))]
+        if not new_owners and not links and not new_companies:
+            return 0
+
+        # Owner id -> portfolio, of the owners that have one
+        portfolio_of = {}
+        company_portfolios = {}
+        # LLCs that had no owners until now, their own portfolios go
+        owned = set()
+        for owner_id, company_id, owner_portfolio, llc_portfolio in links:
+            if owner_portfolio is None:
+                new_owners.setdefault(owner_id, None)
+            else:
+                portfolio_of[owner_id] = owner_portfolio
+            if llc_portfolio is not None and llc_portfolio < 0:
+                owned.add(company_id)
+            elif llc_portfolio is not None:
+                company_portfolios[company_id] = llc_portfolio
+        # Portfolios of the other owners of the new owners' entities
+        cluster_portfolios = defaultdict(set)
+        cluster_ids = sorted({cluster_id for cluster_id in new_owners.values() if cluster_id is not None})
+        for chunk in chunks(cluster_ids):
+            for owner_id, cluster_id, portfolio_id in (
+                    db.session.query(PortfolioOwner.owner_id, OwnerEntity.cluster_id, PortfolioOwner.portfolio_id)
+                    .join(OwnerEntity, OwnerEntity.owner_id == PortfolioOwner.owner_id)
+                    .filter(OwnerEntity.cluster_id.in_(chunk))):
+                portfolio_of[owner_id] = portfolio_id
+                cluster_portfolios[cluster_id].add(portfolio_id)
+
+        # Existing portfolios are single nodes, new owners join them
+        def node(owner_id):
+            return portfolio_of.get(owner_id, owner_id)
+
+        sets = UnionFind()
+        for owner_id, cluster_id in new_owners.items():
+            sets.find(owner_id)
+            if cluster_id in new_owners:
+                sets.union(owner_id, cluster_id)
+            for portfolio_id in cluster_portfolios[cluster_id]:
+                sets.union(owner_id, portfolio_id)
+        first_owners = {}
+        for owner_id, company_id, owner_portfolio, llc_portfolio in links:
+            anchor = company_portfolios.get(company_id) or first_owners.setdefault(company_id, node(owner_id))
+            sets.union(node(owner_id), anchor)
+
+        existing = sorted(set(portfolio_of.values()) | set(company_portfolios.values()))
+        # Portfolios merged into one with a smaller id
+        merged = defaultdict(list)
+        for portfolio_id in existing:
+            if sets.find(portfolio_id) != portfolio_id:
+                merged[sets.find(portfolio_id)].append(portfolio_id)
+        for root, portfolio_ids in sorted(merged.items()):
+            for model in (PortfolioOwner, PortfolioCompany):
+                db.session.execute(update(model).where(model.portfolio_id.in_(portfolio_ids)).values(portfolio_id=root))
+            db.session.execute(delete(Portfolio).where(Portfolio.portfolio_id.in_(portfolio_ids)))
+        for chunk in chunks(sorted(owned)):
+            db.session.execute(delete(PortfolioCompany).where(PortfolioCompany.company_id.in_(chunk)))
+            db.session.execute(delete(Portfolio).where(
+                Portfolio.portfolio_id.in_([company_portfolio(company_id) for company_id in chunk])))
+        if new_owners:
+            db.session.execute(insert(PortfolioOwner), [{'owner_id': owner_id, 'portfolio_id': sets.find(owner_id)}
+                                                        for owner_id in sorted(new_owners)])
+        if first_owners:
+            db.session.execute(insert(PortfolioCompany), [{'company_id': company_id, 'portfolio_id': sets.find(owner_id)}
+                                                          for company_id, owner_id in sorted(first_owners.items())])
+        if new_companies:
+            db.session.execute(insert(PortfolioCompany), [{'company_id': company_id,
+                                                           'portfolio_id': company_portfolio(company_id)}
+                                                          for company_id in new_companies])
+        recount_portfolios(sorted({sets.find(id) for id in list(new_owners) + existing}
+                                  | {company_portfolio(company_id) for company_id in new_companies}))
+        bump_generation()
+        db.session.commit()
+        return len(new_owners)
+
+    except Exception as e:
+        # The rows are picked up again by the next call, or by rebuild_portfolios()
+        db.session.rollback()
+        print(f"Exception from update_portfolios : {e}")
+        return 0
+
+
+def member_count(model, portfolio_id):
+    """Correlated subquery counting a portfolio's rows in PortfolioOwner or PortfolioCompany."""
+    return select(func.count()).select_from(model).where(model.portfolio_id == portfolio_id).scalar_subquery()
+
+
+def property_count(portfolio_id):
+    """Correlated subquery counting the properties a portfolio's owners or LLCs hold, each one once."""
+    # Two levels down from the portfolio, so they're told what to correlate
+    owners = (select(PortfolioOwner.owner_id).where(PortfolioOwner.portfolio_id == portfolio_id)
+              .correlate_except(PortfolioOwner))
+    companies = (select(PortfolioCompany.company_id).where(PortfolioCompany.portfolio_id == portfolio_id)
+                 .correlate_except(PortfolioCompany))
+    return (select(func.count(Property.id)).where(or_(Property.owner_id.in_(owners), Property.llc_id.in_(companies)))
+            .scalar_subquery())
+
+
+def recount_portfolios(portfolio_ids):
+    """
+    Counts portfolios' owners, LLCs and properties from their members, in the caller's transaction. Counted in
+    the upsert itself, so properties other crawl workers counted meanwhile (count_portfolio_properties) aren't
+    overwritten with totals read before they committed.
+
+    Parameters:
+    - portfolio_ids (list) : Ids of portfolios whose members changed.
+    """
+    for chunk in chunks(portfolio_ids):
+        ids = union(select(PortfolioOwner.portfolio_id).where(PortfolioOwner.portfolio_id.in_(chunk)),
+                    select(PortfolioCompany.portfolio_id).where(PortfolioCompany.portfolio_id.in_(chunk))).subquery()
+        counts = (select(ids.c.portfolio_id, member_count(PortfolioOwner, ids.c.portfolio_id),
+                         member_count(PortfolioCompany, ids.c.portfolio_id), property_count(ids.c.portfolio_id))
+                  # SQLite needs a WHERE to tell an upsert's SELECT apart from a join's ON
+                  .where(true()))
+        statement = upsert(Portfolio).from_select(['portfolio_id', 'owner_count', 'company_count', 'property_count'],
+                                                  counts)
+        excluded = statement.excluded
+        db.session.execute(statement.on_conflict_do_update(index_elements=['portfolio_id'], set_={
+            'owner_count': excluded.owner_count, 'company_count': excluded.company_count,
+            'property_count': excluded.property_count}))
+
+
+def recount_portfolio_properties():
+    """Recounts every portfolio's properties, in the caller's transaction, ex: after rebuild_rankings()."""
+    table = Portfolio.__table__
+    db.session.execute(update(table).values(property_count=property_count(table.c.portfolio_id)))
+
+
+def count_portfolio_properties(properties, removed=()):
+    """
+    Moves the portfolios' property counts along with inserted properties and ones moved to another owner or LLC,
+    in the caller's transaction. A property counts in the portfolio of its owner and in the one of its LLC, once
+    when they're the same. Owners and LLCs without a portfolio yet are skipped, update_portfolios() counts all
+    their properties when it adds them.
+
+    Parameters:
+    - properties (list) : (owner_id, llc_id) of each inserted or updated property, either can be None.
+    - removed (list) : (owner_id, llc_id) each updated property had before.
+    """
+    owner_ids = sorted({owner_id for owner_id, llc_id in properties + removed if owner_id is not None})
+    company_ids = sorted({llc_id for owner_id, llc_id in properties + removed if llc_id is not None})
+    portfolios = {}
+    for kind, column, portfolio_column, ids in (
+            ('owner', PortfolioOwner.owner_id, PortfolioOwner.portfolio_id, owner_ids),
+            ('company', PortfolioCompany.company_id, PortfolioCompany.portfolio_id, company_ids)):
+        for chunk in chunks(ids):
+            for id, portfolio_id in db.session.query(column, portfolio_column).filter(column.in_(chunk)):
+                portfolios[kind, id] = portfolio_id
+    counts = Counter()
+    for step, rows in ((1, properties), (-1, removed)):
+        for owner_id, llc_id in rows:
+            for portfolio_id in {portfolios.get(('owner', owner_id)), portfolios.get(('company', llc_id))} - {None}:
+                counts[portfolio_id] += step
+    rows = [{'portfolio': id, 'properties': count} for id, count in sorted(counts.items()) if count]
+    if not rows:
+        return
+    table = Portfolio.__table__
+    db.session.execute(update(table).where(table.c.portfolio_id == bindparam('portfolio'))
+                       .values(property_count=table.c.property_count + bindparam('properties')), rows)
+
+
+def ensure_portfolios():
+    """Builds the portfolios of a database that has owners but no portfolios yet, ex: one crawled before the graph existed."""
+    if db.session.query(Portfolio.portfolio_id).first() is None and db.session.query(Owner.id).first() is not None:
+        rebuild_portfolios()
+
+
+def portfolio_dict(row):
+    return {"id": row.portfolio_id, "name": row.full_name, "owner_count": row.owner_count,
+            "company_count": row.company_count, "property_count": row.property_count}
+
+
+def portfolio_query():
+    """Portfolios with the name of their first owner, or of their LLC when it has no owners."""
+    name = func.coalesce(Owner.full_name, Company.llc_name).label('full_name')
+    return (db.session.query(Portfolio.portfolio_id, name, Portfolio.owner_count, Portfolio.company_count,
+                             Portfolio.property_count)
+            .outerjoin(Owner, Owner.id == Portfolio.portfolio_id)
+            .outerjoin(Company, Company.id == -Portfolio.portfolio_id))
+
+
+def top_portfolios(limit=10):
+    """
+    Portfolios with the most properties.
+
+    Parameters:
+    - limit (int) : Number of portfolios, at most MAX_PORTFOLIOS.
+
+    Return:
+    - portfolios (list) : [{id, name, owner_count, company_count, property_count}, ...] most properties first.
+    """
+    query = (portfolio_query().order_by(Portfolio.property_count.desc(), Portfolio.portfolio_id.desc())
+             .limit(min(limit, MAX_PORTFOLIOS)))
+    return [portfolio_dict(row) for row in query]
+
+
+def portfolio(portfolio_id):
+    """
+    A portfolio's size.
+
+    Parameters:
+    - portfolio_id (int) : Portfolio's id, the portfolio_id of any of its owners, minus the id of an LLC without owners.
+
+    Return:
+    - Dictionary : {id, name, owner_count, company_count, property_count}, name is its first owner's or its LLC's.
+    - Null : None when there's no such portfolio.
+    """
+    row = portfolio_query().filter(Portfolio.portfolio_id == portfolio_id).first()
+    return portfolio_dict(row) if row is not None else None
+
+
+def portfolio_members(portfolio_id):
+    """
+    A portfolio's owners, with their entity's cluster_id, and LLCs, in a single query.
+
+    Parameters:
+    - portfolio_id (int) : Portfolio's id.
+
+    Return:
+    - Dictionary : {portfolio_id, owners: [{id, full_name, cluster_id}, ...], companies: [{id, llc_name}, ...]} in id order.
+    - Null : None when there's no such portfolio.
+    """
+    owners = (select(literal('owner').label('kind'), Owner.id, Owner.full_name.label('name'), OwnerEntity.cluster_id)
+              .select_from(PortfolioOwner).join(Owner, Owner.id == PortfolioOwner.owner_id)
+              .outerjoin(OwnerEntity, OwnerEntity.owner_id == Owner.id)
+              .where(PortfolioOwner.portfolio_id == portfolio_id))
+    companies = (select(literal('company').label('kind'), Company.id, Company.llc_name.label('name'),
+                        null().label('cluster_id'))
+                 .select_from(PortfolioCompany).join(Company, Company.id == PortfolioCompany.company_id)
+                 .where(PortfolioCompany.portfolio_id == portfolio_id))
+    rows = sorted(db.session.execute(union_all(owners, companies)).all(), key=lambda row: row.id)
+    if not rows:
+        return None
+    return {
+        "portfolio_id": portfolio_id,
+        "owners": [{"id": row.id, "full_name": row.name, "cluster_id": row.cluster_id}
+                   for row in rows if row.kind == 'owner'],
+        "companies": [{"id": row.id, "llc_name": row.name} for row in rows if row.kind == 'company']
+    }
+
+
+if __name__ == '__main__':
+    # python portfolios.py rebuilds the portfolios of the database at DATABASE_URL
+    from app import app
+    owners, portfolios = rebuild_portfolios()
+    print(f"Rebuilt portfolios: {owners} owners in {portfolios} portfolios")
@@ -0,0 +1,51 @@
+# Imports
+import threading
+from sqlalchemy import event
+
+# Counts the SQL statements run while serving a request, to catch N+1 queries: a view whose query count
+# grows with the number of rows it returns is lazy loading a relationship per row.
+# benchmark.py queries runs every API read endpoint at two result sizes and fails if any count differs.
+
+
+class QueryCounter:
+    """
+    Counts the statements an engine runs inside a with block, ex:
+        with QueryCounter(db.engine) as counter:
+            client.get('/api/owners')
+        counter.count
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def _before_execute(self, connection, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.count += 1
+            self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._before_execute)
+        return False
+
+
+def count_queries(engine, function, *args, **kwargs):
+    """
+    Calls function and counts the statements it runs.
+
+    Parameters:
+    - engine (Engine) : Engine to watch, ex: db.engine
+    - function (function) : Called as function(*args, **kwargs).
+
+    Return:
+    - (count, statements) (tuple) : Number of statements and their SQL.
+    """
+    with QueryCounter(engine) as counter:
+        function(*args, **kwargs)
+    return counter.count, counter.statements
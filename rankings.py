@@ -0,0 +1,107 @@
+# Imports
+from collections import Counter
+from sqlalchemy import func, insert
+from modules import Owner, Company, Property, OwnerPropertyCount, CompanyPropertyCount, db
+from sql_helpers import upsert, chunks
+from generation import bump_generation
+from portfolios import count_portfolio_properties, recount_portfolio_properties
+
+# Property counts per owner and per LLC, kept in their own tables so the rankings read the top of an index
+# instead of grouping and sorting the whole property table on every request. The crawler's writes add to the
+# counts in the same transaction as the properties, and to their owners' and LLCs' portfolio counts (portfolios.py),
+# rebuild_rankings() recounts everything from scratch.
+
+# Most rows a ranking returns
+MAX_RANKING = 100
+
+
+def count_properties(properties, removed=()):
+    """
+    Adds newly inserted properties to the counts and moves updated ones off their old owner's and LLC's,
+    in the caller's transaction.
+
+    Parameters:
+    - properties (iterable) : (owner_id, llc_id) of each inserted or updated property, either can be None.
+    - removed (iterable) : (owner_id, llc_id) each updated property had before, taken off their counts.
+    """
+    properties, removed = list(properties), list(removed)
+    owners = Counter()
+    companies = Counter()
+    for step, rows in ((1, properties), (-1, removed)):
+        for owner_id, llc_id in rows:
+            if owner_id is not None:
+                owners[owner_id] += step
+            if llc_id is not None:
+                companies[llc_id] += step
+    for model, key, counts in ((OwnerPropertyCount, 'owner_id', owners), (CompanyPropertyCount, 'company_id', companies)):
+        rows = [{key: id, 'property_count': count} for id, count in sorted(counts.items()) if count]
+        for chunk in chunks(rows):
+            statement = upsert(model).values(chunk)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=[key], set_={'property_count': model.property_count + statement.excluded.property_count}))
+    count_portfolio_properties(properties, removed)
+
+
+def rebuild_rankings():
+    """Recounts every owner's, LLC's and portfolio's properties from the property table, ex: after rows were deleted by hand."""
+    db.session.query(OwnerPropertyCount).delete()
+    db.session.query(CompanyPropertyCount).delete()
+    db.session.execute(insert(OwnerPropertyCount).from_select(
+        ['owner_id', 'property_count'],
+        db.session.query(Property.owner_id, func.count(Property.id))
+        .filter(Property.owner_id.isnot(None)).group_by(Property.owner_id)))
+    db.session.execute(insert(CompanyPropertyCount).from_select(
+        ['company_id', 'property_count'],
+        db.session.query(Property.llc_id, func.count(Property.id))
+        .filter(Property.llc_id.isnot(None)).group_by(Property.llc_id)))
+    # Portfolios count their owners' and LLCs' properties
+    recount_portfolio_properties()
+    bump_generation()
+    db.session.commit()
+
+
+def ensure_rankings():
+    """Builds the rankings of a database that has properties but no counts yet, ex: one crawled before the counts existed."""
+    if db.session.query(OwnerPropertyCount.owner_id).first() is None and db.session.query(Property.id).first() is not None:
+        rebuild_rankings()
+
+
+def top_owners(limit=10):
+    """
+    Owners with the most properties.
+
+    Parameters:
+    - limit (int) : Number of owners, at most MAX_RANKING.
+
+    Return:
+    - owners (list) : [{id, full_name, property_count}, ...] most properties first.
+    """
+    query = (db.session.query(Owner.id, Owner.full_name, OwnerPropertyCount.property_count)
+             .join(OwnerPropertyCount, OwnerPropertyCount.owner_id == Owner.id)
+             .order_by(OwnerPropertyCount.property_count.desc(), OwnerPropertyCount.owner_id.desc())
+             .limit(min(limit, MAX_RANKING)))
+    return [{"id": o.id, "full_name": o.full_name, "property_count": o.property_count} for o in query]
+
+
+def top_companies(limit=10):
+    """
+    LLCs with the most properties.
+
+    Parameters:
+    - limit (int) : Number of LLCs, at most MAX_RANKING.
+
+    Return:
+    - companies (list) : [{id, llc_name, property_count}, ...] most properties first.
+    """
+    query = (db.session.query(Company.id, Company.llc_name, CompanyPropertyCount.property_count)
+             .join(CompanyPropertyCount, CompanyPropertyCount.company_id == Company.id)
+             .order_by(CompanyPropertyCount.property_count.desc(), CompanyPropertyCount.company_id.desc())
+             .limit(min(limit, MAX_RANKING)))
+    return [{"id": c.id, "llc_name": c.llc_name, "property_count": c.property_count} for c in query]
+
+
+if __name__ == '__main__':
+    # python rankings.py recounts the rankings of the database at DATABASE_URL
+    from app import app
+    rebuild_rankings()
+    print(f"Rebuilt rankings: {OwnerPropertyCount.query.count()} owners, {CompanyPropertyCount.query.count()} LLCs")
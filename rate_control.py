@@ -0,0 +1,259 @@
+# Imports
+import re
+import time
+import random
+import threading
+from collections import deque
+from requests.exceptions import HTTPError, Timeout, ConnectionError as RequestsConnectionError
+
+# Keeps the crawl as fast as the county site allows without getting it blocked. Every request to the site
+# goes through call_with_backoff(), which
+# - waits while the CircuitBreaker is open, the site failed too many requests in a row and gets left alone for a while,
+# - takes a slot from the AdaptiveLimiter, which adds a slot while requests succeed quickly and halves the
+#   slots on timeouts and 5xx responses (AIMD, the way TCP finds the bandwidth of a link),
+# - retries timeouts, 5xx and dropped connections after a jittered exponential backoff.
+
+
+def classify_error(e):
+    """
+    Sorts a request's exception by what it says about the site.
+
+    Parameters:
+    - e (Exception) : Raised by a fetch.
+
+    Return:
+    - kind (str) : 'timeout', 'server' (5xx, 429), 'connection' and 'other' mean the site may be struggling and are retried,
+                   'client' (any other 4xx) means this one request was bad and isn't.
+    """
+    if isinstance(e, (TimeoutError, Timeout)) or type(e).__name__ == 'TimeoutError':
+        # pyppeteer has its own TimeoutError that isn't the builtin one
+        return 'timeout'
+    if isinstance(e, HTTPError):
+        status = error_status(e)
+        if status is None or status >= 500 or status in (408, 429):
+            return 'server'
+        return 'client'
+    if isinstance(e, (RequestsConnectionError, ConnectionError)) or 'net::ERR_' in str(e):
+        return 'connection'
+    return 'other'
+
+
+def error_status(e):
+    """Returns the HTTP status of an HTTPError, from its response or from the start of its message, ex: '503 Error for url'."""
+    if e.response is not None:
+        return e.response.status_code
+    match = re.match(r'\s*(\d{3})\b', str(e))
+    return int(match.group(1)) if match else None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    Full jitter exponential backoff, a random wait between 0 and base * 2^attempt seconds. The randomness
+    keeps workers that failed together from all retrying at the same moment.
+
+    Parameters:
+    - attempt (int) : Number of failed attempts so far, starting at 0.
+    - base (float) : Seconds of the first backoff window.
+    - cap (float) : Longest window.
+
+    Return:
+    - delay (float) : Seconds to wait.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that follows the site's health. Each quick success adds 1/limit of a slot, so the limit
+    grows by about one per round of requests. A timeout, a 5xx or a response slower than `latency_target` halves it,
+    at most once per `cooldown` seconds so a burst of failures from the same moment only counts once.
+    """
+
+    def __init__(self, min_limit=1, max_limit=8, initial=2, latency_target=15.0, decrease=0.5, cooldown=2.0):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self.stats = {'successes': 0, 'failures': 0, 'decreases': 0, 'peak_limit': int(self.limit)}
+
+    def acquire(self):
+        """Blocks until fewer than limit requests are in flight."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, seconds):
+        """Records a request that came back in seconds."""
+        with self._condition:
+            self.stats['successes'] += 1
+            if self.latency_target and seconds > self.latency_target:
+                self._back_off()
+                return
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.stats['peak_limit'] = max(self.stats['peak_limit'], int(self.limit))
+            self._condition.notify_all()
+
+    def on_failure(self):
+        """Records a request the site failed, ex: a timeout or a 5xx."""
+        with self._condition:
+            self.stats['failures'] += 1
+            self._back_off()
+
+    def _back_off(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.stats['decreases'] += 1
+
+    def set_max_limit(self, max_limit):
+        """Changes the ceiling, ex: to the crawl's number of fetch threads."""
+        with self._condition:
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = min(self.limit, self.max_limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Stops all requests when the site is failing. Opens once `threshold` of the last `window` requests failed,
+    then lets a single probe request through after `cooldown` seconds. A good probe closes it, a bad one
+    opens it again for twice as long, up to `max_cooldown`.
+    """
+
+    def __init__(self, window=20, threshold=0.5, cooldown=30.0, max_cooldown=600.0):
+        self.window = window
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # True for a good request, False for a failed one
+        self.results = deque(maxlen=window)
+        # 'closed' lets everything through, 'open' nothing, 'half_open' just the probe
+        self.state = 'closed'
+        self.opened_at = None
+        self._probing = False
+        # Thread making the probe request, results of requests that were in flight before it don't count
+        self._probe_thread = None
+        self._condition = threading.Condition()
+        self.stats = {'opened': 0}
+
+    def wait(self):
+        """Blocks while the breaker is open, returns once the request may go ahead."""
+        with self._condition:
+            while True:
+                if self.state == 'closed':
+                    return
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining <= 0 and not self._probing:
+                    self.state = 'half_open'
+                    self._probing = True
+                    self._probe_thread = threading.get_ident()
+                    return
+                self._condition.wait(timeout=remaining if remaining > 0 else None)
+
+    def on_success(self):
+        with self._condition:
+            if not self._counts():
+                return
+            if self.state == 'half_open':
+                print('CircuitBreaker: site is back, resuming')
+                self.state = 'closed'
+                self.cooldown = self.base_cooldown
+                self.results.clear()
+                self._probing = False
+                self._condition.notify_all()
+            self.results.append(True)
+
+    def on_failure(self):
+        with self._condition:
+            if not self._counts():
+                return
+            if self.state == 'half_open':
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self._open()
+                return
+            self.results.append(False)
+            if (len(self.results) == self.window
+                    and self.results.count(False) >= self.threshold * self.window):
+                self._open()
+
+    def _counts(self):
+        """While the breaker isn't closed only the probe's result counts, not those of requests that were already in flight."""
+        return self.state == 'closed' or (self.state == 'half_open' and self._probe_thread == threading.get_ident())
+
+    def _open(self):
+        print(f"CircuitBreaker: site is failing, pausing requests for {self.cooldown:.1f}s")
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self._probing = False
+        self.stats['opened'] += 1
+        self._condition.notify_all()
+
+
+def call_with_backoff(function, url, limiter=None, breaker=None, max_attempts=5, base_delay=1.0, max_delay=60.0):
+    """
+    Calls function(url) through the circuit breaker and the adaptive limiter, retrying failures the site
+    might get over with a jittered exponential backoff.
+
+    Parameters:
+    - function (function) : Request to make, ex: scraper.fetch_rendered_html.
+    - url (str) : URL passed to function.
+    - limiter (AdaptiveLimiter) : Concurrency limit shared by every request to the site, None for no limit.
+    - breaker (CircuitBreaker) : Breaker shared by every request to the site, None for no breaker.
+    - max_attempts (int) : Attempts before the last exception is raised.
+    - base_delay (float) : Seconds of the first backoff window.
+    - max_delay (float) : Longest backoff window.
+
+    Return:
+    - Result : Whatever function returns.
+    """
+    for attempt in range(max_attempts):
+        if breaker:
+            breaker.wait()
+        if limiter:
+            limiter.acquire()
+        started = time.monotonic()
+        error = None
+        try:
+            result = function(url)
+        except Exception as e:
+            error = e
+        finally:
+            # The slot is given back before any backoff, so the other requests aren't held up
+            if limiter:
+                limiter.release()
+
+        if error is None:
+            if limiter:
+                limiter.on_success(time.monotonic() - started)
+            if breaker:
+                breaker.on_success()
+            return result
+
+        kind = classify_error(error)
+        if kind == 'client':
+            # The site answered, it just doesn't have this page
+            if breaker:
+                breaker.on_success()
+            raise error
+        if limiter:
+            limiter.on_failure()
+        if breaker:
+            breaker.on_failure()
+        if attempt + 1 == max_attempts:
+            raise error
+        delay = backoff_delay(attempt, base_delay, max_delay)
+        print(f"{type(error).__name__} ({kind}) for {url}: retrying in {delay:.1f}s ({attempt + 1}/{max_attempts})")
+        time.sleep(delay)
@@ -0,0 +1,166 @@
+# Imports
+import json
+import hashlib
+from datetime import datetime
+from sqlalchemy import case, insert
+from modules import ParcelFingerprint, CrawlerProgress, db
+from sql_helpers import upsert, chunks
+from scraper import get_parid
+from metrics import timed_db
+
+# Incremental re-crawls. Every scraped parcel's data is hashed into a fingerprint, a parcel that comes back
+# with the same fingerprint is not written again. The fingerprints also keep count of how often each parcel
+# has changed, so a refresh pass can spend its page budget on the parcels most likely to have changed.
+
+# How much more likely a parcel is to change when its last sale had a price, or when an LLC owns it
+SOLD_WEIGHT = 2.0
+LLC_WEIGHT = 1.5
+
+
+def fingerprint(data):
+    """
+    Hashes the scraped values of a parcel, next_url is left out since it isn't the parcel's data.
+
+    Parameters:
+    - data (dict) : Scraper result.
+
+    Return:
+    - fingerprint (str) : 40 character hex digest.
+    """
+    values = {key: value for key, value in data.items() if key != 'next_url'}
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def is_sold(data):
+    """True when the parcel's last sale had a price, sales between an owner and their own LLC are recorded at 0."""
+    try:
+        return int(data['price']) > 0
+    except (ValueError, TypeError):
+        return False
+
+
+class FingerprintWriter:
+    """
+    Wraps a write(data, url) function and only passes it parcels whose data changed since they were last scraped.
+    Unchanged parcels still get a CrawlerProgress row so the crawl resumes from the right place.
+    Fingerprints are saved `batch_size` parcels at a time, after the wrapped writer has flushed, so a parcel
+    is never marked unchanged before its data is in the database. Parcels the writer couldn't write, returned
+    False for or listed in its `failed` urls, aren't fingerprinted and are written again next time, a call returns
+    False when the wrapped write did.
+    With rewrite, unchanged parcels are written too, ex: to fix rows written before a change to the write path.
+    """
+
+    def __init__(self, write, batch_size=100, rewrite=False):
+        self.write = write
+        self.batch_size = batch_size
+        self.rewrite = rewrite
+        # parid -> fingerprint saved in the database, loaded on first use
+        self.known = None
+        # parid -> fingerprint row waiting for the next flush
+        self.pending = {}
+        # CrawlerProgress rows of unchanged parcels waiting for the next flush
+        self.progress = []
+        self.stats = {'new': 0, 'changed': 0, 'unchanged': 0}
+
+    def __call__(self, data, url):
+        if self.known is None:
+            self.known = dict(db.session.query(ParcelFingerprint.parid, ParcelFingerprint.fingerprint))
+        parid = get_parid(url)
+        digest = fingerprint(data)
+        known = self.known.get(parid)
+        now = datetime.utcnow()
+        row = {'parid': parid, 'fingerprint': digest, 'checks': 1, 'changes': 0, 'last_checked': now,
+               'last_changed': now, 'llc': 'LLC' in data['owner_name'], 'sold': is_sold(data)}
+        if known == digest and not self.rewrite:
+            self.stats['unchanged'] += 1
+            self.progress.append({'curr_url': url, 'next_url': data['next_url']})
+        else:
+            self.stats['new' if known is None else 'unchanged' if known == digest else 'changed'] += 1
+            if known is not None and known != digest:
+                row['changes'] = 1
+            if self.write(data, url) is False:
+                return False
+        self.pending[parid] = row
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Flushes the wrapped writer, then saves the fingerprints of everything it was handed."""
+        if hasattr(self.write, 'flush'):
+            self.write.flush()
+        failed = getattr(self.write, 'failed', None)
+        if failed:
+            for url in failed:
+                self.pending.pop(get_parid(url), None)
+            failed.clear()
+        if not self.pending and not self.progress:
+            return
+        rows, self.pending = list(self.pending.values()), {}
+        progress, self.progress = self.progress, []
+        try:
+            with timed_db('fingerprint_flush'):
+                self._save(rows, progress)
+            for row in rows:
+                self.known[row['parid']] = row['fingerprint']
+
+        except Exception as e:
+            # Unsaved fingerprints only mean the parcels get written again next time
+            db.session.rollback()
+            print(f"Exception from FingerprintWriter : {e}")
+
+    def _save(self, rows, progress):
+        if progress:
+            db.session.execute(insert(CrawlerProgress), progress)
+        for chunk in chunks(rows):
+            statement = upsert(ParcelFingerprint).values(chunk)
+            excluded = statement.excluded
+            statement = statement.on_conflict_do_update(index_elements=['parid'], set_={
+                'fingerprint': excluded.fingerprint,
+                'checks': ParcelFingerprint.checks + 1,
+                'changes': ParcelFingerprint.changes + excluded.changes,
+                'last_checked': excluded.last_checked,
+                # Only moves when the data changed
+                'last_changed': case((excluded.changes > 0, excluded.last_changed),
+                                     else_=ParcelFingerprint.last_changed),
+                'llc': excluded.llc,
+                'sold': excluded.sold})
+            db.session.execute(statement)
+        db.session.commit()
+
+
+def change_score(row, now):
+    """
+    Expected number of changes a parcel has had since it was last checked: its change rate, smoothed so
+    parcels checked only once or twice aren't written off, weighted by sales and LLC ownership, times the
+    days since the last check.
+
+    Parameters:
+    - row (ParcelFingerprint) : The parcel's fingerprint row.
+    - now (datetime) : Time the schedule is made.
+
+    Return:
+    - score (float) : Higher means more likely to have changed.
+    """
+    rate = (row.changes + 1) / (row.checks + 2)
+    if row.sold:
+        rate *= SOLD_WEIGHT
+    if row.llc:
+        rate *= LLC_WEIGHT
+    days = (now - row.last_checked).total_seconds() / 86400
+    return rate * (days + 1)
+
+
+def schedule_recrawl(budget):
+    """
+    Picks the parcels a refresh pass should spend its pages on.
+
+    Parameters:
+    - budget (int) : Number of parcels to re-crawl.
+
+    Return:
+    - parids (list) : The budget parcels with the highest change_score(), in parid order.
+    """
+    now = datetime.utcnow()
+    rows = ParcelFingerprint.query.all()
+    rows.sort(key=lambda row: change_score(row, now), reverse=True)
+    return sorted(row.parid for row in rows[:budget])
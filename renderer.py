@@ -0,0 +1,179 @@
+# Imports
+import asyncio
+import threading
+import time
+from collections import deque
+import pyppeteer
+from pyppeteer.errors import TimeoutError as PageTimeoutError
+from requests.exceptions import HTTPError
+
+# Pool of headless Chromium pages that stay open between parcels. The browser lives on its own
+# event loop thread, so any thread (or any other event loop) can hand it urls to render.
+
+# True once the Angular bindings of the quickinfo tables have filled in the situs, owner and mail address
+# cells and the grantor/grantee spans of the sales table.
+QUICKINFO_READY = """() => {
+    const filled = (element) => element !== null && element.textContent.trim() !== '' && !element.textContent.includes('{{');
+    const cell = (label) => {
+        for (const th of document.querySelectorAll('table.quickinfo_subgrp th')) {
+            if (th.textContent.trim().toLowerCase() === label) {
+                return th.nextElementSibling;
+            }
+        }
+        return null;
+    };
+    const spans = document.querySelectorAll('table.quickinfo_subgrp span.ng-binding.ng-scope');
+    return filled(cell('situs 1')) && filled(cell('owner 1')) && filled(cell('mail address'))
+        && spans.length >= 2 && filled(spans[0]) && filled(spans[1]);
+}"""
+
+
+class RendererPool:
+    """
+    Launches one Chromium with `size` pages and reuses them for every render. A page is closed and
+    replaced after `max_uses` renders or when a render crashes it, the browser is relaunched if it dies.
+    """
+
+    def __init__(self, size=2, max_uses=100, executable_path=None):
+        self.size = size
+        self.max_uses = max_uses
+        self.executable_path = executable_path
+        self.browser = None
+        # Idle pages, a render takes one off the queue and puts one back when it's done
+        self._idle = None
+        # page -> number of renders it has done
+        self._uses = {}
+        self._browser_lock = None
+        # (url, seconds, condition met) of the latest renders, only touched from the pool's loop
+        self.timings = deque(maxlen=1000)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self._call(self._start())
+
+    def _call(self, coroutine):
+        """Runs a coroutine on the pool's loop and blocks the calling thread until it finishes."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _start(self):
+        self._idle = asyncio.Queue()
+        self._browser_lock = asyncio.Lock()
+        await self._launch_browser()
+        for _ in range(self.size):
+            await self._idle.put(await self._new_page())
+
+    async def _launch_browser(self):
+        options = {'headless': True, 'args': ['--no-sandbox'],
+                   # Signal handlers can only be installed from the main thread
+                   'handleSIGINT': False, 'handleSIGTERM': False, 'handleSIGHUP': False}
+        if self.executable_path:
+            options['executablePath'] = self.executable_path
+        self.browser = await pyppeteer.launch(options)
+
+    async def _new_page(self):
+        """Opens a page, relaunching the browser first if it has gone away."""
+        async with self._browser_lock:
+            if self.browser is None or self.browser.process.poll() is not None:
+                print('RendererPool: browser is down, relaunching')
+                self._uses.clear()
+                await self._launch_browser()
+            page = await self.browser.newPage()
+        self._uses[page] = 0
+        return page
+
+    async def _retire(self, page):
+        """Closes a page that is worn out or broken and returns a fresh one, or None if none could be opened."""
+        self._uses.pop(page, None)
+        try:
+            await page.close()
+        except Exception:
+            # The page or the whole browser is already gone
+            pass
+        try:
+            return await self._new_page()
+        except Exception as e:
+            print(f"Exception from RendererPool : {e}")
+            return None
+
+    async def _render(self, url, sleep, timeout, wait_for, wait_timeout):
+        page = await self._idle.get()
+        broken = False
+        started = time.monotonic()
+        try:
+            if page is None:
+                # Replacing this page failed last time, try again now
+                page = await self._new_page()
+            response = await page.goto(url, timeout=timeout * 1000)
+            # Same check HTMLSession made with raise_for_status
+            if response is None or response.status >= 400:
+                status = response.status if response else 'no response'
+                raise HTTPError(f"{status} Error for url: {url}")
+            ready = True
+            if wait_for:
+                try:
+                    await page.waitForFunction(wait_for, {'timeout': wait_timeout * 1000})
+                except PageTimeoutError:
+                    # Parcels with an empty field never meet the condition, read them as they are
+                    ready = False
+            if sleep:
+                await asyncio.sleep(sleep)
+            await page.evaluate('window.scrollBy(0, window.innerHeight)')
+            html = await page.content()
+            self.timings.append((url, time.monotonic() - started, ready))
+            return html
+
+        except HTTPError:
+            # A bad status is the site's problem, the page itself is fine
+            raise
+
+        except Exception:
+            # Timeouts and crashes can leave the page stuck mid-load, so it gets replaced
+            broken = True
+            raise
+
+        finally:
+            if page is not None:
+                self._uses[page] = self._uses.get(page, 0) + 1
+                if broken or self._uses[page] >= self.max_uses:
+                    page = await self._retire(page)
+            await self._idle.put(page)
+
+    def render(self, url, sleep=0, timeout=20, wait_for=None, wait_timeout=8):
+        """
+        Renders url on one of the pooled pages, waiting for a free page if they are all busy.
+
+        Parameters:
+        - url (str) : URL of dynamically updated page.
+        - sleep (int) : Seconds to let the page's scripts run before reading it.
+        - timeout (int) : Seconds before the page load raises TimeoutError.
+        - wait_for (str) : JavaScript function, the page is read as soon as it returns true, ex: QUICKINFO_READY.
+        - wait_timeout (int) : Most seconds to wait on wait_for, the page is read as it is after that.
+
+        Return:
+        - HTML (str) : The rendered HTML document.
+        """
+        return self._call(self._render(url, sleep, timeout, wait_for, wait_timeout))
+
+    def timing_summary(self):
+        """
+        Summarizes how long the latest renders took, from goto until the page was read.
+
+        Return:
+        - summary (dict) : {'renders', 'mean', 'p50', 'max', 'not_ready'}, times in seconds.
+        """
+        timings = list(self.timings)
+        if not timings:
+            return {'renders': 0, 'mean': None, 'p50': None, 'max': None, 'not_ready': 0}
+        seconds = sorted(timing[1] for timing in timings)
+        return {'renders': len(seconds),
+                'mean': sum(seconds) / len(seconds),
+                'p50': seconds[len(seconds) // 2],
+                'max': seconds[-1],
+                'not_ready': sum(1 for timing in timings if not timing[2])}
+
+    def close(self):
+        """Closes the browser and stops the pool's loop thread."""
+        if self.browser is not None:
+            self._call(self.browser.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
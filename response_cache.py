@@ -0,0 +1,97 @@
+# Imports
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, current_app
+from generation import current_generation
+
+# Cache of the API's rendered JSON responses. The data only changes when the crawler writes, so a response is
+# kept under (crawl generation, url) and served from memory until the generation moves on, entries of old
+# generations age out of the LRU. Responses carry an ETag so browsers revalidate with If-None-Match and get a
+# 304 Not Modified without the body.
+
+# Most bytes of response bodies kept, 0 turns the cache off
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024))
+
+
+class ResponseCache:
+    """LRU of response bodies bounded by their total size, least recently used ones are evicted first."""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        # (generation, url) -> (etag, body, mimetype)
+        self.entries = OrderedDict()
+        self.size = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self.entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[1])
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(view):
+    """
+    Decorates a read-only API view so its 200 responses are cached per crawl generation and url,
+    and answered with 304 Not Modified when the client already has them. Goes under @app.route.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not response_cache.max_bytes:
+            return view(*args, **kwargs)
+        generation = current_generation()
+        key = (generation, request.full_path)
+        entry = response_cache.get(key)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            # Errors aren't cached, a missing owner may be crawled any moment
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            entry = (f"{generation}-{hashlib.sha1(body).hexdigest()[:16]}", body, response.mimetype)
+            response_cache.put(key, entry)
+            cache_status = 'miss'
+        else:
+            cache_status = 'hit'
+        etag, body, mimetype = entry
+        response = current_app.response_class(body, mimetype=mimetype)
+        response.set_etag(etag)
+        # Browsers may keep the response but have to check it's still current, which costs them a 304
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Cache'] = cache_status
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            response_cache.stats['not_modified'] += 1
+        return response
+    return wrapper
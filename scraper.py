@@ -1,24 +1,211 @@
 # Imports
-from requests_html import HTMLSession
 from bs4 import BeautifulSoup, SoupStrainer, element
+import lxml.html
 from requests.exceptions import Timeout
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from requests.adapters import HTTPAdapter
+import requests
+from urllib.parse import urlsplit, urlunsplit, parse_qs, urlencode
+from bisect import bisect_right
+from renderer import RendererPool, QUICKINFO_READY
+from rate_control import AdaptiveLimiter, CircuitBreaker, call_with_backoff
+from metrics import timed
+import os
 import re
+import json
+import threading
+# Selenium is only needed for the browser fallback of find_next_url
+try:
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException, NoSuchElementException
+except ImportError:
+    webdriver = None
 
 # The starting pairid = parid=00102000
 # Current Pages URL
 curr_url = 'https://www.washoecounty.gov/assessor/cama/?parid=00102008'
 
-# HTMLSessiException from extract data : Connection is closedon obj variable used in rendering pages
-session = HTMLSession()
+# Pool of headless pages shared by every fetch_rendered_html() call, launched on first use
+renderer_pool = None
+renderer_pool_lock = threading.Lock()
+# RENDER_MODE=sleep goes back to waiting a fixed 4 seconds on every page instead of waiting for the data
+render_mode = os.environ.get('RENDER_MODE', 'ready')
+
+# HTML_PARSER=soup parses pages with BeautifulSoup instead of the single-pass lxml engine
+html_parser = os.environ.get('HTML_PARSER', 'lxml')
+
+# FETCH_BACKEND=data reads the parcel data payload directly instead of rendering the page
+fetch_backend = os.environ.get('FETCH_BACKEND', 'render')
+# The payload's url isn't documented by the county and there's no default, the data backend is opt-in:
+# ASSESSOR_DATA_URL has to point at a payload url seen in the browser's network tab, ex: '{cama}api/...?parid={parid}'
+data_url_template = os.environ.get('ASSESSOR_DATA_URL')
+if fetch_backend == 'data' and not data_url_template:
+    raise ValueError("FETCH_BACKEND=data needs ASSESSOR_DATA_URL, the url of a parcel's data payload")
+# Pooled keep-alive connections for the data backend, shared by the crawler's worker threads
+http_session = requests.Session()
+http_session.mount('http://', HTTPAdapter(pool_maxsize=32))
+http_session.mount('https://', HTTPAdapter(pool_maxsize=32))
+# Every request to the county site, rendered or not, shares one adaptive concurrency limit and one circuit breaker.
+# The crawler raises max_limit to its number of fetch threads, the limit then grows toward it while the site keeps up.
+site_limiter = AdaptiveLimiter(max_limit=int(os.environ.get('CRAWL_CONCURRENCY', 4)),
+                               latency_target=float(os.environ.get('CRAWL_LATENCY_TARGET', 15)))
+site_breaker = CircuitBreaker(cooldown=float(os.environ.get('CRAWL_BREAKER_COOLDOWN', 30)))
+
+# Parcel URL Functions
+
+def get_parid(url):
+    """
+    Reads the parcel id out of an assessor page url.
+
+    Parameters:
+    - url (str) : URL of an assessor page, ex: https://www.washoecounty.gov/assessor/cama/?parid=00102001
+
+    Return:
+    - parid (str) : The parid query value, ex: '00102001'
+    """
+    return parse_qs(urlsplit(url).query)['parid'][0]
+
+
+def set_parid(url, parid):
+    """
+    Builds a new assessor page url by swapping the parid query value of an existing url.
+
+    Parameters:
+    - url (str) : URL of an assessor page, used for the scheme, host and path.
+    - parid (str) : Parcel id for the new url.
+
+    Return:
+    - URL (str) : The assessor page url for the given parid.
+    """
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    query['parid'] = [parid]
+    return urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+
+
+class ParcelIndex:
+    """
+    Sorted list of every known parid, loaded once and searched with bisect so the parcel after
+    any parid, listed or not, is found without touching the assessor site.
+    """
+
+    def __init__(self, parids):
+        self.parids = sorted(set(parids))
+
+    @classmethod
+    def from_file(cls, path):
+        """Builds an index from a text file with one parid per line."""
+        with open(path) as file:
+            return cls(line.strip() for line in file if line.strip())
+
+    def __len__(self):
+        return len(self.parids)
+
+    def next_parid(self, parid):
+        """Returns the first listed parid after parid, or None past the end of the list."""
+        position = bisect_right(self.parids, parid)
+        if position < len(self.parids):
+            return self.parids[position]
+        return None
+
+
+# Set by load_parcel_index(), next_parid() counts up the parid sequence while this is None
+parcel_index = None
+# NEXT_URL_BROWSER=1 makes scraper() click through the site with Selenium like it used to
+use_browser_for_next_url = os.environ.get('NEXT_URL_BROWSER') == '1'
+
+
+def load_parcel_index(path):
+    """
+    Loads a parcel id list for next_parid() to follow, parcels missing from the list get skipped.
+
+    Parameters:
+    - path (str) : Text file with one parid per line.
+
+    Return:
+    - ParcelIndex (obj) : The loaded index.
+    """
+    global parcel_index
+    parcel_index = ParcelIndex.from_file(path)
+    return parcel_index
+
+
+def next_parid(parid):
+    """
+    Works out the parcel that follows parid, from the parcel index when one is loaded and otherwise by
+    adding one to the parid and keeping its zero padding.
+
+    Parameters:
+    - parid (str) : Parcel id, ex: '00102001'
+
+    Return:
+    - parid (str) : The following parcel id, ex: '00102002', None at the end of a loaded index.
+    """
+    if parcel_index is not None:
+        return parcel_index.next_parid(parid)
+    return str(int(parid) + 1).zfill(len(parid))
+
+
+def parcel_url_sequence(start_url):
+    """
+    Generator that follows next_parid() from start_url.
+
+    Parameters:
+    - start_url (str) : URL of the first assessor page.
+
+    Return:
+    - URLs (generator) : start_url, then the url of every following parid.
+    """
+    parid = get_parid(start_url)
+    while parid is not None:
+        yield set_parid(start_url, parid)
+        parid = next_parid(parid)
+
+
+# Load the parcel list named by the environment once, at import
+if os.environ.get('PARCEL_LIST'):
+    load_parcel_index(os.environ['PARCEL_LIST'])
+
 
 # Parsing Functions
 
+def get_renderer_pool(size=None):
+    """
+    Returns the shared RendererPool, launching it the first time. RENDER_POOL_SIZE, RENDER_MAX_USES and
+    CHROMIUM_PATH configure it.
+
+    Parameters:
+    - size (int) : Number of pages to open if the pool isn't running yet, defaults to RENDER_POOL_SIZE or 2.
+
+    Return:
+    - RendererPool (obj) : The running pool.
+    """
+    global renderer_pool
+    with renderer_pool_lock:
+        if renderer_pool is None:
+            renderer_pool = RendererPool(size=size or int(os.environ.get('RENDER_POOL_SIZE', 2)),
+                                         max_uses=int(os.environ.get('RENDER_MAX_USES', 100)),
+                                         executable_path=os.environ.get('CHROMIUM_PATH'))
+    return renderer_pool
+
+
+def close_renderer_pool():
+    """Closes the shared RendererPool if it was launched, its Chromium processes exit with it. The next render launches a new one."""
+    global renderer_pool
+    with renderer_pool_lock:
+        pool, renderer_pool = renderer_pool, None
+    if pool is None:
+        return
+    print(f"Render times: {pool.timing_summary()}")
+    try:
+        pool.close()
+    except Exception as e:
+        print(f"Exception from close_renderer_pool : {e}")
+
+
 def fetch_rendered_html(url):
     """
     Fetches and renders HTML document for a given url and returns a new HTML document with updated data.
@@ -29,39 +216,29 @@ def fetch_rendered_html(url):
     Return:
     - HTML: The rendered HTML document.
     """
-    # Uses HTMLSession object and sends a GET response to the url
-    response = session.get(url)
-    # Raises an HTTPError for bad response
-    response.raise_for_status()
-    # Uses HTML Session object to render the html in a headless browser, updating the template language into usable values
-    response.html.render(sleep = 4, keep_page = True, scrolldown = 1, timeout = 20)
-    # Returns HTML Document with updated data
-    return response.html.html
+    # Loads the url on an already open headless page, updating the template language into usable values.
+    # Raises an HTTPError for bad response and TimeoutError if the page doesn't load in time.
+    with timed('render'):
+        if render_mode == 'sleep':
+            return get_renderer_pool().render(url, sleep=4, timeout=20)
+        # Reads the page as soon as the owner, situs and sales values are filled in
+        return get_renderer_pool().render(url, timeout=20, wait_for=QUICKINFO_READY, wait_timeout=8)
 
 
-def render_page_with_retry(url, max_retries=20):
+def render_page_with_retry(url, max_retries=5):
     """
-    Retries fetching and rendering HTML document in case of Timeout Exceptions.
+    Retries fetching and rendering HTML document when the site times out, fails with a 5xx or drops the connection,
+    waiting a jittered exponential backoff between attempts. Goes through site_limiter and site_breaker.
 
     Parameters:
     - url (str) : URL of dynamically updated page.
-    - max_retries (int) : The number of times that fetch_rendered_html() should be retried.
+    - max_retries (int) : The number of times that fetch_rendered_html() should be tried.
 
     Return:
     - HTML: The rendered HTML document
     """
-    # retries Var tracks the attempt the function is on.
-    retries = 0
-    # While loop modified by optional parameter max_retries.
-    while retries < max_retries:
-        try:
-            return fetch_rendered_html(url)
-        # Exception looking for Timeout Errors. Prints which attempt we are on and updates retries Var.
-        except TimeoutError:
-            print(f"TimeoutError: Retrying ({retries + 1}/{max_retries})")
-            retries += 1
-    # In the case that the retry limit is reached, this exception will raise and inform of problem.
-    raise TimeoutError('Max retires exceeded')
+    return call_with_backoff(fetch_rendered_html, url, limiter=site_limiter, breaker=site_breaker,
+                             max_attempts=max_retries)
 
 
 def find_owner_info_by_header(header_name, th_iterable):
@@ -94,6 +271,12 @@ def find_owner_info_by_header(header_name, th_iterable):
         return None
 
 
+def clean_up_string(str):
+    """Clean up string by removing unwanted characters."""
+    cleaned_string = re.sub(r'[\xa0\n]', ' ', str)
+    return re.sub(r'\s+', ' ', cleaned_string).strip()
+
+
 def get_owner_data(header_name, th_iterable):
     """
     Retrieves data from a td element.
@@ -106,11 +289,6 @@ def get_owner_data(header_name, th_iterable):
     - Data (str) : Text of td element.
     """
 
-    def clean_up_string(str):
-        """Clean up string by removing unwanted characters."""
-        cleaned_string = re.sub(r'[\xa0\n]', ' ', str)
-        return re.sub(r'\s+', ' ', cleaned_string).strip()
-    
     try:    
         # Case for Searching for Situs 1
         if(header_name.lower() == 'situs 1'):
@@ -178,9 +356,159 @@ def get_sales_data(spans):
             print(f"Exception from get_sales_data : {e}")
 
 
+def parse_quickinfo(html):
+    """
+    Creates Soup object and then extracts data from a rendered page.
+
+    Parameters:
+    - html (str) : Rendered HTML of an assessor page.
+
+    Returns:
+    - Data (dict) : Dictionary of the extracted values.
+    """
+    # Stainer to limit the data parsed by BeautifulSoup obj
+    table_strainer = SoupStrainer('table', class_='quickinfo_subgrp')
+    # Create Soup Object
+    soup = BeautifulSoup(html, 'html.parser', parse_only=table_strainer)
+    # Soup Iterables
+    table_headers = soup('th')
+    spans = soup('span', class_='ng-binding ng-scope', limit=2)
+    # Owner Data
+    property_address = get_owner_data('situs 1', table_headers)
+    owner_name = get_owner_data('owner 1', table_headers)
+    owner_address = get_owner_data('mail address', table_headers)
+    # Sales Data
+    grantor, grantee, sale_value = get_sales_data(spans)
+
+    return {
+        'owner_name' : owner_name,
+        'property_address' : property_address,
+        'owner_address' : owner_address,
+        'grantor' : grantor[0],
+        'grantee' : grantee[0],
+        'price' : sale_value
+    }
+
+
+# lxml Extraction Engine
+# Produces the same dictionary as parse_quickinfo() in a single pass. The helpers below reproduce how
+# BeautifulSoup sees the tree: an element's children are its text, then every child followed by its tail text.
+
+# Tables parse_quickinfo's SoupStrainer keeps
+QUICKINFO_TABLES = "//table[contains(concat(' ', normalize-space(@class), ' '), ' quickinfo_subgrp ')]"
+
+
+def child_nodes(node):
+    """Returns the BeautifulSoup-style children of an lxml element, text nodes as str."""
+    nodes = [node.text] if node.text else []
+    for child in node:
+        # Comments count as text nodes, like BeautifulSoup's Comment strings
+        nodes.append(child if isinstance(child.tag, str) else child.text or '')
+        if child.tail:
+            nodes.append(child.tail)
+    return nodes
+
+
+def node_string(node):
+    """Same as BeautifulSoup's .string: the only text inside node, None if there's more than one child."""
+    if isinstance(node, str):
+        return node
+    nodes = child_nodes(node)
+    if len(nodes) == 1:
+        return node_string(nodes[0])
+    return None
+
+
+def node_strings(node):
+    """Same as BeautifulSoup's .strings: every text node inside node, in order."""
+    if isinstance(node, str):
+        return [node]
+    return list(node.itertext())
+
+
+def parse_quickinfo_lxml(html):
+    """
+    Extracts data from a rendered page with lxml, building a header -> cell map and finding the
+    sales spans in one walk over the quickinfo tables.
+
+    Parameters:
+    - html (str) : Rendered HTML of an assessor page.
+
+    Returns:
+    - Data (dict) : Dictionary of the extracted values, same as parse_quickinfo().
+    """
+    document = lxml.html.fromstring(html)
+    tables = document.xpath(QUICKINFO_TABLES)
+    # A quickinfo table inside another one is already part of the outer table
+    table_set = set(tables)
+    tables = [table for table in tables if not any(ancestor in table_set for ancestor in table.iterancestors('table'))]
+
+    # header name -> the node two siblings after the th, the first th with a name wins
+    cells = {}
+    # Grantor and grantee spans
+    spans = []
+    for table in tables:
+        for node in table.iter('tr', 'span'):
+            if node.tag == 'span':
+                if len(spans) < 2 and ' '.join(node.get('class', '').split()) == 'ng-binding ng-scope':
+                    spans.append(node)
+                continue
+            row = child_nodes(node)
+            for position, header in enumerate(row):
+                if isinstance(header, str) or header.tag != 'th':
+                    continue
+                for content in child_nodes(header):
+                    if isinstance(content, str):
+                        cells.setdefault(content.strip().lower(), row[position + 2] if position + 2 < len(row) else None)
+
+    def cell_element(header_name):
+        cell = cells.get(header_name)
+        # get_owner_data skips cells that are missing or have no children
+        if cell is None or (not isinstance(cell, str) and not child_nodes(cell)):
+            return None
+        return cell
+
+    # Owner Data
+    situs = cell_element('situs 1')
+    property_address = " ".join(clean_up_string(string) for string in node_strings(situs)) if situs is not None else None
+    owner = cell_element('owner 1')
+    owner_name = node_string(owner).strip() if owner is not None and node_string(owner) is not None else None
+    mail = cell_element('mail address')
+    if mail is not None:
+        owner_address = " ".join(clean_up_string(string) for string in node_strings(mail) if clean_up_string(string) != '')
+    else:
+        owner_address = None
+
+    # Sales Data, the value is 12 nodes after the grantee's td, like get_sales_data
+    if len(spans) < 2:
+        raise ValueError('Sales spans not found')
+    grantor = [node_string(content).strip() for content in child_nodes(spans[0]) if node_string(content) and node_string(content).strip()]
+    grantee = [node_string(content).strip() for content in child_nodes(spans[1]) if node_string(content) and node_string(content).strip()]
+    grantee_cell = spans[1].getparent()
+    row = child_nodes(grantee_cell.getparent())
+    value_node = row[[index for index, node in enumerate(row) if node is grantee_cell][0] + 12]
+    sale_value = value_node.strip() if isinstance(value_node, str) else value_node.text_content().strip()
+
+    return {
+        'owner_name' : owner_name,
+        'property_address' : property_address,
+        'owner_address' : owner_address,
+        'grantor' : grantor[0],
+        'grantee' : grantee[0],
+        'price' : sale_value
+    }
+
+
+# name -> function(html) that returns the extract_data() dictionary, HTML_PARSER picks one
+html_parsers = {
+    'lxml' : parse_quickinfo_lxml,
+    'soup' : parse_quickinfo
+}
+
+
 def extract_data(url):
     """
-    Creates Soup object and then extracts data from the page.
+    Renders the page and then extracts data from it.
 
     Parameters:
     - url (str) : URL of page you want data extracted.
@@ -191,35 +519,201 @@ def extract_data(url):
     try:    
         # Starts at first parid
         html = render_page_with_retry(url)
-        # Stainer to limit the data parsed by BeautifulSoup obj
-        table_strainer = SoupStrainer('table', class_='quickinfo_subgrp')
-        # Create Soup Object
-        soup = BeautifulSoup(html, 'html.parser', parse_only=table_strainer)
-        # Soup Iterables
-        table_headers = soup('th')
-        spans = soup('span', class_='ng-binding ng-scope', limit=2)
-        # Owner Data
-        property_address = get_owner_data('situs 1', table_headers)
-        owner_name = get_owner_data('owner 1', table_headers)
-        owner_address = get_owner_data('mail address', table_headers)
-        # Sales Data
-        grantor, grantee, sale_value = get_sales_data(spans)
-    
-        return {
-            'owner_name' : owner_name,
-            'property_address' : property_address,
-            'owner_address' : owner_address,
-            'grantor' : grantor[0],
-            'grantee' : grantee[0],
-            'price' : sale_value
-        }
+        with timed('parse'):
+            return html_parsers[html_parser](html)
     
     except Exception as e:
         print(f"Exception from extract data : {e}")
         return None
 
 
-def find_next_url(curr_url):
+# Fetch Backends
+
+def get_data_url(url):
+    """
+    Builds the url of the parcel data the CAMA page's Angular app loads in the background from ASSESSOR_DATA_URL,
+    {cama} is the page url without its query and {parid} the parcel id. Raises ValueError when it isn't set.
+
+    Parameters:
+    - url (str) : URL of an assessor page.
+
+    Return:
+    - URL (str) : URL of the parcel's data payload.
+    """
+    if not data_url_template:
+        raise ValueError("The data backend is off, ASSESSOR_DATA_URL isn't set")
+    cama = urlunsplit(urlsplit(url)._replace(query='', fragment=''))
+    return data_url_template.format(cama=cama, parid=get_parid(url))
+
+
+def join_lines(lines):
+    """Joins the lines of an address payload into the single cleaned string the page parser produces."""
+    if isinstance(lines, str):
+        lines = [lines]
+    return " ".join(re.sub(r'\s+', ' ', line).strip() for line in lines if line and line.strip())
+
+
+# Fields map_parcel_payload() reads
+PAYLOAD_FIELDS = ('situs', 'owner1', 'mailAddress', 'sales')
+
+
+def map_parcel_payload(payload):
+    """
+    Maps a parcel data payload into the same dictionary parse_quickinfo() returns.
+    The field names are the stand-in's (stand_in.make_parcel_payload), not confirmed against the county's payload:
+    record real payloads with `python stand_in.py --record URL` and ASSESSOR_DATA_URL set and update them from
+    those before crawling with FETCH_BACKEND=data. A payload without them raises KeyError naming the missing fields.
+
+    Parameters:
+    - payload (dict) : {'situs': [str], 'owner1': str, 'mailAddress': [str], 'sales': [{'grantor', 'grantee', 'value'}]}
+
+    Return:
+    - Data (dict) : Dictionary of the extracted values.
+    """
+    missing = [field for field in PAYLOAD_FIELDS if field not in payload]
+    if missing:
+        raise KeyError(f"Parcel payload has no {', '.join(missing)}, its fields are {sorted(payload)}")
+    # Sales are listed newest first, the page reads the first row too
+    sale = payload['sales'][0]
+    return {
+        'owner_name' : payload['owner1'].strip(),
+        'property_address' : join_lines(payload['situs']),
+        'owner_address' : join_lines(payload['mailAddress']),
+        'grantor' : sale['grantor'].strip(),
+        'grantee' : sale['grantee'].strip(),
+        'price' : str(sale['value']).strip()
+    }
+
+
+def fetch_payload(url):
+    """
+    Requests the parcel's data payload over plain HTTP.
+
+    Parameters:
+    - url (str) : URL of the assessor page.
+
+    Returns:
+    - Payload (str) : JSON text of the payload. Raises an HTTPError for bad response.
+    """
+    def request_payload(url):
+        with timed('payload'):
+            response = http_session.get(get_data_url(url), timeout=20)
+            response.raise_for_status()
+            return response.text
+    return call_with_backoff(request_payload, url, limiter=site_limiter, breaker=site_breaker)
+
+
+def extract_data_from_endpoint(url):
+    """
+    Requests the parcel's data payload over plain HTTP, skipping the headless browser entirely.
+
+    Parameters:
+    - url (str) : URL of the assessor page.
+
+    Returns:
+    - Data (dict) : Dictionary of the extracted values, None if the payload couldn't be fetched or read.
+    """
+    try:
+        return map_parcel_payload(json.loads(fetch_payload(url)))
+
+    except Exception as e:
+        print(f"Exception from extract_data_from_endpoint : {e}")
+        return None
+
+
+def fetch_page(url, backend=None):
+    """
+    Fetches a parcel's raw document without parsing it, for crawls that parse in a separate stage.
+    The data backend falls back to rendering the page when the payload can't be fetched.
+
+    Parameters:
+    - url (str) : URL of the assessor page.
+    - backend (str) : 'render' or 'data', defaults to FETCH_BACKEND.
+
+    Returns:
+    - Page (dict) : {'url', 'backend', 'body'}, None if nothing could be fetched.
+    """
+    backend = backend or fetch_backend
+    if backend == 'data':
+        try:
+            return {'url': url, 'backend': 'data', 'body': fetch_payload(url)}
+        except Exception as e:
+            print(f"Exception from fetch_page : {e}")
+    try:
+        return {'url': url, 'backend': 'render', 'body': render_page_with_retry(url)}
+    except Exception as e:
+        print(f"Exception from fetch_page : {e}")
+        return None
+
+
+def parse_page(page):
+    """
+    Extracts the data from a fetch_page() result. Only needs the page itself, so it can run in another process.
+
+    Parameters:
+    - page (dict) : {'url', 'backend', 'body'}
+
+    Returns:
+    - Data (dict) : Dictionary of the extracted values, None if the page couldn't be read.
+    """
+    try:
+        if page['backend'] == 'data':
+            return map_parcel_payload(json.loads(page['body']))
+        return html_parsers[html_parser](page['body'])
+
+    except Exception as e:
+        print(f"Exception from parse_page : {e}")
+        return None
+
+
+def fetch_parcel(url, backend=None):
+    """
+    Extracts a parcel's data with a fetch backend. The rendered page is the fallback when another
+    backend comes back empty or incomplete.
+
+    Parameters:
+    - url (str) : URL of the assessor page.
+    - backend (str) : Name in fetch_backends, defaults to FETCH_BACKEND or 'render'.
+
+    Returns:
+    - Data (dict) : Dictionary of the extracted values, None if every backend failed.
+    """
+    backend = backend or fetch_backend
+    data = fetch_backends[backend](url)
+    if backend != 'render' and (data is None or None in data.values()):
+        data = extract_data(url)
+    return data
+
+
+# name -> function(url) that returns the extract_data() dictionary
+fetch_backends = {
+    'render' : extract_data,
+    'data' : extract_data_from_endpoint
+}
+
+
+def find_next_url(curr_url, use_browser=False):
+    """
+    Finds the url of the parcel after curr_url. The next parid is worked out with next_parid(),
+    the assessor site is only opened when use_browser is True.
+
+    Parameters:
+    - curr_url (str): The current URL.
+    - use_browser (bool): Click through the site with find_next_url_with_browser() instead.
+
+    Returns:
+    - str: The URL of the next parcel, None if there isn't one.
+    """
+    with timed('next_url'):
+        if use_browser:
+            return find_next_url_with_browser(curr_url)
+        parid = next_parid(get_parid(curr_url))
+        if parid is None:
+            return None
+        return set_parid(curr_url, parid)
+
+
+def find_next_url_with_browser(curr_url):
     """
     This function uses a Selenium WebDriver to open a headless Chromium browser,
     locates and clicks the next page button, and returns the new current_url.
@@ -230,6 +724,9 @@ def find_next_url(curr_url):
     Returns:
     - str: The new URL after clicking the next page button.
     """
+    if webdriver is None:
+        raise ImportError('selenium is required to find the next url with a browser')
+    driver = None
     try: 
         # Creating options object to pass into driver
         options = Options()
@@ -259,14 +756,15 @@ def find_next_url(curr_url):
          new_url = None
     
     finally:
-        driver.quit()
+        if driver:
+            driver.quit()
     
     return new_url
 
 
 def scraper (curr_url):
     """
-    A Web-Scraper for the Whashoe Assessor Site. Uses BeautifulSoup, Selenium, Request-HTML in order to create a dictionary.
+    A Web-Scraper for the Whashoe Assessor Site. Uses BeautifulSoup, Request-HTML and optionally Selenium in order to create a dictionary.
 
     Parameters:
     - curr_url (str) : The current url that needs to have data extracted.
@@ -275,10 +773,10 @@ def scraper (curr_url):
     - results (dict) : {'owner_name': str, 'property_address': str, 'owner_address': str, 'grantor': str, 'grantee': str, 'price': str, 'next_url': str}
     """
     try:
-        # First: Use BeautifulSoup and Request-HTML helper functions to extract property and owner data, save to result Var.
-        result = extract_data(curr_url)
+        # First: Use the fetch backend to extract property and owner data, save to result Var.
+        result = fetch_parcel(curr_url)
         # add next_url key-val pair to the result dictionary.
-        result['next_url'] = find_next_url(curr_url)
+        result['next_url'] = find_next_url(curr_url, use_browser=use_browser_for_next_url)
         # finally return the dictionary.
         return result
     
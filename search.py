@@ -0,0 +1,252 @@
+# Imports
+from sqlalchemy import text, func, or_, case
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from modules import Owner, Company, OwnerCompany, Property, db
+
+# Indexed search for /api/search. LIKE '%q%' can't use a btree index, so every keystroke was a scan of the
+# owner, property and company tables. Postgres gets trigram GIN indexes (pg_trgm), which answer substring
+# and fuzzy matches, ranked by how close the match is. SQLite gets an FTS5 table with the trigram tokenizer
+# per searched column, kept in sync with the tables by triggers.
+
+# Results per type when the request doesn't say, and the most it may ask for
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+# Most matches read per relevance tier (match_ids), the best of them are returned
+SEARCH_CANDIDATES = 1000
+
+# Queries shorter than a trigram can't use the indexes, they only match the start of a name
+MIN_TRIGRAM_QUERY = 3
+
+# Searched column of each result type
+SEARCH_COLUMNS = {'owners': (Owner, 'full_name'), 'properties': (Property, 'address'), 'companies': (Company, 'llc_name')}
+
+
+def escape_like(q):
+    """Escapes LIKE wildcards so a query matches them literally."""
+    return q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def escape_glob(q):
+    """Escapes GLOB wildcards so a query matches them literally."""
+    return ''.join(f"[{c}]" if c in '*?[' else c for c in q)
+
+
+def ensure_search_index():
+    """
+    Creates the search indexes of the database if they're missing, ex: on a database crawled before they existed.
+    Cheap when they already exist, the app calls it on startup.
+    """
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'postgresql':
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for model, column in SEARCH_COLUMNS.values():
+                table = model.__tablename__
+                db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm "
+                                        f"ON {table} USING gin ({column} gin_trgm_ops)"))
+        elif dialect == 'sqlite':
+            for model, column in SEARCH_COLUMNS.values():
+                create_fts_index(model.__tablename__, column)
+        db.session.commit()
+    except Exception as e:
+        # Without the indexes search() still works, by scanning
+        db.session.rollback()
+        print(f"Exception from ensure_search_index : {e}")
+
+
+def create_fts_index(table, column):
+    """
+    Creates the SQLite FTS5 trigram table of one column and the triggers that keep it in sync, then fills it,
+    and a btree index on the column for queries too short for trigrams.
+    Dropping the table drops its triggers but not the FTS table, so it's rebuilt whenever the triggers are missing.
+
+    Parameters:
+    - table (str) : Table name, ex: 'owner'
+    - column (str) : Searched column, ex: 'full_name'
+    """
+    fts = f"{table}_search"
+    # Short queries are prefix matches on a btree index, unique columns already have one
+    indexed = {db.session.execute(text(f"SELECT name FROM pragma_index_info(:index)"), {'index': index}).scalar()
+               for index, in db.session.execute(text("SELECT name FROM pragma_index_list(:table)"), {'table': table})}
+    if column not in indexed:
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})"))
+    triggers = db.session.execute(text("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE :name"),
+                                  {'name': f"{fts}_a_"}).scalar()
+    if triggers == 3:
+        return
+    db.session.execute(text(f"DROP TABLE IF EXISTS {fts}"))
+    db.session.execute(text(f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', content_rowid='id', "
+                            f"tokenize='trigram')"))
+    insert = f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});"
+    delete = f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});"
+    for name, event, body in (('ai', 'INSERT', insert), ('ad', 'DELETE', delete),
+                              ('au', f'UPDATE OF {column}', delete + ' ' + insert)):
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{name}"))
+        db.session.execute(text(f"CREATE TRIGGER {fts}_{name} AFTER {event} ON {table} BEGIN {body} END"))
+    # Indexes the rows that were there before the triggers
+    db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def relevance(q, value):
+    """Sort key of a match: names starting with the query first, then a word starting with it, then shorter names."""
+    value = value.upper()
+    q = q.upper()
+    if value.startswith(q):
+        place = 0
+    elif f" {q}" in value:
+        place = 1
+    else:
+        place = 2
+    return (place, len(value))
+
+
+def tier_matches(model, column, q, tier):
+    """
+    Rows whose column matches a query in one relevance tier, at most SEARCH_CANDIDATES of them.
+
+    Parameters:
+    - model (Flask-SQLAlchemy Model Obj) : Searched model.
+    - column (str) : Searched column.
+    - q (str) : Query.
+    - tier (str) : 'start' of the name, start of a 'word' in it, or 'anywhere' in it.
+
+    Return:
+    - matches (list) : (id, value) rows.
+    """
+    field = getattr(model, column)
+    dialect = db.engine.dialect.name
+    pattern = escape_like(q)
+    if tier == 'start':
+        if dialect == 'sqlite':
+            # GLOB is case sensitive so it can use the column's btree index, the assessor publishes names in upper case
+            condition = field.op('GLOB')(escape_glob(q.upper()) + '*')
+        else:
+            condition = field.ilike(f"{pattern}%", escape='\\')
+    elif tier == 'word':
+        condition = field.ilike(f"% {pattern}%", escape='\\')
+    else:
+        condition = field.ilike(f"%{pattern}%", escape='\\')
+        if dialect == 'postgresql':
+            # %> also matches names with a word close to the query, ex: typos, on the same trigram index
+            condition = or_(condition, field.op('%>')(q))
+
+    if dialect == 'sqlite' and tier == 'start':
+        table = model.__tablename__
+        return db.session.execute(text(f"SELECT id, {column} FROM {table} WHERE {column} GLOB :prefix LIMIT :limit"),
+                                  {'prefix': escape_glob(q.upper()) + '*', 'limit': SEARCH_CANDIDATES}).all()
+    if dialect == 'sqlite':
+        fts = f"{model.__tablename__}_search"
+        # The trigrams take in spaces too, so a leading space only matches at the start of a word
+        phrase = f" {q}" if tier == 'word' else q
+        try:
+            # A quoted phrase is a case insensitive substring match with the trigram tokenizer
+            return db.session.execute(text(f"SELECT rowid, {column} FROM {fts} WHERE {fts} MATCH :phrase LIMIT :limit"),
+                                      {'phrase': '"' + phrase.replace('"', '""') + '"', 'limit': SEARCH_CANDIDATES}).all()
+        except OperationalError:
+            # No FTS5 in this SQLite build, or no index yet
+            db.session.rollback()
+    return db.session.query(model.id, field).filter(condition).limit(SEARCH_CANDIDATES).all()
+
+
+def match_ids(model, column, q, limit):
+    """
+    Ids of the rows whose column matches a query, best match first: names starting with the query, then names
+    with a word starting with it, then the rest. At most SEARCH_CANDIDATES matches are read, so a query common
+    to most rows, ex: 'RENO NV', costs no more than a rare one. When there are more than that, the names starting
+    with the query and those with a word starting with it are read on their own too, so the best matches are
+    always among the ranked ones.
+
+    Parameters:
+    - model (Flask-SQLAlchemy Model Obj) : Searched model.
+    - column (str) : Searched column.
+    - q (str) : Query.
+    - limit (int) : Most ids returned.
+
+    Return:
+    - ids (list) : Matching ids in rank order.
+    """
+    field = getattr(model, column)
+    dialect = db.engine.dialect.name
+    if len(q) < MIN_TRIGRAM_QUERY:
+        if dialect == 'sqlite':
+            # GLOB is case sensitive so it can use the column's btree index, the assessor publishes names in upper case
+            query = db.session.query(model.id).filter(field.op('GLOB')(escape_glob(q.upper()) + '*')).order_by(field)
+        else:
+            # The trigram index also answers prefixes, from the padded trigrams at the start of each name
+            query = db.session.query(model.id).filter(field.ilike(f"{escape_like(q)}%", escape='\\')).order_by(model.id)
+        return [id for id, in query.limit(limit)]
+
+    matches = dict(tier_matches(model, column, q, 'anywhere'))
+    if len(matches) == SEARCH_CANDIDATES:
+        # There are more matches than were read, the best ones may not be among them
+        for tier in ('start', 'word'):
+            tier_rows = tier_matches(model, column, q, tier)
+            matches.update(tier_rows)
+            # Every match of the next tier ranks below these
+            if len(tier_rows) >= MAX_SEARCH_LIMIT:
+                break
+
+    if dialect == 'postgresql' and matches:
+        pattern = escape_like(q)
+        place = case((field.ilike(f"{pattern}%", escape='\\'), 0), (field.ilike(f"% {pattern}%", escape='\\'), 1),
+                     (field.ilike(f"%{pattern}%", escape='\\'), 2), else_=3)
+        query = (db.session.query(model.id).filter(model.id.in_(list(matches)))
+                 .order_by(place, func.word_similarity(q, field).desc(), func.length(field), model.id))
+        return [id for id, in query.limit(limit)]
+    ranked = sorted(matches.items(), key=lambda match: relevance(q, match[1]) + (match[0],))
+    return [id for id, value in ranked[:limit]]
+
+
+class UnlinkedCompany:
+    """Search result of an LLC without an owner_company row, serializes like OwnerCompany with no owner."""
+
+    def __init__(self, company):
+        self.company = company
+
+    def serialize(self):
+        return {
+            "id" : None,
+            "owner_id" : None,
+            "owner_name" : None,
+            "company_id" : self.company.id,
+            "llc_name" : self.company.llc_name
+        }
+
+
+def in_order(rows, ids, key=lambda row: row.id):
+    """Sorts rows loaded with an IN (ids) query back into the order of ids."""
+    rank = {id: index for index, id in enumerate(ids)}
+    return sorted(rows, key=lambda row: rank[key(row)])
+
+
+def search(q, limit=SEARCH_LIMIT):
+    """
+    Searches owner names, property addresses and LLC names.
+
+    Parameters:
+    - q (str) : Query, matched case insensitively anywhere in the name.
+    - limit (int) : Most results of each type.
+
+    Return:
+    - results (dict) : {'owners': [Owner], 'properties': [Property], 'companies': [OwnerCompany or UnlinkedCompany]}
+                       best match first.
+    """
+    q = q.strip()
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    if not q:
+        return {'owners': [], 'properties': [], 'companies': []}
+    results = {}
+    for key, (model, column) in SEARCH_COLUMNS.items():
+        ids = match_ids(model, column, q, limit)
+        if key == 'companies':
+            # An LLC is listed once per owner it has, like the company listing, and once with no owner when it has none
+            rows = (db.session.query(Company, OwnerCompany)
+                    .outerjoin(OwnerCompany, OwnerCompany.company_id == Company.id)
+                    .options(joinedload(OwnerCompany.owner)).filter(Company.id.in_(ids)).all()) if ids else []
+            rows = [link if link is not None else UnlinkedCompany(company) for company, link in rows]
+            results[key] = in_order(rows, ids, key=lambda row: row.company.id)[:limit]
+        else:
+            results[key] = in_order(model.query.filter(model.id.in_(ids)).all(), ids) if ids else []
+    return results
@@ -0,0 +1,216 @@
+# Imports
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from itertools import islice, takewhile
+from sqlalchemy import update, or_
+from modules import CrawlShard, db
+from scraper import parcel_url_sequence, get_parid, set_parid, next_parid
+
+# Splits the parid sequence into shards that crawler processes claim through leases in the database, so
+# any number of workers on any number of machines can crawl at once. A worker renews its lease with a
+# heartbeat that also saves how far it got, a shard whose worker stops heartbeating goes back up for grabs
+# and the next worker resumes it from the last saved parid. Lease times come from each worker's clock,
+# so the machines need their clocks in sync. A LeaseTimer renews the lease from a thread of its own, so a
+# worker that's waiting on the site (backoff, an open circuit breaker) doesn't lose its shard.
+
+
+class LeaseLost(Exception):
+    """Raised when a worker heartbeats a shard whose lease has expired and been claimed by another worker."""
+
+
+def default_worker_name():
+    """Returns host:pid, unique for every crawler process."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def plan_shards(start_url, count, shard_size=1000):
+    """
+    Adds shards covering the next count parids from start_url. Shards that already exist are left as they are,
+    so planning the same range twice is harmless. Raises ValueError when a new shard would overlap a planned
+    one without matching it, ex: the same range planned again with another shard_size, since both would be crawled.
+
+    Parameters:
+    - start_url (str) : URL of the first assessor page.
+    - count (int) : Number of parids to cover, following scraper.next_parid().
+    - shard_size (int) : Parids per shard.
+
+    Return:
+    - shards (int) : Number of shards added.
+    """
+    parids = [get_parid(url) for url in islice(parcel_url_sequence(start_url), count)]
+    starts = parids[::shard_size]
+    ends = starts[1:] + [next_parid(parids[-1]) if parids else None]
+    planned = [(shard.start_parid, shard.end_parid) for shard in CrawlShard.query]
+    added = 0
+    for start, end in zip(starts, ends):
+        if (start, end) in planned:
+            continue
+        # Parids are zero padded to the same width, so comparing them as strings keeps parid order, no end is open ended
+        overlap = next(((other_start, other_end) for other_start, other_end in planned
+                        if (end is None or other_start < end) and (other_end is None or start < other_end)), None)
+        if overlap is not None:
+            db.session.rollback()
+            raise ValueError(f"Shard {start} to {end} overlaps the planned shard {overlap[0]} to {overlap[1]}")
+        db.session.add(CrawlShard(start_url=start_url, start_parid=start, end_parid=end, next_parid=start))
+        added += 1
+    db.session.commit()
+    return added
+
+
+def claim_shard(worker, lease_seconds=300):
+    """
+    Leases the first unfinished shard nobody holds a live lease on.
+
+    Parameters:
+    - worker (str) : Name of the claiming worker, ex: default_worker_name().
+    - lease_seconds (int) : How long the lease lasts without a heartbeat.
+
+    Return:
+    - CrawlShard (obj) : The claimed shard, None when every shard is done or leased.
+    """
+    while True:
+        now = datetime.utcnow()
+        claimable = (CrawlShard.done.is_(False),
+                     or_(CrawlShard.lease_expires.is_(None), CrawlShard.lease_expires < now))
+        query = CrawlShard.query.filter(*claimable).order_by(CrawlShard.id)
+        if db.engine.dialect.name == 'postgresql':
+            # Workers claiming at the same moment skip past each other's rows instead of queueing on them
+            query = query.with_for_update(skip_locked=True)
+        shard = query.first()
+        if shard is None:
+            db.session.commit()
+            return None
+        # The update only goes through if the shard is still claimable, so two workers can't both win it
+        result = db.session.execute(update(CrawlShard)
+                                    .where(CrawlShard.id == shard.id, *claimable)
+                                    .values(worker=worker, lease_expires=now + timedelta(seconds=lease_seconds),
+                                            heartbeat_at=now))
+        db.session.commit()
+        if result.rowcount == 1:
+            db.session.refresh(shard)
+            return shard
+
+
+def heartbeat(shard, worker, next_parid=None, pages=0, lease_seconds=300, done=False):
+    """
+    Renews a lease and saves the shard's progress. Only call it once every page before next_parid is committed.
+
+    Parameters:
+    - shard (CrawlShard) : Shard the worker holds.
+    - worker (str) : Name of the worker holding the lease.
+    - next_parid (str) : First parid not written yet, None keeps the saved one.
+    - pages (int) : Pages written since the last heartbeat.
+    - lease_seconds (int) : How long the renewed lease lasts.
+    - done (bool) : Marks the shard finished and gives up the lease.
+
+    Raises:
+    - LeaseLost : The lease expired and another worker claimed the shard.
+    """
+    now = datetime.utcnow()
+    values = {'heartbeat_at': now, 'pages': CrawlShard.pages + pages,
+              'lease_expires': None if done else now + timedelta(seconds=lease_seconds)}
+    if next_parid is not None:
+        values['next_parid'] = next_parid
+    if done:
+        values['done'] = True
+        values['worker'] = None
+    renew_lease(shard.id, worker, values)
+
+
+def renew_lease(shard_id, worker, values):
+    """Writes values to a shard if worker still holds it and commits, raises LeaseLost if it doesn't."""
+    result = db.session.execute(update(CrawlShard)
+                                .where(CrawlShard.id == shard_id, CrawlShard.worker == worker)
+                                .values(**values))
+    db.session.commit()
+    if result.rowcount != 1:
+        raise LeaseLost(f"Shard {shard_id} is no longer leased to {worker}")
+
+
+class LeaseTimer:
+    """
+    Renews a shard's lease every third of lease_seconds from a background thread, whatever the crawl is doing.
+    Only heartbeat() saves progress, the timer just keeps the lease alive. `lost` turns True once another
+    worker has claimed the shard.
+    """
+
+    def __init__(self, shard, worker, lease_seconds, app):
+        # The shard row belongs to the crawl's session, the thread only keeps its id
+        self.shard_id = shard.id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.app = app
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops renewing, returns once the thread is done with the database."""
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        # Its own app context, so its own session
+        with self.app.app_context():
+            while not self._stopped.wait(self.lease_seconds / 3):
+                now = datetime.utcnow()
+                try:
+                    renew_lease(self.shard_id, self.worker, {
+                        'heartbeat_at': now, 'lease_expires': now + timedelta(seconds=self.lease_seconds)})
+                except LeaseLost as e:
+                    print(f"Exception from LeaseTimer : {e}")
+                    self.lost = True
+                    return
+                except Exception as e:
+                    # A failed renewal is retried on the next tick, the lease has two more left before it runs out
+                    db.session.rollback()
+                    print(f"Exception from LeaseTimer : {e}")
+
+
+def release_shard(shard, worker):
+    """Gives up a lease early without finishing the shard, ex: on shutdown, so another worker can pick it up right away."""
+    db.session.execute(update(CrawlShard)
+                       .where(CrawlShard.id == shard.id, CrawlShard.worker == worker)
+                       .values(worker=None, lease_expires=None))
+    db.session.commit()
+
+
+def shard_pages(shard):
+    """
+    (url, next_url) pairs of the parids a shard still has to crawl, the last next_url is the next shard's first page.
+
+    Parameters:
+    - shard (CrawlShard) : Claimed shard.
+
+    Return:
+    - pages (generator) : (url, next_url) pairs from shard.next_parid up to shard.end_parid.
+    """
+    urls = parcel_url_sequence(set_parid(shard.start_url, shard.next_parid))
+    following = parcel_url_sequence(set_parid(shard.start_url, shard.next_parid))
+    next(following, None)
+    pages = zip(urls, following)
+    if shard.end_parid is None:
+        return pages
+    # Parids are zero padded to the same width, so comparing them as strings keeps parid order
+    return takewhile(lambda page: get_parid(page[0]) < shard.end_parid, pages)
+
+
+def shard_progress():
+    """
+    Summarizes every shard for monitoring.
+
+    Return:
+    - progress (dict) : {'shards', 'done', 'leased', 'pages'}
+    """
+    now = datetime.utcnow()
+    shards = CrawlShard.query.all()
+    return {'shards': len(shards),
+            'done': sum(1 for shard in shards if shard.done),
+            'leased': sum(1 for shard in shards if not shard.done and shard.lease_expires and shard.lease_expires >= now),
+            'pages': sum(shard.pages for shard in shards)}
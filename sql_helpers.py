@@ -0,0 +1,30 @@
+# Imports
+from sqlalchemy.dialects import postgresql, sqlite
+from modules import db
+
+# Statement helpers shared by the modules that write in bulk (batch_writer, recrawl, rankings), and schema upkeep.
+
+# Rows per INSERT statement, keeps the bound parameters under the database's limit
+STATEMENT_ROWS = 500
+
+
+def upsert(model):
+    """Returns an INSERT for model that supports on_conflict_do_nothing / on_conflict_do_update on this database."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upserts aren't supported on {dialect}")
+
+
+def chunks(rows, size=STATEMENT_ROWS):
+    """Splits rows into lists of at most size rows."""
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+
+def create_missing_indexes():
+    """Creates the models' indexes that an existing database doesn't have yet, db.create_all() only adds missing tables."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
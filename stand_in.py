@@ -0,0 +1,329 @@
+# Imports
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# A local stand-in for the Washoe Assessor CAMA site. It serves pages shaped like the rendered
+# quickinfo tables that scraper.extract_data() reads, so the crawler can be run without touching washoecounty.gov.
+# Usage: python stand_in.py --port 8000, then crawl http://127.0.0.1:8000/assessor/cama/?parid=00102001
+
+# Path the stand-in answers on, mirrors the real site
+CAMA_PATH = '/assessor/cama/'
+# Path of the parcel data payload, made up for the stand-in, the county's isn't known
+DATA_PATH = CAMA_PATH + 'api/quickinfo'
+# ASSESSOR_DATA_URL of the stand-in's payloads, for crawls and benchmarks against it
+DATA_URL_TEMPLATE = '{cama}api/quickinfo?parid={parid}'
+
+# Synthetic Data Pools
+FIRST_NAMES = ['JOHN', 'MARIA', 'DAVID', 'LINDA', 'JAMES', 'SUSAN', 'ROBERT', 'KAREN', 'MICHAEL', 'NANCY']
+LAST_NAMES = ['SMITH', 'GARCIA', 'JOHNSON', 'LOPEZ', 'BROWN', 'MILLER', 'DAVIS', 'WILSON', 'MOORE', 'TAYLOR']
+STREETS = ['MAIN ST', 'VIRGINIA ST', 'PLUMB LN', 'KIETZKE LN', 'MOANA LN', 'MCCARRAN BLVD', 'SKY VALLEY DR', 'WELLS AVE']
+CITIES = ['RENO NV 89501', 'RENO NV 89502', 'SPARKS NV 89431', 'RENO NV 89509', 'SPARKS NV 89436']
+# A handful of repeat landlords so the owner/company tables see the same rows many times
+LANDLORDS = [('TRUCKEE HOLDINGS LLC', 'SMITH, JOHN'), ('SIERRA RENTALS LLC', 'GARCIA, MARIA'),
+             ('BIGGEST LITTLE HOMES LLC', 'BROWN, DAVID'), ('WASHOE PROPERTY GROUP LLC', 'MOORE, LINDA')]
+
+
+def _pick(digest, offset, pool):
+    """Deterministically picks an item from pool using a byte of the digest."""
+    return pool[digest[offset] % len(pool)]
+
+
+def _step_parid(parid, step):
+    """Returns the parid step places away from parid, keeping its zero padding."""
+    return str(int(parid) + step).zfill(len(parid))
+
+
+def _split_address(address):
+    """Splits '123 MAIN ST RENO NV 89501' into its street line and its city/state/zip line."""
+    words = address.rsplit(' ', 3)
+    return words[0], ' '.join(words[1:])
+
+
+def make_parcel_record(parid):
+    """
+    Creates a deterministic fake parcel record for a parid, the same parid always gives the same record.
+
+    Parameters:
+    - parid (str) : Parcel id, ex: '00102001'
+
+    Return:
+    - Record (dict) : {'parid', 'property_address', 'owner_name', 'owner_address', 'grantor', 'grantee', 'price'}
+    """
+    digest = hashlib.sha256(parid.encode()).digest()
+    property_address = f"{int(parid[-4:]) + 100} {_pick(digest, 0, STREETS)} {_pick(digest, 1, CITIES)}"
+    # Roughly 1 in 4 parcels belong to a repeat landlord
+    if digest[2] % 4 == 0:
+        llc_name, person = _pick(digest, 3, LANDLORDS)
+        owner_address = f"{1000 + LANDLORDS.index((llc_name, person))} CORPORATE BLVD RENO NV 89502"
+        # LLC transfers from the landlord themself are recorded with a price of 0
+        return {'parid': parid, 'property_address': property_address, 'owner_name': llc_name,
+                'owner_address': owner_address, 'grantor': person, 'grantee': llc_name, 'price': '0'}
+
+    owner_name = f"{_pick(digest, 4, LAST_NAMES)}, {_pick(digest, 5, FIRST_NAMES)}"
+    # Most people get their mail at the property, some at a separate address
+    owner_address = property_address if digest[6] % 3 else f"PO BOX {digest[7] * 10} {_pick(digest, 8, CITIES)}"
+    grantor = f"{_pick(digest, 9, LAST_NAMES)}, {_pick(digest, 10, FIRST_NAMES)}"
+    price = str((digest[11] * 256 + digest[12]) * 10)
+    return {'parid': parid, 'property_address': property_address, 'owner_name': owner_name,
+            'owner_address': owner_address, 'grantor': grantor, 'grantee': owner_name, 'price': price}
+
+
+def render_parcel_page(record):
+    """
+    Renders a parcel record as the HTML the assessor page has once its Angular bindings are filled in.
+    The whitespace between cells matters, scraper.py walks next_sibling to reach the values.
+
+    Parameters:
+    - record (dict) : Output of make_parcel_record()
+
+    Return:
+    - HTML (str) : Page markup.
+    """
+    # The 20th w3-bar-item holds the prev/next arrows scraper.find_next_url_with_browser() clicks
+    nav = '\n'.join(f'<div class="w3-bar-item">Tab {tab}</div>' for tab in range(1, 20))
+    nav += (f'\n<div class="w3-bar-item">'
+            f'<i class="fa fa-arrow-left" onclick="location.href=\'?parid={_step_parid(record["parid"], -1)}\'">&lt;</i> '
+            f'<i class="fa fa-arrow-right" onclick="location.href=\'?parid={_step_parid(record["parid"], 1)}\'">&gt;</i></div>')
+    street, city = _split_address(record['property_address'])
+    mail_street, mail_city = _split_address(record['owner_address'])
+    return f"""<!DOCTYPE html>
+<html>
+<head><title>Washoe County Assessor - {record['parid']}</title></head>
+<body>
+<div class="w3-bar">
+{nav}
+</div>
+<div>
+<table class="quickinfo_subgrp">
+<tr>
+<th>Situs 1</th>
+<td><span>{street}</span><span>{city}</span></td>
+</tr>
+<tr>
+<th>Owner 1</th>
+<td>{record['owner_name']}</td>
+</tr>
+<tr>
+<th>Mail Address</th>
+<td>{mail_street}<br>
+{mail_city}</td>
+</tr>
+</table>
+<table class="quickinfo_subgrp">
+<tr>
+<th>Grantor</th>
+<th>Grantee</th>
+<th>Doc #</th>
+<th>Doc Type</th>
+<th>Doc Date</th>
+<th>Vesting</th>
+<th>DOR Code</th>
+<th>Value</th>
+</tr>
+<tr>
+<td><span class="ng-binding ng-scope">{record['grantor']}</span></td>
+<td><span class="ng-binding ng-scope">{record['grantee']}</span></td>
+<td>{record['parid']}01</td>
+<td>DEED</td>
+<td>01/02/2020</td>
+<td>AS</td>
+<td>200</td>
+<td>{record['price']}</td>
+</tr>
+</table>
+</div>
+</body>
+</html>
+"""
+
+
+def make_parcel_payload(record):
+    """
+    Builds the parcel data payload the page's Angular app would load for a record.
+
+    Parameters:
+    - record (dict) : Output of make_parcel_record()
+
+    Return:
+    - Payload (dict) : {'parid', 'situs', 'owner1', 'mailAddress', 'sales'}
+    """
+    return {
+        'parid': record['parid'],
+        'situs': list(_split_address(record['property_address'])),
+        'owner1': record['owner_name'],
+        'mailAddress': list(_split_address(record['owner_address'])),
+        'sales': [{'grantor': record['grantor'], 'grantee': record['grantee'], 'docType': 'DEED',
+                   'docDate': '01/02/2020', 'value': record['price']}]
+    }
+
+
+def load_fixture(directory, parid, extension):
+    """Returns the text of directory/<parid>.<extension>, None if there's no such recorded fixture."""
+    if not directory:
+        return None
+    path = os.path.join(directory, f"{parid}.{extension}")
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return file.read()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Request handler serving synthetic parcel pages, configured through the attributes of its server."""
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        parid = parse_qs(parts.query).get('parid', [None])[0]
+        # Pretend to be a slow county server
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if parid is None or parts.path not in (CAMA_PATH, DATA_PATH):
+            self.send_error(404)
+            return
+
+        # Pretend to be a struggling county server
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+            failing = self.server.error_rate and self.server.random.random() < self.server.error_rate
+            if failing:
+                self.server.stats['errors'] += 1
+        if failing:
+            self.send_error(self.server.error_status)
+            return
+
+        # Recorded fixtures win over the synthetic pages
+        if parts.path == DATA_PATH:
+            content_type = 'application/json'
+            body = self.server.recorded(parid, 'json')
+            if body is None:
+                if self.server.fixtures:
+                    # A recorded page without a recorded payload, a made up payload would only agree with itself
+                    self.send_error(404)
+                    return
+                body = json.dumps(make_parcel_payload(make_parcel_record(parid)))
+        else:
+            content_type = 'text/html; charset=utf-8'
+            body = self.server.recorded(parid, 'html') or render_parcel_page(make_parcel_record(parid))
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keeps crawl output readable, the stand-in answers hundreds of requests a second
+        pass
+
+
+def fixture_loader(fixtures):
+    """
+    Returns recorded(parid, extension) -> text or None for a fixtures directory, either <parid>.html / <parid>.json
+    files from --record or a PageArchive written by crawler.py --archive.
+    """
+    if fixtures and os.path.exists(os.path.join(fixtures, 'index.tsv')):
+        # Only archives need the scraper's modules
+        from page_archive import PageArchive
+        archive = PageArchive(fixtures)
+        backends = {'html': 'render', 'json': 'data'}
+
+        def recorded(parid, extension):
+            page = archive.get(parid)
+            if page is None or page['backend'] != backends[extension]:
+                return None
+            return page['body']
+        return recorded
+    return lambda parid, extension: load_fixture(fixtures, parid, extension)
+
+
+def start_stand_in(host='127.0.0.1', port=0, latency=0.0, fixtures=None, error_rate=0.0, error_status=503, seed=0):
+    """
+    Starts the stand-in assessor site on a background thread.
+
+    Parameters:
+    - host (str) : Interface to bind.
+    - port (int) : Port to bind, 0 picks a free port.
+    - latency (float) : Seconds every response is delayed by.
+    - fixtures (str) : Directory of recorded <parid>.html pages and <parid>.json payloads, or a page archive,
+                       to serve instead of synthetic ones.
+    - error_rate (float) : Share of parcel requests answered with error_status instead of the page.
+    - error_status (int) : Status of the injected errors.
+    - seed (int) : Seed of the error injection, the same seed fails the same share of requests.
+
+    Return:
+    - server (ThreadingHTTPServer) : Running server, server.base_url is the cama url without a parid,
+                                     server.stats counts requests and injected errors and server.shutdown() stops it.
+    """
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fixtures = fixtures
+    server.recorded = fixture_loader(fixtures)
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'errors': 0}
+    server.base_url = f"http://{host}:{server.server_address[1]}{CAMA_PATH}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def record_fixtures(start_url, count, directory):
+    """
+    Saves the rendered page and the data payload of count parcels from the real site, so the stand-in can serve them later.
+    Payloads are only recorded when ASSESSOR_DATA_URL is set, the data backend is off without it.
+
+    Parameters:
+    - start_url (str) : URL of the first assessor page to record.
+    - count (int) : Number of parcels to record, following scraper.next_parid().
+    - directory (str) : Where <parid>.html and <parid>.json are written.
+    """
+    # Only recording needs the scraper and its browser
+    from itertools import islice
+    import scraper
+    from scraper import parcel_url_sequence, get_parid, render_page_with_retry, get_data_url, http_session
+
+    os.makedirs(directory, exist_ok=True)
+    for url in islice(parcel_url_sequence(start_url), count):
+        parid = get_parid(url)
+        with open(os.path.join(directory, f"{parid}.html"), 'w') as file:
+            file.write(render_page_with_retry(url))
+        if scraper.data_url_template:
+            response = http_session.get(get_data_url(url), timeout=20)
+            if response.ok:
+                with open(os.path.join(directory, f"{parid}.json"), 'w') as file:
+                    file.write(response.text)
+            else:
+                print(f"No payload for {parid}: {response.status_code}")
+        print(f"Recorded {parid}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Local stand-in for the Washoe Assessor site.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every response is delayed by.')
+    parser.add_argument('--fixtures', default=None, help='Directory of recorded pages or a page archive to serve.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of parcel requests answered with a 503.')
+    parser.add_argument('--record', default=None, metavar='URL',
+                        help='Record parcels from the real site into --fixtures, starting at URL, instead of serving.')
+    parser.add_argument('--count', type=int, default=20, help='Number of parcels to record.')
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.record, args.count, args.fixtures or 'fixtures')
+    else:
+        server = start_stand_in(port=args.port, latency=args.latency, fixtures=args.fixtures, error_rate=args.error_rate)
+        print(f"Stand-in assessor site at {server.base_url}?parid=00102001")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
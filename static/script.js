@@ -99,11 +99,11 @@ function renderNavButtons(category, pageNav) {
     Renders page navigation buttons for paginated results
     Parameters:
     - category (str) : specifies owners, properties, or companies
-    - pageNavObj (obj) : obj that has the pagination page data
+    - pageNavObj (obj) : obj that has the prev/next page cursors
     */
     // store pageNav attributes as variables
-    const prev = pageNav["prev_page"];
-    const next = pageNav["next_page"];
+    const prev = pageNav["prev_cursor"];
+    const next = pageNav["next_cursor"];
     
     // create wrapper for .page-btn elements and push onto html
     const pageBtnWrapper = $("<div></div>")
@@ -113,7 +113,7 @@ function renderNavButtons(category, pageNav) {
 
     // Int. Helper Functional
     function createBtn(pageId, text) {
-        // create dynamic page var
+        // create dynamic page var, an opaque cursor
         const page = `${pageId}`;
         // create btn element
         const btn = $("<button></button>")
@@ -138,7 +138,7 @@ function renderNavButtons(category, pageNav) {
 async function renderAllOwnersByPage(page) {
     // Renders lis with dynamic owner data
     // create dynamic url with page parameter
-    const urlPath =`/api/owners/${page}`;
+    const urlPath =`/api/owners?cursor=${encodeURIComponent(page)}`;
 
     // make GET request to urlPath
     const response = await axios.get(urlPath);
@@ -169,7 +169,7 @@ async function renderAllOwnersByPage(page) {
 async function renderAllPropertiesByPage(page) {
     // Renders lis with dynamic property data
     // create dynamic url with page parameter
-    const urlPath =`/api/properties/${page}`;
+    const urlPath =`/api/properties?cursor=${encodeURIComponent(page)}`;
 
     // make GET request to urlPath
     const response = await axios.get(urlPath);
@@ -199,7 +199,7 @@ async function renderAllPropertiesByPage(page) {
 async function renderAllCompaniesByPage(page) {
     // Renders lis with dynamic company data
     // create dynamic url with page parameter
-    const urlPath =`/api/companies/${page}`;
+    const urlPath =`/api/companies?cursor=${encodeURIComponent(page)}`;
 
     // make GET request to urlPath
     const response = await axios.get(urlPath);
@@ -250,7 +250,8 @@ async function renderListContainer() {
 
     // try renderFunc and show container
     try {
-        renderFunc(1);
+        // empty cursor is the first page
+        renderFunc('');
         $listCon.show();
     }
     catch(err) {
@@ -261,6 +262,37 @@ async function renderListContainer() {
 // #search-btn Click Event
 $("#search-btn").click(search);
 
+// #search-input Input Event, waits for a pause in typing before asking for suggestions
+let suggestTimer = undefined;
+$("#search-input").on("input", () => {
+    clearTimeout(suggestTimer);
+    suggestTimer = setTimeout(suggest, 150);
+});
+
+// #search-input Handler Function
+async function suggest() {
+    // fills the search bar's datalist with names starting with what's been typed
+    const searchVal = $("#search-input").val().trim();
+    const $suggestions = $("#search-suggestions");
+    if (!searchVal) {
+        $suggestions.empty();
+        return;
+    }
+    try {
+        const pathUrl = `/api/typeahead?q=${encodeURIComponent(searchVal.toUpperCase())}&limit=5`;
+        const response = await axios.get(pathUrl);
+        $suggestions.empty();
+        for (let category of ["owners", "companies", "properties"]) {
+            for (let match of response.data[category]) {
+                $suggestions.append($("<option></option>").attr("value", match["name"]));
+            }
+        }
+    }
+    catch(err) {
+        console.log(err);
+    }
+};
+
 // #search-btn Handler Function
 async function search(evt) {
     // prevent default button behavior
@@ -442,7 +474,8 @@ async function showOwnerInfo(evt) {
                     txt = `Property Count: ${owner["property_count"]}`;
                     break;
                 case 2:
-                    txt = `Company Name: ${owner["llc_name"]}`;
+                    // an owner can have several LLCs
+                    txt = `Company Name: ${owner["llc_names"].join(", ")}`;
                     break;
             }
             const p = $("<p></p>").text(txt);
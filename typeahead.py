@@ -0,0 +1,356 @@
+# Imports
+import gc
+import sys
+import time
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from sqlalchemy import func, select
+from modules import Owner, Company, OwnerCompany, Property, PropertyTransfer, db
+from generation import current_generation, GENERATION_CHECK_SECONDS
+
+# Autocomplete for the search bar, answered from memory. Each result type has a PrefixIndex: the names in one
+# UTF-8 blob and a sorted array of (name, word start) pairs, so a prefix is two binary searches and a short walk,
+# and a name is found from the start of any of its words, ex: 'VIRGINIA' finds '2117 VIRGINIA ST RENO NV 89501'.
+# Names added since the index was built go in a small side index, merged in once it grows past MERGE_SIZE.
+# The owner each result opens, a property's owner or an LLC's first owner, is kept next to its name, so a
+# keystroke never reads the database. A background thread loads the indexes at startup and, whenever the crawl
+# generation moves, adds the new rows and re-reads the owners of the properties moved (property_transfer) and
+# the LLCs linked since. It sorts and merges into new arrays and swaps them in at the end, searches carry on
+# against the old ones meanwhile.
+
+# Results per type when the request doesn't say, and the most it may ask for
+TYPEAHEAD_LIMIT = 8
+MAX_TYPEAHEAD_LIMIT = 50
+
+# Names waiting in the side index before they're merged into the sorted arrays
+MERGE_SIZE = 20000
+
+# Keys sorted at a time while loading, the rest wait in sorted runs of arrays
+RUN_SIZE = 500000
+
+# Rows read per query while loading
+LOAD_BATCH = 50000
+
+# Links and transfers re-read below the last one seen, rows committed out of id order by concurrent crawl
+# workers are still found
+CHANGE_WINDOW = 1000
+
+# Characters that start a new word after them
+WORD_BREAKS = b' ,-/&.'
+
+
+def word_starts(name):
+    """Byte offsets of the words of an upper-cased UTF-8 name, ex: b'SMITH, JOHN' -> [0, 7]."""
+    starts = [0]
+    for position in range(1, len(name)):
+        if name[position - 1] in WORD_BREAKS and name[position] not in WORD_BREAKS:
+            starts.append(position)
+    return starts
+
+
+@contextmanager
+def paused_gc():
+    """Turns the cyclic garbage collector off for a block, a load makes millions of tuples it would keep rescanning."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class KeyView:
+    """Sequence over the sorted keys of a PrefixIndex, for bisect."""
+
+    def __init__(self, index, key_names, key_starts):
+        self.index = index
+        self.key_names = key_names
+        self.key_starts = key_starts
+
+    def __len__(self):
+        return len(self.key_names)
+
+    def __getitem__(self, position):
+        return self.index.key(self.key_names[position], self.key_starts[position])
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index over the names of one result type.
+    Memory is the names' bytes plus 16 bytes per name and 6 bytes per word, no Python object per entry.
+    Names are only added by one thread at a time, searches may run in any number of others.
+    """
+
+    def __init__(self):
+        # Names, upper cased, end to end
+        self.blob = bytearray()
+        # Name number -> start of the name in blob, one more at the end
+        self.offsets = array('Q', [0])
+        # Name number -> row id, rows are added in id order so it's sorted
+        self.ids = array('I')
+        # Name number -> id of the owner the result opens, 0 when there's none
+        self.owner_ids = array('I')
+        # What searches read, replaced whole by publish(): the sorted keys, each the name key_names[i] from its
+        # byte key_starts[i], and the keys of names added since the last merge, as (key bytes, name number,
+        # word start), sorted
+        self.keys = (array('I'), array('H'), [])
+        # Keys of names added since the last publish(), and sorted (key_names, key_starts) runs spilled from a big load
+        self.added = []
+        self.runs = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name(self, number):
+        return bytes(self.blob[self.offsets[number]:self.offsets[number + 1]])
+
+    def key(self, number, start):
+        return bytes(self.blob[self.offsets[number] + start:self.offsets[number + 1]])
+
+    def add(self, rows):
+        """
+        Adds names, searches find them once publish() is called.
+
+        Parameters:
+        - rows (iterable) : (id, name, owner_id) tuples in id order, after the ids already added.
+        """
+        for id, name, owner_id in rows:
+            if not name:
+                continue
+            encoded = name.upper().encode('utf-8')
+            number = len(self.ids)
+            # Searches only read the names their keys point to, so appending here doesn't disturb them
+            self.blob += encoded
+            self.offsets.append(len(self.blob))
+            self.ids.append(id)
+            self.owner_ids.append(owner_id or 0)
+            for start in word_starts(encoded):
+                self.added.append((encoded[start:], number, start))
+            if len(self.added) >= RUN_SIZE:
+                self.spill()
+
+    def spill(self):
+        """Sorts the added keys into a run of arrays, so a big load never holds more than RUN_SIZE keys as objects."""
+        self.added.sort()
+        self.runs.append((array('I', (number for key, number, start in self.added)),
+                          array('H', (start for key, number, start in self.added))))
+        self.added = []
+
+    def run_keys(self, key_names, key_starts):
+        """(key, name number, word start) of a sorted run, one at a time."""
+        for number, start in zip(key_names, key_starts):
+            yield self.key(number, start), number, start
+
+    def publish(self, merge=None):
+        """
+        Makes the added names searchable. Their keys go in the side index, or when merge is set, the side index is
+        full or it's the first load, everything is merged into new sorted arrays in one pass. The new keys are built
+        apart from the ones searches read and swapped in at the end.
+
+        Parameters:
+        - merge (bool) : Merge into the sorted arrays, None decides by the side index's size.
+        """
+        if not self.added and not self.runs:
+            return
+        key_names, key_starts, pending = self.keys
+        if merge is None:
+            merge = not key_names or self.runs or len(pending) + len(self.added) >= MERGE_SIZE
+        if merge:
+            if self.added:
+                self.spill()
+            runs = [(key_names, key_starts)] + self.runs
+            key_names = array('I')
+            key_starts = array('H')
+            for key, number, start in heapq.merge(pending, *(self.run_keys(*run) for run in runs)):
+                key_names.append(number)
+                key_starts.append(start)
+            keys = (key_names, key_starts, [])
+        else:
+            keys = (key_names, key_starts, sorted(pending + self.added))
+        with self._lock:
+            self.keys = keys
+        self.added = []
+        self.runs = []
+
+    def set_owners(self, rows):
+        """
+        Updates the owner of names already added.
+
+        Parameters:
+        - rows (iterable) : (id, owner_id) tuples, ids that aren't in the index are skipped.
+        """
+        for id, owner_id in rows:
+            number = bisect_left(self.ids, id)
+            if number < len(self.ids) and self.ids[number] == id:
+                self.owner_ids[number] = owner_id or 0
+
+    def search(self, prefix, limit):
+        """
+        Names with a word starting with prefix, in alphabetical order of the matching word.
+
+        Parameters:
+        - prefix (str) : What's been typed, any case.
+        - limit (int) : Most results.
+
+        Return:
+        - matches (list) : [(id, name, owner_id), ...], owner_id None when there's none.
+        """
+        with self._lock:
+            key_names, key_starts, pending = self.keys
+        prefix = prefix.upper().encode('utf-8')
+        # UTF-8 never has a 0xFF byte, so every key starting with prefix sorts before prefix + 0xFF
+        end = prefix + b'\xff'
+        view = KeyView(self, key_names, key_starts)
+        low = bisect_left(view, prefix)
+        high = bisect_left(view, end, lo=low)
+        keys = ((view[position], key_names[position]) for position in range(low, high))
+        if pending:
+            first = bisect_left(pending, (prefix,))
+            last = bisect_left(pending, (end,), lo=first)
+            # Both are sorted, merged they give the side index's names their place among the others
+            keys = heapq.merge(keys, (pending[position][:2] for position in range(first, last)))
+        results = []
+        seen = set()
+        # A name with several words starting with prefix has several keys, read on until limit different names
+        for key, number in keys:
+            if number in seen:
+                continue
+            seen.add(number)
+            results.append((self.ids[number], self.name(number).decode('utf-8'), self.owner_ids[number] or None))
+            if len(results) == limit:
+                break
+        return results
+
+    def memory(self):
+        """Bytes held by the sorted arrays and names, the side index is counted roughly."""
+        key_names, key_starts, pending = self.keys
+        arrays = (self.offsets, self.ids, self.owner_ids, key_names, key_starts)
+        pending = sum(sys.getsizeof(key) + 72 for key, number, start in pending)
+        return len(self.blob) + sum(part.itemsize * len(part) for part in arrays) + pending
+
+
+class Typeahead:
+    """The PrefixIndex of each result type, kept in step with the database by refresh()."""
+
+    def __init__(self):
+        self.indexes = {'owners': PrefixIndex(), 'companies': PrefixIndex(), 'properties': PrefixIndex()}
+        # Result type -> largest id loaded
+        self.last_ids = {key: 0 for key in self.indexes}
+        # Largest OwnerCompany and PropertyTransfer ids seen, the owners of rows changed after them are re-read
+        self.last_link = None
+        self.last_transfer = None
+        self.generation = None
+        # One refresh at a time, searches don't wait for it
+        self._refresh_lock = threading.Lock()
+
+    def first_owner(self):
+        """Correlated subquery of an LLC's first owner, the smallest owner id linked to it."""
+        return (select(func.min(OwnerCompany.owner_id)).where(OwnerCompany.company_id == Company.id)
+                .scalar_subquery())
+
+    def sources(self, key, after):
+        """Query of the (id, name, owner_id) rows of a result type with an id after `after`, in id order."""
+        columns = {'owners': (Owner.id, Owner.full_name, Owner.id),
+                   'properties': (Property.id, Property.address, Property.owner_id),
+                   'companies': (Company.id, Company.llc_name, self.first_owner())}[key]
+        return db.session.query(*columns).filter(columns[0] > after).order_by(columns[0])
+
+    def changed_owners(self):
+        """
+        Owners of the properties moved and the LLCs linked since the last refresh, and a bit before.
+
+        Return:
+        - changes (dict) : {'properties': [(id, owner_id), ...], 'companies': [...]}
+        """
+        last_link = db.session.query(func.max(OwnerCompany.id)).scalar() or 0
+        last_transfer = db.session.query(func.max(PropertyTransfer.id)).scalar() or 0
+        changes = {'properties': [], 'companies': []}
+        # The first load read every row's owner as it is
+        if self.last_link is not None:
+            companies = (db.session.query(OwnerCompany.company_id)
+                         .filter(OwnerCompany.id > self.last_link - CHANGE_WINDOW).distinct().subquery())
+            changes['companies'] = (db.session.query(Company.id, self.first_owner())
+                                    .filter(Company.id.in_(select(companies.c.company_id))).all())
+        if self.last_transfer is not None:
+            properties = (db.session.query(PropertyTransfer.property_id)
+                          .filter(PropertyTransfer.id > self.last_transfer - CHANGE_WINDOW).distinct().subquery())
+            changes['properties'] = (db.session.query(Property.id, Property.owner_id)
+                                     .filter(Property.id.in_(select(properties.c.property_id))).all())
+        self.last_link, self.last_transfer = last_link, last_transfer
+        return changes
+
+    def refresh(self):
+        """
+        Loads the rows added since the last refresh and re-reads the owners that changed, only reads the database
+        when the crawl generation moved. Searches keep answering from the indexes as they were until it's done.
+        """
+        generation = current_generation()
+        if generation == self.generation:
+            return
+        with self._refresh_lock, paused_gc():
+            if generation == self.generation:
+                return
+            # Read first, so a link or transfer committed while the rows load is re-read next time
+            changes = self.changed_owners()
+            for key, index in self.indexes.items():
+                while True:
+                    rows = self.sources(key, self.last_ids[key]).limit(LOAD_BATCH).all()
+                    if not rows:
+                        break
+                    index.add(rows)
+                    self.last_ids[key] = rows[-1][0]
+                index.publish()
+                index.set_owners(changes.get(key, ()))
+            self.generation = generation
+
+    def search(self, q, limit=TYPEAHEAD_LIMIT):
+        """
+        Autocomplete matches of each type, from memory.
+
+        Parameters:
+        - q (str) : What's been typed.
+        - limit (int) : Most results per type.
+
+        Return:
+        - results (dict) : {'owners': [...], 'companies': [...], 'properties': [...]} of {id, name, owner_id}
+        """
+        q = q.strip()
+        limit = max(1, min(limit, MAX_TYPEAHEAD_LIMIT))
+        results = {}
+        for key, index in self.indexes.items():
+            rows = index.search(q, limit) if q else []
+            results[key] = [{"id": id, "name": name, "owner_id": owner_id} for id, name, owner_id in rows]
+        return results
+
+    def memory(self):
+        """Returns {result type: (names, bytes)}."""
+        return {key: (len(index), index.memory()) for key, index in self.indexes.items()}
+
+
+typeahead = Typeahead()
+
+
+def start_typeahead_build(app, interval=GENERATION_CHECK_SECONDS):
+    """
+    Loads the typeahead indexes in a background thread, so the app starts right away, then refreshes them from
+    the same thread every interval seconds.
+    """
+    def build():
+        with app.app_context():
+            while True:
+                try:
+                    typeahead.refresh()
+                except Exception as e:
+                    print(f"Exception from start_typeahead_build : {e}")
+                finally:
+                    # Ends the read transaction, the next refresh sees what was committed since
+                    db.session.remove()
+                time.sleep(interval)
+    thread = threading.Thread(target=build, daemon=True)
+    thread.start()
+    return thread